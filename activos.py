@@ -0,0 +1,220 @@
+"""
+Archivos estaticos con huella de contenido y precomprimidos
+construir() copia cada archivo de static/ a static/dist/ con un hash de su
+contenido en el nombre (css/style.css -> css/style.3f2a1b9c0d.css), junto a
+sus variantes .gz y .br (si esta instalado el paquete brotli), y escribe:
+- static/dist/activos.json: nombre original -> nombre con hash
+- static/dist/sw.js: el service worker con la lista de precache y el nombre
+  de cache derivados de esos hashes
+
+Como el nombre cambia cuando cambia el contenido, /activos/ se sirve con
+cache de un ano e immutable: una visita repetida no descarga nada. Ejecutar
+en cada despliegue (wsgi.py lo hace al arrancar):
+
+    python activos.py
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+from flask import Blueprint, request, send_from_directory, abort, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+ESTATICOS = os.path.join(RAIZ, 'static')
+DESTINO = os.path.join(ESTATICOS, 'dist')
+MANIFIESTO = os.path.join(DESTINO, 'activos.json')
+
+# Carpetas con archivos subidos por usuarios: no son parte del despliegue
+EXCLUIDOS = ('dist', 'uploads', 'fotos_entrega')
+# El service worker se sirve desde /sw.js con su propio nombre
+SERVICE_WORKER = 'sw.js'
+# Solo vale la pena comprimir texto; PNG/JPG ya vienen comprimidos
+COMPRIMIBLES = ('.css', '.js', '.json', '.svg', '.html', '.txt')
+# Se precachean en el service worker (los iconos grandes solo los usa el SO)
+PRECACHE = ('css/style.css', 'manifest.json', 'images/logo.png', 'images/icon-192.png', 'images/icon-72.png')
+
+UN_ANO = 365 * 24 * 3600
+
+activos_bp = Blueprint('activos', __name__)
+_manifiesto = {}
+
+
+def _con_hash(nombre, contenido):
+    base, extension = os.path.splitext(nombre)
+    return f'{base}.{hashlib.sha256(contenido).hexdigest()[:10]}{extension}'
+
+
+def _escribir(ruta, contenido):
+    """Escribe de forma atomica; si ya existe no hace nada (el nombre es el contenido)"""
+    if os.path.exists(ruta):
+        return
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = f'{ruta}.{os.getpid()}.tmp'
+    with open(temporal, 'wb') as f:
+        f.write(contenido)
+    os.replace(temporal, ruta)
+
+
+def _reemplazar(ruta, contenido):
+    """
+    Escribe de forma atomica solo si el contenido cambio: cache_http toma la
+    version del codigo de las fechas de modificacion, y reescribir sw.js o el
+    manifiesto en cada arranque invalidaria todos los ETag
+    """
+    try:
+        with open(ruta, 'rb') as f:
+            if f.read() == contenido:
+                return
+    except OSError:
+        pass
+    temporal = f'{ruta}.{os.getpid()}.tmp'
+    with open(temporal, 'wb') as f:
+        f.write(contenido)
+    os.replace(temporal, ruta)
+
+
+def _guardar(nombre, contenido, manifiesto):
+    hasheado = _con_hash(nombre, contenido)
+    ruta = os.path.join(DESTINO, hasheado)
+    _escribir(ruta, contenido)
+    if nombre.endswith(COMPRIMIBLES):
+        variantes = [('.gz', gzip.compress(contenido, 9, mtime=0))]
+        if brotli:
+            variantes.append(('.br', brotli.compress(contenido, quality=11)))
+        for sufijo, comprimido in variantes:
+            if len(comprimido) < len(contenido):
+                _escribir(ruta + sufijo, comprimido)
+    manifiesto[nombre] = hasheado
+
+
+def _archivos():
+    for directorio, carpetas, archivos in os.walk(ESTATICOS):
+        if directorio == ESTATICOS:
+            carpetas[:] = [c for c in carpetas if c not in EXCLUIDOS]
+        for archivo in sorted(archivos):
+            nombre = os.path.relpath(os.path.join(directorio, archivo), ESTATICOS).replace(os.sep, '/')
+            if nombre != SERVICE_WORKER:
+                yield nombre
+
+
+def _reescribir_urls(texto, manifiesto):
+    """Cambia /static/<nombre> por la URL con hash en archivos que referencian a otros"""
+    return re.sub(
+        r'/static/([\w./-]+)',
+        lambda m: f'/activos/{manifiesto[m.group(1)]}' if m.group(1) in manifiesto else m.group(0),
+        texto
+    )
+
+
+def _service_worker(manifiesto):
+    """sw.js con la lista de precache y un nombre de cache que cambia con los hashes"""
+    with open(os.path.join(ESTATICOS, SERVICE_WORKER), encoding='utf-8') as f:
+        codigo = f.read()
+    urls = [f'/activos/{manifiesto[n]}' for n in PRECACHE if n in manifiesto]
+    version = hashlib.sha256(json.dumps(urls).encode()).hexdigest()[:10]
+    codigo = re.sub(r"const CACHE_NAME = '[^']*';", f"const CACHE_NAME = 'happy-remesitas-{version}';", codigo, 1)
+    codigo = re.sub(r'const urlsToCache = \[[^\]]*\];',
+                    'const urlsToCache = ' + json.dumps(urls, indent=2) + ';', codigo, 1)
+    return codigo.encode('utf-8')
+
+
+def construir():
+    """
+    Genera static/dist a partir de static/. Idempotente y seguro con varios
+    procesos: cada archivo se escribe con un rename atomico, y sin cambios en
+    static/ no se toca ningun archivo.
+
+    Returns:
+        dict nombre original -> nombre con hash
+    """
+    manifiesto = {}
+    referenciadores = []
+    for nombre in _archivos():
+        with open(os.path.join(ESTATICOS, nombre), 'rb') as f:
+            contenido = f.read()
+        # manifest.json y el CSS apuntan a otros estaticos: se procesan al final
+        if nombre.endswith(('.json', '.css')) and b'/static/' in contenido:
+            referenciadores.append((nombre, contenido))
+        else:
+            _guardar(nombre, contenido, manifiesto)
+
+    for nombre, contenido in referenciadores:
+        _guardar(nombre, _reescribir_urls(contenido.decode('utf-8'), manifiesto).encode('utf-8'), manifiesto)
+
+    sw = _service_worker(manifiesto)
+    os.makedirs(DESTINO, exist_ok=True)
+    for ruta, contenido in ((os.path.join(DESTINO, SERVICE_WORKER), sw),
+                            (MANIFIESTO, json.dumps(manifiesto, indent=2, sort_keys=True).encode())):
+        _reemplazar(ruta, contenido)
+
+    logger.info(f"Activos estaticos: {len(manifiesto)} archivos"
+                f"{'' if brotli else ' (sin brotli)'}")
+    return manifiesto
+
+
+def cargar():
+    """Lee el manifiesto generado; sin manifiesto se usan los estaticos originales"""
+    global _manifiesto
+    try:
+        with open(MANIFIESTO, encoding='utf-8') as f:
+            _manifiesto = json.load(f)
+    except (OSError, ValueError):
+        _manifiesto = {}
+    return _manifiesto
+
+
+def url_activo(nombre):
+    """URL con hash de un estatico, o la de /static/ si no esta en el manifiesto"""
+    hasheado = _manifiesto.get(nombre)
+    if hasheado:
+        return url_for('activos.servir', nombre=hasheado)
+    return url_for('static', filename=nombre)
+
+
+def ruta_service_worker():
+    """(carpeta, archivo) del service worker generado, o el original si no se construyo"""
+    if _manifiesto and os.path.exists(os.path.join(DESTINO, SERVICE_WORKER)):
+        return DESTINO, SERVICE_WORKER
+    return ESTATICOS, SERVICE_WORKER
+
+
+@activos_bp.route('/activos/<path:nombre>')
+def servir(nombre):
+    """Estatico con hash: la variante precomprimida que acepte el cliente, cacheada un ano"""
+    if not os.path.isfile(os.path.join(DESTINO, nombre)):
+        abort(404)
+
+    archivo, codificacion = nombre, None
+    for sufijo, encoding in (('.br', 'br'), ('.gz', 'gzip')):
+        if encoding in request.accept_encodings and os.path.isfile(os.path.join(DESTINO, nombre + sufijo)):
+            archivo, codificacion = nombre + sufijo, encoding
+            break
+
+    respuesta = send_from_directory(
+        DESTINO, archivo,
+        mimetype=mimetypes.guess_type(nombre)[0] or 'application/octet-stream',
+        max_age=UN_ANO
+    )
+    if codificacion:
+        respuesta.headers['Content-Encoding'] = codificacion
+    respuesta.vary.add('Accept-Encoding')
+    respuesta.cache_control.public = True
+    respuesta.cache_control.immutable = True
+    return respuesta
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    manifiesto = construir()
+    for original, hasheado in sorted(manifiesto.items()):
+        print(f'{original} -> {hasheado}')
@@ -2,7 +2,19 @@ from flask import Flask, redirect, url_for, render_template, send_from_directory
 from flask_login import LoginManager, current_user
 from config import Config
 import os
-from models import db, Usuario, TasaCambio, Comision, Configuracion, Remesa
+from models import db, Usuario, TasaCambio, Comision, Configuracion, Remesa, asegurar_esquema
+from busqueda import crear_indice_busqueda
+from sincronizacion import crear_registro_bajas
+from cache_reportes import crear_versiones
+from archivo import migrar_autoincremento
+from idempotencia import campo_idempotencia
+import fotos
+import eventos
+from directorio import migrar_directorio
+from perfiles import migrar_perfiles
+from cache_http import condicional, version_landing
+import activos
+from compresion import Compresion
 
 login_manager = LoginManager()
 
@@ -10,6 +22,14 @@ def crear_app():
     app = Flask(__name__)
     app.config.from_object(Config)
 
+    # Comprimir HTML/JSON para conexiones moviles lentas
+    app.wsgi_app = Compresion(
+        app.wsgi_app,
+        nivel=app.config['COMPRESION_NIVEL'],
+        nivel_brotli=app.config['COMPRESION_NIVEL_BROTLI'],
+        minimo=app.config['COMPRESION_MINIMO']
+    )
+
     # Inicializar extensiones
     db.init_app(app)
     login_manager.init_app(app)
@@ -36,9 +56,26 @@ def crear_app():
     app.register_blueprint(publico_bp)
     app.register_blueprint(repartidor_bp)
     app.register_blueprint(revendedor_bp)
+    app.register_blueprint(activos.activos_bp)
+    app.register_blueprint(fotos.fotos_bp)
+    app.register_blueprint(eventos.eventos_bp)
+
+    # url_for('static', ...) en las plantillas apunta al estatico con hash si existe
+    activos.cargar()
+
+    def url_for_activos(endpoint, **values):
+        if endpoint == 'static' and list(values) == ['filename']:
+            return activos.url_activo(values['filename'])
+        return url_for(endpoint, **values)
+
+    app.jinja_env.globals['url_for'] = url_for_activos
+    app.jinja_env.globals['campo_idempotencia'] = campo_idempotencia
+    app.jinja_env.globals['url_foto'] = fotos.url_foto
+    app.jinja_env.globals['ultimo_evento'] = eventos.ultimo_evento
 
     # Ruta principal - Landing Page
     @app.route('/')
+    @condicional(version_landing, cache_control='public, max-age=300')
     def index():
         if current_user.is_authenticated:
             if current_user.es_admin():
@@ -54,20 +91,31 @@ def crear_app():
     # Service Worker desde la raiz (necesario para scope /)
     @app.route('/sw.js')
     def service_worker():
+        # El generado por activos.py trae la lista de precache con hashes
+        carpeta, archivo = activos.ruta_service_worker()
         response = make_response(
             send_from_directory(
-                os.path.join(app.root_path, 'static'),
-                'sw.js',
+                carpeta,
+                archivo,
                 mimetype='application/javascript'
             )
         )
         # Header especial para permitir scope /
         response.headers['Service-Worker-Allowed'] = '/'
+        # El navegador debe revisar siempre si hay una version nueva
+        response.headers['Cache-Control'] = 'no-cache'
         return response
 
     # Crear tablas y datos iniciales
     with app.app_context():
         db.create_all()
+        asegurar_esquema()
+        migrar_autoincremento()
+        crear_indice_busqueda()
+        crear_registro_bajas()
+        crear_versiones()
+        migrar_directorio()
+        migrar_perfiles()
         crear_datos_iniciales()
 
     return app
@@ -144,4 +192,8 @@ if __name__ == '__main__':
         from scheduler import iniciar_scheduler
         iniciar_scheduler(app)
 
+    import autocompletar
+    with app.app_context():
+        autocompletar.construir()
+
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,179 @@
+"""
+Archivo de remesas historicas (particion caliente/fria)
+Las remesas canceladas, o entregadas y pagadas, con mas de N dias se mueven
+con sus movimientos contables a remesas_archivo y
+movimientos_contables_archivo, conservando el id. Asi la tabla remesas que
+recorren el panel, las listas y las alertas solo tiene trabajo activo.
+
+Los movimientos de efectivo y los cargos de revendedor no se archivan: son
+los libros de saldos y la conciliacion los necesita completos.
+
+Las consultas de detalle, seguimiento y reportes leen a traves de los
+alias *Historica/*Historico (tabla activa UNION ALL archivo).
+
+Como las filas archivadas conservan su id, remesas y movimientos_contables
+son AUTOINCREMENT: SQLite no vuelve a usar un id aunque se borre la fila
+de id maximo. migrar_autoincremento() convierte las tablas de bases viejas.
+"""
+import logging
+import re
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, delete, func, or_, and_
+from sqlalchemy.orm import aliased
+from sqlalchemy.schema import CreateTable
+from models import db, Remesa, MovimientoContable, Configuracion, remesas_archivo, movimientos_contables_archivo
+
+logger = logging.getLogger(__name__)
+
+DIAS_ARCHIVO = 90
+TAMANO_LOTE = 500
+
+# Filas archivadas vistas como el modelo original (solo lectura)
+RemesaArchivada = aliased(Remesa, remesas_archivo, adapt_on_names=True)
+MovimientoArchivado = aliased(MovimientoContable, movimientos_contables_archivo, adapt_on_names=True)
+
+# Tabla activa + archivo, para consultas que abarcan todo el historial
+RemesaHistorica = aliased(
+    Remesa,
+    select(Remesa.__table__).union_all(select(remesas_archivo)).subquery('remesas_historicas'),
+    adapt_on_names=True
+)
+MovimientoHistorico = aliased(
+    MovimientoContable,
+    select(MovimientoContable.__table__).union_all(
+        select(movimientos_contables_archivo)
+    ).subquery('movimientos_historicos'),
+    adapt_on_names=True
+)
+
+
+def obtener_remesa(id):
+    """Remesa por id, buscando primero en la tabla activa y luego en el archivo"""
+    return db.session.get(Remesa, id) or db.session.execute(
+        select(RemesaArchivada).where(RemesaArchivada.id == id)
+    ).scalar()
+
+
+def buscar_por_codigo(codigo):
+    """Remesa por codigo, buscando primero en la tabla activa y luego en el archivo"""
+    return Remesa.query.filter_by(codigo=codigo).first() or db.session.execute(
+        select(RemesaArchivada).where(RemesaArchivada.codigo == codigo)
+    ).scalar()
+
+
+def _copiar(tabla_origen, tabla_destino, condicion):
+    columnas = [c.name for c in tabla_origen.columns]
+    db.session.execute(
+        insert(tabla_destino).from_select(columnas, select(*tabla_origen.columns).where(condicion))
+    )
+    db.session.execute(
+        delete(tabla_origen).where(condicion),
+        execution_options={'synchronize_session': False}
+    )
+
+
+def archivar_remesas(dias=None):
+    """
+    Mueve al archivo las remesas canceladas o entregadas y pagadas cuya
+    ultima actividad tiene mas de `dias` dias. Un commit por lote.
+
+    Returns:
+        Cantidad de remesas archivadas
+    """
+    if dias is None:
+        dias = int(Configuracion.obtener('archivo_dias', DIAS_ARCHIVO))
+    corte = datetime.utcnow() - timedelta(days=dias)
+
+    candidatas = select(Remesa.id).where(
+        or_(
+            Remesa.estado == 'cancelada',
+            and_(Remesa.estado == 'entregada', Remesa.facturada == True)
+        ),
+        func.coalesce(Remesa.fecha_entrega, Remesa.fecha_creacion) < corte
+    ).order_by(Remesa.id).limit(TAMANO_LOTE)
+
+    total = 0
+    while True:
+        ids = db.session.execute(candidatas).scalars().all()
+        if not ids:
+            break
+
+        _copiar(MovimientoContable.__table__, movimientos_contables_archivo, MovimientoContable.remesa_id.in_(ids))
+        _copiar(Remesa.__table__, remesas_archivo, Remesa.id.in_(ids))
+        db.session.commit()
+        total += len(ids)
+
+    if total:
+        logger.info(f"Archivadas {total} remesas anteriores a {corte:%Y-%m-%d}")
+    return total
+
+
+# === Migracion a AUTOINCREMENT ===
+
+def _con_autoincremento(cursor, tabla):
+    fila = cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (tabla,)).fetchone()
+    return fila is None or 'AUTOINCREMENT' in fila[0].upper()
+
+
+def _reconstruir(cursor, tabla, archivo):
+    """
+    Recrea la tabla con AUTOINCREMENT (procedimiento de SQLite para cambiar
+    una tabla: crear, copiar, borrar, renombrar) con sus indices y triggers,
+    y fija su secuencia por encima de todo id activo o archivado.
+    """
+    nombre = tabla.name
+    nueva = f'{nombre}_autoincremento'
+    anexos = [sql for (sql,) in cursor.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+        (nombre,)
+    )]
+    ddl = str(CreateTable(tabla).compile(dialect=db.engine.dialect))
+    cursor.execute(re.sub(rf'CREATE TABLE "?{nombre}"?', f'CREATE TABLE {nueva}', ddl, count=1))
+    columnas = ', '.join(c.name for c in tabla.columns)
+    cursor.execute(f'INSERT INTO {nueva} ({columnas}) SELECT {columnas} FROM {nombre}')
+    cursor.execute(f'DROP TABLE {nombre}')
+    cursor.execute(f'ALTER TABLE {nueva} RENAME TO {nombre}')
+    for sql in anexos:
+        cursor.execute(sql)
+    cursor.execute('DELETE FROM sqlite_sequence WHERE name = ?', (nombre,))
+    cursor.execute(
+        f'INSERT INTO sqlite_sequence (name, seq) SELECT ?, max('
+        f'  coalesce((SELECT max(id) FROM {nombre}), 0),'
+        f'  coalesce((SELECT max(id) FROM {archivo.name}), 0))',
+        (nombre,)
+    )
+
+
+def migrar_autoincremento():
+    """
+    Convierte remesas y movimientos_contables de bases creadas antes del
+    archivo a AUTOINCREMENT. Seguro de llamar en cada arranque: si ya lo
+    son no hace nada, y con varios procesos solo uno la hace (BEGIN IMMEDIATE).
+    Debe correr antes de crear los triggers de busqueda y versiones.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return
+
+    conexion = db.engine.raw_connection()
+    sqlite = conexion.driver_connection
+    nivel = sqlite.isolation_level
+    # Transaccion manual: el DDL tambien debe quedar dentro
+    sqlite.isolation_level = None
+    try:
+        cursor = sqlite.cursor()
+        for tabla, archivo in ((Remesa.__table__, remesas_archivo),
+                               (MovimientoContable.__table__, movimientos_contables_archivo)):
+            if _con_autoincremento(cursor, tabla.name):
+                continue
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                if not _con_autoincremento(cursor, tabla.name):
+                    _reconstruir(cursor, tabla, archivo)
+                    logger.info(f"Tabla {tabla.name} convertida a AUTOINCREMENT")
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+    finally:
+        sqlite.isolation_level = nivel
+        conexion.close()
@@ -0,0 +1,218 @@
+"""
+Indice en memoria para autocompletar remitentes y beneficiarios
+Cada proceso mantiene los contactos distintos (por nombre normalizado, sin
+acentos ni mayusculas) con sus datos mas recientes, y un arreglo ordenado
+con el nombre a partir de cada palabra ("jose perez", "perez"). Una
+busqueda es una busqueda binaria mas un recorrido corto, sin tocar la base.
+
+Se mantiene al dia sin coordinacion entre procesos:
+- registrar_remesa() agrega al instante lo creado en este proceso
+- cada SEGUNDOS_SINCRONIZACION se leen las remesas con id mayor al ultimo visto
+- cada SEGUNDOS_RECONSTRUCCION se reconstruye completo (ediciones y borrados)
+Una sola sincronizacion o reconstruccion a la vez por proceso: mientras
+corre, las demas busquedas usan el indice anterior.
+"""
+import bisect
+import heapq
+import logging
+import threading
+import time
+import unicodedata
+from sqlalchemy import select
+from models import db, Remesa
+from archivo import RemesaArchivada
+
+logger = logging.getLogger(__name__)
+
+SEGUNDOS_SINCRONIZACION = 30
+SEGUNDOS_RECONSTRUCCION = 3600
+
+
+def normalizar(texto):
+    """Minusculas, sin acentos y con espacios simples: "  José  PÉREZ" -> "jose perez" """
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    sin_acentos = ''.join(c for c in descompuesto if not unicodedata.combining(c))
+    return ' '.join(sin_acentos.lower().split())
+
+
+class _Indice:
+    """Contactos distintos de un tipo (remitentes o beneficiarios)"""
+
+    def __init__(self, campos):
+        self.campos = campos  # nombre, telefono[, direccion] en Remesa
+        self.contactos = {}   # clave -> {'nombre', 'telefono', ..., 'ultimo'}
+        self.entradas = []    # (nombre desde cada palabra, clave), ordenado
+        self.cache = {}       # prefijo corto -> resultado (se vacia al cambiar)
+
+    def _actualizar(self, remesa_id, valores):
+        """Actualiza el contacto; retorna su clave si es nuevo"""
+        clave = normalizar(valores[0])
+        if not clave:
+            return None
+        nuevo = clave not in self.contactos
+        contacto = self.contactos.setdefault(clave, {'ultimo': 0})
+        if remesa_id >= contacto['ultimo']:
+            contacto['ultimo'] = remesa_id
+            for campo, valor in zip(('nombre', 'telefono', 'direccion'), valores):
+                contacto[campo] = valor or ''
+        return clave if nuevo else None
+
+    @staticmethod
+    def _entradas_de(clave):
+        palabras = clave.split()
+        return [(' '.join(palabras[i:]), clave) for i in range(len(palabras))]
+
+    def agregar(self, filas):
+        """
+        Agrega filas (id, nombre, telefono[, direccion]).
+        Las entradas nuevas se suman al final y se reordena: timsort aprovecha
+        que el arreglo ya esta ordenado, asi un lote grande cuesta O(n).
+        Retorna el ultimo id visto.
+        """
+        remesa_id = 0
+        nuevas = []
+        for remesa_id, *valores in filas:
+            clave = self._actualizar(remesa_id, valores)
+            if clave:
+                nuevas.extend(self._entradas_de(clave))
+        if nuevas:
+            self.entradas.extend(nuevas)
+            self.entradas.sort()
+        self.cache.clear()
+        return remesa_id
+
+    def buscar(self, texto, limite):
+        prefijo = normalizar(texto)
+        if not prefijo:
+            return []
+        # Los prefijos cortos abarcan miles de contactos: se recuerdan hasta el proximo cambio
+        if len(prefijo) <= 3 and (prefijo, limite) in self.cache:
+            return self.cache[(prefijo, limite)]
+
+        inicio = bisect.bisect_left(self.entradas, (prefijo,))
+        fin = bisect.bisect_left(self.entradas, (prefijo + '\uffff',), inicio)
+        claves = {clave for _, clave in self.entradas[inicio:fin]}
+
+        # Los usados mas recientemente primero, entre todos los que coinciden
+        # (el orden alfabetico no dice nada de la recencia)
+        mejores = heapq.nlargest(limite, claves, key=lambda c: self.contactos[c]['ultimo'])
+        resultado = [
+            {k: v for k, v in self.contactos[c].items() if k != 'ultimo'}
+            for c in mejores
+        ]
+        if len(prefijo) <= 3:
+            self.cache[(prefijo, limite)] = resultado
+        return resultado
+
+
+_remitentes = _Indice(('remitente_nombre', 'remitente_telefono'))
+_beneficiarios = _Indice(('beneficiario_nombre', 'beneficiario_telefono', 'beneficiario_direccion'))
+_lock = threading.Lock()
+# Sincronizacion o reconstruccion en curso (no se toma junto con _lock mientras se lee la base)
+_actualizando = threading.Lock()
+_estado = {'construido': None, 'sincronizado': None, 'ultimo_id': 0}
+
+
+def _columnas(entidad, indice):
+    return [entidad.id] + [getattr(entidad, c) for c in indice.campos]
+
+
+def construir():
+    """Reconstruye ambos indices desde todas las remesas (archivo y activas)"""
+    with _actualizando:
+        _construir()
+
+
+def _construir():
+    global _remitentes, _beneficiarios
+    inicio = time.monotonic()
+    remitentes = _Indice(_remitentes.campos)
+    beneficiarios = _Indice(_beneficiarios.campos)
+    ultimo_id = 0
+
+    # Archivo primero y luego activas, cada una en orden de id: lo mas reciente gana
+    for entidad in (RemesaArchivada, Remesa):
+        for indice in (remitentes, beneficiarios):
+            filas = db.session.execute(
+                select(*_columnas(entidad, indice)).order_by(entidad.id)
+                .execution_options(yield_per=5000)
+            )
+            ultimo_id = max(ultimo_id, indice.agregar(filas))
+
+    ahora = time.monotonic()
+    with _lock:
+        _remitentes, _beneficiarios = remitentes, beneficiarios
+        _estado.update(construido=ahora, sincronizado=ahora, ultimo_id=ultimo_id)
+    logger.info(f"Indice de autocompletar: {len(remitentes.contactos)} remitentes, "
+                f"{len(beneficiarios.contactos)} beneficiarios en {ahora - inicio:.2f}s")
+
+
+def _sincronizar():
+    """Agrega las remesas creadas por otros procesos (id mayor al ultimo visto)"""
+    with _lock:
+        desde = _estado['ultimo_id']
+    filas = db.session.execute(
+        select(Remesa.id, *[getattr(Remesa, c) for c in _beneficiarios.campos],
+               *[getattr(Remesa, c) for c in _remitentes.campos])
+        .where(Remesa.id > desde).order_by(Remesa.id)
+    ).all()
+    n = len(_beneficiarios.campos)
+    with _lock:
+        _beneficiarios.agregar([(f[0], *f[1:n + 1]) for f in filas])
+        _remitentes.agregar([(f[0], *f[n + 1:]) for f in filas])
+        if filas:
+            _estado['ultimo_id'] = max(_estado['ultimo_id'], filas[-1][0])
+        _estado['sincronizado'] = time.monotonic()
+
+
+def _pendiente():
+    """Lo que falta para tener el indice al dia: 'construir', 'sincronizar' o None"""
+    ahora = time.monotonic()
+    if _estado['construido'] is None or ahora - _estado['construido'] > SEGUNDOS_RECONSTRUCCION:
+        return 'construir'
+    if ahora - _estado['sincronizado'] > SEGUNDOS_SINCRONIZACION:
+        return 'sincronizar'
+    return None
+
+
+def _al_dia():
+    if _pendiente() is None:
+        return
+    if _estado['construido'] is None:
+        # Sin indice no hay nada que mostrar: se espera a quien lo esta construyendo
+        _actualizando.acquire()
+    elif not _actualizando.acquire(blocking=False):
+        return  # Otra solicitud lo esta actualizando: se usa el indice actual
+    try:
+        # Se vuelve a mirar: pudo actualizarlo la solicitud que tenia el lock
+        pendiente = _pendiente()
+        if pendiente == 'construir':
+            _construir()
+        elif pendiente == 'sincronizar':
+            _sincronizar()
+    finally:
+        _actualizando.release()
+
+
+def registrar_remesa(remesa):
+    """Agrega al indice una remesa recien creada (llamar despues del commit)"""
+    if _estado['construido'] is None:
+        return  # Se incluira al construir
+    with _lock:
+        _remitentes.agregar([(remesa.id, *[getattr(remesa, c) for c in _remitentes.campos])])
+        _beneficiarios.agregar([(remesa.id, *[getattr(remesa, c) for c in _beneficiarios.campos])])
+        # ultimo_id no se adelanta: puede haber ids menores de otros procesos sin leer
+
+
+def buscar_remitentes(texto, limite=10):
+    """Remitentes cuyo nombre (o alguna palabra) empieza por texto"""
+    _al_dia()
+    with _lock:
+        return _remitentes.buscar(texto, limite)
+
+
+def buscar_beneficiarios(texto, limite=10):
+    """Beneficiarios cuyo nombre (o alguna palabra) empieza por texto"""
+    _al_dia()
+    with _lock:
+        return _beneficiarios.buscar(texto, limite)
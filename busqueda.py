@@ -0,0 +1,137 @@
+"""
+Busqueda de texto completo sobre remesas (SQLite FTS5)
+remesas_fts es una tabla FTS5 de contenido externo sobre remesas: guarda
+solo el indice invertido y la mantienen al dia tres triggers, asi que
+cualquier INSERT/UPDATE/DELETE (ORM, bulk o SQL directo) queda indexado.
+El tokenizador unicode61 con remove_diacritics ignora acentos y
+mayusculas: "pena" encuentra "Peña" y "jose" encuentra "José".
+
+Si la base no es SQLite o no tiene FTS5 se usa la busqueda con LIKE.
+"""
+import logging
+import re
+from sqlalchemy import text, or_, false, Integer
+from sqlalchemy.exc import OperationalError
+from models import db, Remesa
+
+logger = logging.getLogger(__name__)
+
+COLUMNAS = (
+    'codigo', 'remitente_nombre', 'remitente_telefono',
+    'beneficiario_nombre', 'beneficiario_telefono', 'beneficiario_direccion', 'notas'
+)
+# Peso de cada columna en el ranking bm25 (mismo orden que COLUMNAS)
+PESOS = (10.0, 5.0, 3.0, 5.0, 3.0, 1.0, 1.0)
+
+_disponible = None
+
+
+def _crear_tabla(conexion):
+    columnas = ', '.join(COLUMNAS)
+    # remove_diacritics 2 (SQLite >= 3.27) tambien pliega diacriticos combinados
+    for tokenizador in ('unicode61 remove_diacritics 2', 'unicode61 remove_diacritics 1'):
+        try:
+            conexion.execute(text(
+                f"CREATE VIRTUAL TABLE remesas_fts USING fts5({columnas}, "
+                f"content='remesas', content_rowid='id', tokenize='{tokenizador}')"
+            ))
+            return
+        except OperationalError:
+            if tokenizador.endswith('1'):
+                raise
+
+
+def crear_indice_busqueda():
+    """
+    Crea la tabla FTS5 y sus triggers si no existen, y la llena con las
+    remesas actuales la primera vez. Seguro de llamar en cada arranque.
+    """
+    global _disponible
+    if db.engine.dialect.name != 'sqlite':
+        _disponible = False
+        return
+
+    columnas = ', '.join(COLUMNAS)
+    nuevos = ', '.join(f'new.{c}' for c in COLUMNAS)
+    viejos = ', '.join(f'old.{c}' for c in COLUMNAS)
+
+    try:
+        with db.engine.begin() as conexion:
+            existe = conexion.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'remesas_fts'"
+            )).scalar()
+            if not existe:
+                _crear_tabla(conexion)
+
+            conexion.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS remesas_fts_insertar AFTER INSERT ON remesas BEGIN
+                    INSERT INTO remesas_fts(rowid, {columnas}) VALUES (new.id, {nuevos});
+                END"""))
+            conexion.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS remesas_fts_eliminar AFTER DELETE ON remesas BEGIN
+                    INSERT INTO remesas_fts(remesas_fts, rowid, {columnas}) VALUES ('delete', old.id, {viejos});
+                END"""))
+            # Solo cuando cambian columnas indexadas (no en cambios de estado)
+            conexion.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS remesas_fts_actualizar AFTER UPDATE OF {columnas} ON remesas BEGIN
+                    INSERT INTO remesas_fts(remesas_fts, rowid, {columnas}) VALUES ('delete', old.id, {viejos});
+                    INSERT INTO remesas_fts(rowid, {columnas}) VALUES (new.id, {nuevos});
+                END"""))
+
+            if not existe:
+                conexion.execute(text("INSERT INTO remesas_fts(remesas_fts) VALUES ('rebuild')"))
+                logger.info("Indice de busqueda de remesas creado")
+        _disponible = True
+    except OperationalError as e:
+        # SQLite compilado sin FTS5
+        logger.warning(f"Busqueda FTS5 no disponible, se usara LIKE: {e}")
+        _disponible = False
+
+
+def _expresion_fts(texto):
+    """
+    Convierte lo que escribe el usuario en una consulta FTS5 segura:
+    cada palabra entre comillas y como prefijo, todas obligatorias.
+    "jose pe" -> "jose"* "pe"*
+    """
+    palabras = re.findall(r'\w+', texto)
+    # "REM" esta en todos los codigos: no filtra nada y obliga a recorrer todo el indice
+    if len(palabras) > 1 and palabras[0].lower() == 'rem':
+        palabras = palabras[1:]
+    return ' '.join('"{}"*'.format(p.replace('"', '""')) for p in palabras)
+
+
+def filtrar_remesas(query, texto):
+    """
+    Aplica una busqueda de texto a una consulta de Remesa.
+    Con FTS5 une todas las coincidencias a remesas, ordenadas por relevancia
+    y las mas nuevas primero; sin FTS5 filtra con LIKE. Los demas filtros y
+    la paginacion van en la misma consulta, sobre todas las coincidencias.
+    Un texto sin palabras (solo signos) no encuentra nada.
+
+    Returns:
+        (query, ordenada) - ordenada indica si ya tiene ORDER BY por relevancia
+    """
+    expresion = _expresion_fts(texto)
+    if not expresion:
+        return query.filter(false()), False
+
+    if not _disponible:
+        return query.filter(or_(
+            Remesa.codigo.contains(texto),
+            Remesa.remitente_nombre.contains(texto),
+            Remesa.beneficiario_nombre.contains(texto),
+            Remesa.remitente_telefono.contains(texto),
+            Remesa.beneficiario_telefono.contains(texto)
+        )), False
+
+    pesos = ', '.join(str(p) for p in PESOS)
+    coincidencias = text(
+        f"SELECT rowid AS id, bm25(remesas_fts, {pesos}) AS rango FROM remesas_fts"
+        f" WHERE remesas_fts MATCH :expresion"
+    ).bindparams(expresion=expresion).columns(id=Integer, rango=db.Float).subquery('coincidencias')
+
+    query = query.join(coincidencias, coincidencias.c.id == Remesa.id).order_by(
+        coincidencias.c.rango, Remesa.id.desc()
+    )
+    return query, True
@@ -0,0 +1,168 @@
+"""
+Cache HTTP condicional (ETag / If-None-Match)
+Los repartidores recargan sus paginas muchas veces con datos moviles lentos.
+Cada vista cacheable declara una funcion de version: una consulta barata
+(p. ej. cantidad y max(actualizado_en) de las filas que muestra). El ETag se
+arma con esa version, el usuario y la version del codigo; si coincide con el
+que manda el navegador se responde 304 sin ejecutar la vista ni la plantilla.
+
+Se lleva la cuenta por endpoint de respuestas completas, 304 y bytes
+ahorrados (ver estadisticas()).
+"""
+import hashlib
+import os
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from functools import wraps
+from flask import request, session, make_response
+from flask_login import current_user
+from sqlalchemy import select, func, or_, and_
+from models import db, Remesa, TasaCambio
+from archivo import RemesaArchivada
+
+
+def _version_codigo():
+    """
+    Fecha de modificacion mas reciente de plantillas, codigo y estaticos:
+    cambia con cada despliegue (las paginas enlazan los estaticos con hash).
+    """
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    ultima = 0
+    for carpeta in ('templates', 'routes', 'static', '.'):
+        for directorio, carpetas, archivos in os.walk(os.path.join(raiz, carpeta)):
+            ultima = max([ultima] + [
+                os.path.getmtime(os.path.join(directorio, a))
+                for a in archivos if a.endswith(('.html', '.py', '.css', '.js', '.json'))
+            ])
+            # Solo los modulos de la raiz; en static no se recorren las fotos subidas
+            carpetas[:] = [] if carpeta == '.' else [c for c in carpetas if c not in ('uploads', 'fotos_entrega')]
+    return str(int(ultima))
+
+
+VERSION_CODIGO = _version_codigo()
+
+# Tamanos de respuestas enviadas por ETag, para estimar lo ahorrado con cada 304
+MAX_TAMANOS = 2000
+_tamanos = OrderedDict()
+_estadisticas = {}
+_lock = threading.Lock()
+
+
+def _etag(endpoint, version):
+    usuario = current_user.get_id() if current_user.is_authenticated else ''
+    clave = f'{VERSION_CODIGO}|{endpoint}|{usuario}|{version}'
+    return hashlib.sha1(clave.encode()).hexdigest()[:20]
+
+
+def _contar(endpoint, etag, tamano=None):
+    """Registra una respuesta completa (con su tamano) o un 304 (tamano None)"""
+    with _lock:
+        datos = _estadisticas.setdefault(endpoint, {
+            'completas': 0, 'no_modificadas': 0, 'bytes_enviados': 0, 'bytes_ahorrados': 0
+        })
+        if tamano is not None:
+            datos['completas'] += 1
+            datos['bytes_enviados'] += tamano
+            _tamanos[etag] = tamano
+            _tamanos.move_to_end(etag)
+            if len(_tamanos) > MAX_TAMANOS:
+                _tamanos.popitem(last=False)
+        else:
+            datos['no_modificadas'] += 1
+            # Si la respuesta la envio otro proceso se estima con el promedio del endpoint
+            promedio = datos['bytes_enviados'] // datos['completas'] if datos['completas'] else 0
+            datos['bytes_ahorrados'] += _tamanos.get(etag, promedio)
+
+
+def estadisticas():
+    """Contadores por endpoint de este proceso"""
+    with _lock:
+        return {endpoint: dict(datos) for endpoint, datos in _estadisticas.items()}
+
+
+def condicional(version, cache_control='private, no-cache'):
+    """
+    Decorador para vistas GET con ETag.
+
+    Args:
+        version: funcion con los mismos argumentos de la vista que retorna
+                 algo que cambia cuando cambia la pagina, o None para no cachear
+        cache_control: valor de Cache-Control. 'private, no-cache' deja que el
+                       navegador guarde la pagina pero la revalide siempre.
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            # Con mensajes flash pendientes la pagina no es la misma que la guardada
+            if request.method != 'GET' or session.get('_flashes'):
+                return vista(*args, **kwargs)
+            valor = version(*args, **kwargs)
+            if valor is None:
+                return vista(*args, **kwargs)
+
+            etag = _etag(request.endpoint, valor)
+            # Comparacion debil: compresion.py entrega el ETag como W/"..."
+            if request.if_none_match.contains_weak(etag):
+                respuesta = make_response('', 304)
+                respuesta.set_etag(etag)
+                respuesta.headers['Cache-Control'] = cache_control
+                _contar(request.endpoint, etag)
+                return respuesta
+
+            respuesta = make_response(vista(*args, **kwargs))
+            if respuesta.status_code == 200:
+                respuesta.set_etag(etag)
+                respuesta.headers['Cache-Control'] = cache_control
+                if 'public' in cache_control:
+                    # La misma URL puede redirigir a usuarios con sesion
+                    respuesta.vary.add('Cookie')
+                _contar(request.endpoint, etag, respuesta.calculate_content_length() or 0)
+            return respuesta
+        return envoltura
+    return decorador
+
+
+# === Versiones de las paginas cacheadas ===
+
+def _sello(*condiciones):
+    """Cantidad, id maximo y ultima escritura de las remesas que cumplen las condiciones"""
+    return tuple(db.session.execute(
+        select(func.count(Remesa.id), func.max(Remesa.id), func.max(Remesa.actualizado_en))
+        .where(*condiciones)
+    ).one())
+
+
+def version_repartidor(*args, **kwargs):
+    """
+    Remesas activas del repartidor y las entregadas hoy (panel y mis entregas).
+    Una remesa que sale del conjunto cambia la cantidad; una que entra o
+    cambia, la ultima escritura. La fecha cambia la version a medianoche y
+    los saldos (ya cargados con el usuario) cambian con cada movimiento de efectivo.
+    """
+    hoy = datetime.now().date()
+    return _sello(
+        Remesa.repartidor_id == current_user.id,
+        or_(
+            Remesa.estado.in_(['pendiente', 'en_proceso']),
+            and_(Remesa.estado == 'entregada', func.date(Remesa.fecha_entrega) == hoy)
+        )
+    ) + (hoy, current_user.saldo_usd, current_user.saldo_cup)
+
+
+def version_landing():
+    """La landing solo cambia con la tasa; con sesion iniciada redirige"""
+    if current_user.is_authenticated:
+        return None
+    return TasaCambio.obtener_tasa_actual()
+
+
+def version_remesa(id):
+    """Ultima escritura de una remesa (activa o archivada)"""
+    fila = db.session.execute(
+        select(Remesa.id, Remesa.actualizado_en, Remesa.estado).where(Remesa.id == id)
+    ).first() or db.session.execute(
+        select(RemesaArchivada.id, RemesaArchivada.actualizado_en, RemesaArchivada.estado)
+        .where(RemesaArchivada.id == id)
+    ).first()
+    return tuple(fila) if fila else None
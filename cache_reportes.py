@@ -0,0 +1,192 @@
+"""
+Cache de reportes por rango de fechas
+Balance, ingresos, pagos y repartidores recalculaban todo en cada visita,
+aunque el rango sea de meses ya cerrados que no cambian.
+
+Cada escritura en remesas, movimientos_contables o pagos_revendedor suma 1
+a versiones_datos en el dia de las fechas que toca (creacion y facturacion
+de la remesa, fecha del movimiento o del pago; antes y despues del cambio).
+Lo hacen triggers de SQLite, asi cualquier INSERT/UPDATE/DELETE (ORM, bulk,
+importacion, archivo) queda contado. La version de un rango es la suma de
+sus dias: solo crece, y crece si y solo si algo del rango cambio.
+
+Las funciones decoradas con @cacheado(reporte) reciben (desde, hasta) y
+devuelven datos planos serializables a JSON. El resultado se guarda en
+cache_reportes con la version del rango y se sirve mientras la version no
+cambie: ver un trimestre pasado lee una vez las tablas y despues solo la
+suma de ~90 filas de versiones_datos. Los rangos cerrados (terminan antes
+de hoy) se guardan para siempre; los que incluyen hoy se borran al dia.
+
+Como la tabla esta en la base, la comparten todos los procesos; dentro de
+un proceso los calculos simultaneos se unen con calculo_compartido.
+Si la base no es SQLite no hay triggers y los reportes se calculan siempre.
+"""
+import json
+import logging
+from datetime import datetime, date, timedelta
+from functools import wraps
+from sqlalchemy import select, delete, func, text
+from sqlalchemy.dialects.sqlite import insert as insert_sqlite
+from sqlalchemy.exc import OperationalError
+from models import db, VersionDatos, CacheReporte
+import calculo_compartido
+
+logger = logging.getLogger(__name__)
+
+# Columnas de fecha que ubican cada fila en los reportes
+FECHAS = {
+    'remesas': ('fecha_creacion', 'fecha_facturacion'),
+    'movimientos_contables': ('fecha',),
+    'pagos_revendedor': ('fecha',),
+}
+# Los rangos que incluyen hoy se recalculan con cada escritura; sus filas viejas se borran
+RETENCION_ABIERTOS = timedelta(days=1)
+
+_disponible = None
+
+
+def _trigger(tabla, evento, filas):
+    """Trigger que suma 1 a versiones_datos en cada dia (sin repetir) de las fechas de la fila"""
+    dias = ' UNION '.join(f'SELECT date({fila}.{columna}) AS dia'
+                          for fila in filas for columna in FECHAS[tabla])
+    return f"""
+        CREATE TRIGGER IF NOT EXISTS versiones_{tabla}_{evento.lower()} AFTER {evento} ON {tabla} BEGIN
+            INSERT INTO versiones_datos(dia, version)
+            SELECT dia, 1 FROM ({dias}) WHERE dia IS NOT NULL
+            ON CONFLICT(dia) DO UPDATE SET version = version + 1;
+        END"""
+
+
+def crear_versiones():
+    """Crea los triggers que llenan versiones_datos. Seguro de llamar en cada arranque."""
+    global _disponible
+    if db.engine.dialect.name != 'sqlite':
+        _disponible = False
+        return
+
+    try:
+        with db.engine.begin() as conexion:
+            for tabla in FECHAS:
+                conexion.execute(text(_trigger(tabla, 'INSERT', ['new'])))
+                conexion.execute(text(_trigger(tabla, 'UPDATE', ['old', 'new'])))
+                conexion.execute(text(_trigger(tabla, 'DELETE', ['old'])))
+        _disponible = True
+    except OperationalError as e:
+        logger.warning(f"Versiones de datos no disponibles, los reportes no se guardaran: {e}")
+        _disponible = False
+
+
+# === Version y serializacion ===
+
+def _dia(valor):
+    return datetime.fromisoformat(valor).date() if valor else None
+
+
+def version_rango(desde='', hasta=''):
+    """Suma de las versiones de los dias del rango ('' = sin limite)"""
+    consulta = select(func.coalesce(func.sum(VersionDatos.version), 0))
+    if desde:
+        consulta = consulta.where(VersionDatos.dia >= _dia(desde))
+    if hasta:
+        consulta = consulta.where(VersionDatos.dia <= _dia(hasta))
+    return db.session.execute(consulta).scalar()
+
+
+def _a_json(valor):
+    if isinstance(valor, (datetime, date)):
+        return {'__fecha__': valor.isoformat()}
+    raise TypeError(f'{type(valor).__name__} no se puede guardar en el cache de reportes')
+
+
+def _de_json(objeto):
+    if '__fecha__' in objeto:
+        return datetime.fromisoformat(objeto['__fecha__'])
+    return objeto
+
+
+def _leer(texto):
+    return json.loads(texto, object_hook=_de_json)
+
+
+# === Cache ===
+
+def _guardar(reporte, desde, hasta, version, texto):
+    """Guarda el resultado; una version mas vieja (calculo lento de otro proceso) no pisa una nueva"""
+    cerrado = bool(hasta) and _dia(hasta) < datetime.utcnow().date()
+    valores = {'reporte': reporte, 'desde': desde, 'hasta': hasta, 'version': version,
+               'cerrado': cerrado, 'datos': texto, 'creado': datetime.utcnow()}
+    tabla = CacheReporte.__table__
+    sentencia = insert_sqlite(tabla).values(**valores).on_conflict_do_update(
+        index_elements=['reporte', 'desde', 'hasta'],
+        set_={c: valores[c] for c in ('version', 'cerrado', 'datos', 'creado')},
+        where=tabla.c.version <= version
+    )
+    try:
+        with db.engine.begin() as conexion:
+            conexion.execute(sentencia)
+    except OperationalError as e:
+        # Base ocupada: el reporte se muestra igual y se guardara en la proxima visita
+        logger.warning(f"No se pudo guardar el reporte {reporte} {desde}..{hasta}: {e}")
+
+
+def disponible():
+    """True si los reportes se guardan (SQLite con los triggers de versiones)"""
+    return bool(_disponible)
+
+
+def _buscar(reporte, desde, hasta, version=None):
+    """Datos guardados del reporte con esa version (None: la que haya), o None"""
+    guardado = db.session.execute(
+        select(CacheReporte.version, CacheReporte.datos).where(
+            CacheReporte.reporte == reporte,
+            CacheReporte.desde == desde,
+            CacheReporte.hasta == hasta
+        )
+    ).first()
+    if guardado and (version is None or guardado.version == version):
+        return _leer(guardado.datos)
+    return None
+
+
+def cacheado(reporte):
+    """
+    Decorador para funciones (desde, hasta) -> datos planos de un reporte.
+    La funcion decorada tiene ademas .reporte y .guardado(desde, hasta,
+    vigente=True), que devuelve lo guardado sin calcular (o None).
+    """
+    def decorador(funcion):
+        @wraps(funcion)
+        def envoltura(desde='', hasta=''):
+            if not _disponible:
+                return funcion(desde, hasta)
+
+            version = version_rango(desde, hasta)
+            datos = _buscar(reporte, desde, hasta, version)
+            if datos is not None:
+                return datos
+
+            def calcular():
+                texto = json.dumps(funcion(desde, hasta), default=_a_json)
+                _guardar(reporte, desde, hasta, version, texto)
+                return _leer(texto)
+            return calculo_compartido.una_vez((reporte, desde, hasta, version), calcular)
+
+        def guardado(desde='', hasta='', vigente=True):
+            if not _disponible:
+                return None
+            return _buscar(reporte, desde, hasta, version_rango(desde, hasta) if vigente else None)
+
+        envoltura.reporte = reporte
+        envoltura.guardado = guardado
+        return envoltura
+    return decorador
+
+
+def limpiar_cache():
+    """Borra los reportes de rangos que incluian hoy, ya reemplazados. Returns: cantidad borrada"""
+    resultado = db.session.execute(delete(CacheReporte).where(
+        CacheReporte.cerrado.is_(False),
+        CacheReporte.creado < datetime.utcnow() - RETENCION_ABIERTOS
+    ))
+    db.session.commit()
+    return resultado.rowcount
@@ -0,0 +1,124 @@
+"""
+Calculos compartidos (single-flight) para las paginas con agregados caros
+Cuando varios admins abren el dashboard, el balance o los revendedores al
+mismo tiempo (o el feed en vivo los hace recargar a todos juntos), cada
+solicitud calculaba los mismos COUNT/SUM por su cuenta.
+
+Las funciones decoradas con @compartido se identifican por (funcion,
+argumentos, version de los datos). Si ya hay un calculo en curso con esa
+clave, las demas solicitudes esperan y usan su resultado; el resultado se
+reutiliza durante TTL segundos. La version (max id y ultima escritura de las
+remesas, por indices) cambia con cada escritura, asi que nunca se sirve un
+resultado anterior a un cambio; el TTL corto acota lo que no detecta (p. ej.
+un borrado que no es el ultimo id).
+
+Es por proceso: con N workers el costo maximo es N calculos por clave, no
+uno por visitante. El resultado se comparte entre hilos: debe ser de datos
+planos (numeros, dicts, filas), nunca objetos del ORM, y no modificarse.
+"""
+import threading
+import time
+from functools import wraps
+from sqlalchemy import select, func
+from models import db, Remesa
+
+TTL = 10
+# Si el calculo en curso tarda mas que esto, el que espera calcula por su cuenta
+ESPERA_MAXIMA = 30
+MAX_ENTRADAS = 200
+
+_lock = threading.Lock()
+_vuelos = {}
+_estadisticas = {'calculados': 0, 'compartidos': 0, 'en_cache': 0}
+
+
+class _Vuelo:
+    """Un calculo en curso o terminado"""
+
+    def __init__(self):
+        self.listo = threading.Event()
+        self.resultado = None
+        self.error = None
+        self.expira = None
+
+
+def version_remesas():
+    """Cambia con cada remesa nueva o modificada (dos max() por indice)"""
+    # En subconsultas separadas: con dos max() en el mismo SELECT SQLite recorre la tabla
+    return tuple(db.session.execute(select(
+        select(func.max(Remesa.id)).scalar_subquery(),
+        select(func.max(Remesa.actualizado_en)).scalar_subquery()
+    )).one())
+
+
+def _purgar(ahora):
+    for clave in [c for c, v in _vuelos.items() if v.expira is not None and v.expira <= ahora]:
+        del _vuelos[clave]
+    if len(_vuelos) > MAX_ENTRADAS:
+        terminados = sorted((v.expira, c) for c, v in _vuelos.items() if v.expira is not None)
+        for _, clave in terminados[:len(_vuelos) - MAX_ENTRADAS]:
+            del _vuelos[clave]
+
+
+def una_vez(clave, calcular, ttl=TTL):
+    """
+    Ejecuta calcular() una sola vez por clave: las llamadas simultaneas con la
+    misma clave esperan y reciben el mismo resultado, y las que llegan dentro
+    de ttl segundos lo reutilizan. La clave debe incluir la version de los datos.
+    """
+    ahora = time.monotonic()
+    with _lock:
+        vuelo = _vuelos.get(clave)
+        if vuelo is not None and vuelo.expira is not None and vuelo.expira <= ahora:
+            vuelo = None
+        propio = vuelo is None
+        if propio:
+            _purgar(ahora)
+            vuelo = _vuelos[clave] = _Vuelo()
+
+    if not propio:
+        en_curso = not vuelo.listo.is_set()
+        if vuelo.listo.wait(ESPERA_MAXIMA) and vuelo.error is None:
+            with _lock:
+                _estadisticas['compartidos' if en_curso else 'en_cache'] += 1
+            return vuelo.resultado
+        # El calculo original fallo o no termina: se calcula aparte
+        return calcular()
+
+    try:
+        vuelo.resultado = calcular()
+    except BaseException as e:
+        vuelo.error = e
+        with _lock:
+            if _vuelos.get(clave) is vuelo:
+                del _vuelos[clave]
+        raise
+    finally:
+        vuelo.expira = time.monotonic() + ttl
+        vuelo.listo.set()
+    with _lock:
+        _estadisticas['calculados'] += 1
+    return vuelo.resultado
+
+
+def compartido(version=version_remesas, ttl=TTL):
+    """
+    Decorador para funciones que calculan agregados.
+
+    Args:
+        version: funcion sin argumentos que cambia cuando cambian los datos
+        ttl: segundos que se reutiliza un resultado terminado
+    """
+    def decorador(funcion):
+        @wraps(funcion)
+        def envoltura(*args):
+            clave = (funcion.__module__, funcion.__qualname__, args, version())
+            return una_vez(clave, lambda: funcion(*args), ttl)
+        return envoltura
+    return decorador
+
+
+def estadisticas():
+    """Calculos hechos, compartidos con uno en curso y servidos de los ya terminados (este proceso)"""
+    with _lock:
+        return dict(_estadisticas)
@@ -0,0 +1,219 @@
+"""
+Compresion de respuestas (middleware WSGI)
+Comprime con brotli (si esta instalado el paquete brotli) o gzip las
+respuestas de texto (HTML, JSON, CSS, JS, CSV) que el cliente acepta
+comprimidas. Las listas y paneles bajan de 5 a 10 veces en la red, que es lo
+que importa con datos moviles 2G/3G.
+
+- Respuestas chicas (menos de `minimo` bytes) se envian tal cual
+- Respuestas que ya traen Content-Encoding (estaticos precomprimidos de
+  activos.py, exportaciones) o Cache-Control: no-transform no se tocan
+- Respuestas en streaming (sin Content-Length) se comprimen por bloques y
+  se vacia el compresor cada VACIAR_CADA bytes, asi el cliente recibe los
+  datos a medida que salen
+- El ETag pasa a debil (W/"..."): el cuerpo comprimido no es identico byte
+  a byte, pero la pagina es la misma y los 304 siguen funcionando
+
+Benchmark de bytes y CPU por respuesta, con la base configurada:
+
+    python compresion.py /remesas /dashboard /api/listar-remitentes
+"""
+import itertools
+import zlib
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TIPOS = (
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/json', 'application/javascript', 'application/manifest+json',
+    'image/svg+xml'
+)
+SIN_CUERPO = ('204', '304')
+# En streaming se vacia el compresor cada tantos bytes de entrada: vaciar por
+# cada bloque chico (una linea de CSV) casi anula la compresion
+VACIAR_CADA = 8192
+
+
+class _Compresor:
+    """Interfaz comun para gzip (zlib) y brotli"""
+
+    def __init__(self, codificacion, nivel):
+        self.codificacion = codificacion
+        if codificacion == 'br':
+            self._br = brotli.Compressor(quality=nivel)
+        else:
+            self._gz = zlib.compressobj(nivel, zlib.DEFLATED, 31)  # wbits=31: cabecera gzip
+
+    def comprimir(self, datos):
+        return self._br.process(datos) if self.codificacion == 'br' else self._gz.compress(datos)
+
+    def vaciar(self):
+        """Emite lo pendiente sin cerrar el flujo (para streaming)"""
+        return self._br.flush() if self.codificacion == 'br' else self._gz.flush(zlib.Z_SYNC_FLUSH)
+
+    def terminar(self):
+        return self._br.finish() if self.codificacion == 'br' else self._gz.flush()
+
+
+class Compresion:
+    """
+    Middleware WSGI: app.wsgi_app = Compresion(app.wsgi_app, ...)
+
+    Args:
+        nivel: nivel gzip (1-9)
+        nivel_brotli: calidad brotli (0-11); 4-5 rinde como gzip 9 con menos CPU
+        minimo: bytes a partir de los cuales se comprime
+        tipos: Content-Type permitidos
+    """
+
+    def __init__(self, app, nivel=6, nivel_brotli=4, minimo=1024, tipos=TIPOS):
+        self.app = app
+        self.nivel = nivel
+        self.nivel_brotli = nivel_brotli
+        self.minimo = minimo
+        self.tipos = tipos
+
+    def _codificacion(self, environ):
+        aceptadas = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli and aceptadas['br']:
+            return 'br'
+        if aceptadas['gzip']:
+            return 'gzip'
+        return None
+
+    def _comprimible(self, status, headers):
+        if status[:3] in SIN_CUERPO or status[0] == '1':
+            return False
+        encabezados = {k.lower(): v for k, v in headers}
+        if 'content-encoding' in encabezados:
+            return False
+        if 'no-transform' in encabezados.get('cache-control', ''):
+            return False
+        tipo = encabezados.get('content-type', '').split(';')[0].strip().lower()
+        if tipo not in self.tipos:
+            return False
+        longitud = encabezados.get('content-length')
+        return longitud is None or int(longitud) >= self.minimo
+
+    def __call__(self, environ, start_response):
+        codificacion = self._codificacion(environ)
+        if not codificacion or environ.get('REQUEST_METHOD') == 'HEAD':
+            return self.app(environ, start_response)
+
+        respuesta = {}
+
+        def capturar(status, headers, exc_info=None):
+            respuesta.update(status=status, headers=headers, exc_info=exc_info)
+            return lambda datos: None  # write() heredado, Flask no lo usa
+
+        app_iter = self.app(environ, capturar)
+        return self._responder(app_iter, respuesta, codificacion, start_response)
+
+    def _responder(self, app_iter, respuesta, codificacion, start_response):
+        try:
+            iterador = iter(app_iter)
+            pendientes = []
+            if 'status' not in respuesta:
+                # La aplicacion llama a start_response al producir el primer bloque
+                pendientes = list(itertools.islice(iterador, 1))
+            status, headers = respuesta['status'], respuesta['headers']
+
+            if not self._comprimible(status, headers):
+                start_response(status, headers, respuesta['exc_info'])
+                yield from itertools.chain(pendientes, iterador)
+                return
+
+            en_streaming = not any(k.lower() == 'content-length' for k, _ in headers)
+            if en_streaming:
+                # Se junta hasta el minimo: si la respuesta termina antes va sin comprimir
+                total = sum(len(b) for b in pendientes)
+                for bloque in iterador:
+                    pendientes.append(bloque)
+                    total += len(bloque)
+                    if total >= self.minimo:
+                        break
+                else:
+                    start_response(status, headers, respuesta['exc_info'])
+                    yield from pendientes
+                    return
+
+            start_response(status, self._encabezados(headers, codificacion), respuesta['exc_info'])
+            compresor = _Compresor(codificacion, self.nivel_brotli if codificacion == 'br' else self.nivel)
+            sin_vaciar = 0
+            for bloque in itertools.chain(pendientes, iterador):
+                datos = compresor.comprimir(bloque)
+                sin_vaciar += len(bloque)
+                if en_streaming and sin_vaciar >= VACIAR_CADA:
+                    datos += compresor.vaciar()
+                    sin_vaciar = 0
+                if datos:
+                    yield datos
+            yield compresor.terminar()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+    @staticmethod
+    def _encabezados(headers, codificacion):
+        nuevos = []
+        vary = None
+        for clave, valor in headers:
+            minuscula = clave.lower()
+            if minuscula == 'content-length':
+                continue
+            if minuscula == 'etag' and not valor.startswith('W/'):
+                valor = 'W/' + valor
+            if minuscula == 'vary':
+                vary = valor
+                continue
+            nuevos.append((clave, valor))
+        nuevos.append(('Content-Encoding', codificacion))
+        nuevos.append(('Vary', f'{vary}, Accept-Encoding' if vary else 'Accept-Encoding'))
+        return nuevos
+
+
+def _benchmark(rutas, usuario=None):
+    """Bytes y CPU de comprimir cada ruta con gzip y brotli a varios niveles"""
+    import time
+    from app import crear_app
+    from models import Usuario
+
+    app = crear_app()
+    cliente = app.test_client()
+    with app.app_context():
+        admin = Usuario.query.filter_by(username=usuario).first() if usuario else \
+            Usuario.query.filter_by(rol='admin').first()
+    if admin:
+        with cliente.session_transaction() as sesion:
+            sesion['_user_id'] = str(admin.id)
+            sesion['_fresh'] = True
+
+    variantes = [('gzip', n) for n in (1, 6, 9)]
+    if brotli:
+        variantes += [('br', n) for n in (4, 5, 11)]
+
+    print(f"{'ruta':40} {'original':>10} {'metodo':>8} {'bytes':>9} {'razon':>6} {'cpu ms':>7}")
+    for ruta in rutas:
+        cuerpo = cliente.get(ruta, headers={'Accept-Encoding': 'identity'}).get_data()
+        print(f"{ruta:40} {len(cuerpo):>10}")
+        for codificacion, nivel in variantes:
+            inicio = time.process_time()
+            for _ in range(20):
+                compresor = _Compresor(codificacion, nivel)
+                comprimido = compresor.comprimir(cuerpo) + compresor.terminar()
+            cpu = (time.process_time() - inicio) / 20 * 1000
+            razon = len(cuerpo) / len(comprimido) if comprimido else 0
+            print(f"{'':40} {'':>10} {codificacion + str(nivel):>8} {len(comprimido):>9} {razon:>5.1f}x {cpu:>7.2f}")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark de compresion de respuestas')
+    parser.add_argument('rutas', nargs='*', default=['/remesas', '/dashboard', '/api/listar-remitentes'])
+    parser.add_argument('--usuario', help='username con el que se piden las paginas (por defecto un admin)')
+    argumentos = parser.parse_args()
+    _benchmark(argumentos.rutas, argumentos.usuario)
@@ -0,0 +1,130 @@
+"""
+Conciliacion de saldos contra los libros
+Recalcula en una sola pasada set-based los saldos de efectivo de todos los
+repartidores (saldo_usd, saldo_cup) desde movimientos_efectivo y los saldos
+pendientes de los revendedores desde el libro de cargos y pagos.
+Reporta los descuadres por usuario y opcionalmente los corrige.
+"""
+import logging
+import time
+from sqlalchemy import func, select, update, case
+from models import db, Usuario, MovimientoEfectivo
+from libro_efectivo import monto_firmado
+from cuentas_revendedor import verificar_saldos, migrar_cargos_historicos, TOLERANCIA
+
+logger = logging.getLogger(__name__)
+
+CAMPO_MONEDA = {'USD': 'saldo_usd', 'CUP': 'saldo_cup'}
+
+
+def _saldos_efectivo_segun_libro():
+    """
+    Una consulta sobre todos los movimientos con dos SUM de ventana:
+    el total por repartidor y moneda, y el saldo corrido para encontrar
+    el primer movimiento cuyo saldo_nuevo registrado ya no coincide.
+
+    Returns:
+        dict (repartidor_id, moneda) -> (saldo_libro, fecha_primer_descuadre)
+    """
+    M = MovimientoEfectivo
+    efecto = monto_firmado()
+    particion = (M.repartidor_id, M.moneda)
+
+    corridos = select(
+        M.repartidor_id,
+        M.moneda,
+        M.fecha,
+        M.saldo_nuevo,
+        func.sum(efecto).over(partition_by=particion).label('total'),
+        func.sum(efecto).over(partition_by=particion, order_by=(M.fecha, M.id)).label('corrido')
+    ).subquery()
+
+    primer_descuadre = func.min(case(
+        (func.abs(corridos.c.corrido - corridos.c.saldo_nuevo) > TOLERANCIA, corridos.c.fecha)
+    ))
+
+    filas = db.session.execute(
+        select(
+            corridos.c.repartidor_id,
+            corridos.c.moneda,
+            func.max(corridos.c.total),
+            primer_descuadre
+        ).group_by(corridos.c.repartidor_id, corridos.c.moneda)
+    ).all()
+
+    return {(rid, moneda): (total or 0, fecha) for rid, moneda, total, fecha in filas}
+
+
+def conciliar(corregir=False):
+    """
+    Compara los saldos mantenidos en usuarios con los libros.
+
+    Args:
+        corregir: Si es True, sobrescribe los saldos con los del libro
+
+    Returns:
+        dict con 'descuadres' (lista por usuario y campo), cantidad de
+        'repartidores' revisados y 'segundos' de duracion
+    """
+    inicio = time.monotonic()
+    # Sin los cargos anteriores al libro, el libro de un revendedor antiguo
+    # tendria menos deuda que la real (y corregir se la borraria)
+    migrados = migrar_cargos_historicos()
+    if migrados:
+        logger.info(f"{migrados} cargos historicos agregados al libro de revendedores")
+    libro = _saldos_efectivo_segun_libro()
+
+    repartidores = db.session.execute(
+        select(Usuario.id, Usuario.nombre, Usuario.saldo_usd, Usuario.saldo_cup)
+        .where(Usuario.rol == 'repartidor')
+    ).all()
+
+    descuadres = []
+    correcciones = {}
+    for rid, nombre, saldo_usd, saldo_cup in repartidores:
+        registrados = {'USD': saldo_usd, 'CUP': saldo_cup}
+        for moneda, campo in CAMPO_MONEDA.items():
+            esperado, primer_descuadre = libro.get((rid, moneda), (0, None))
+            esperado = round(esperado, 2)
+            registrado = round(registrados[moneda] or 0, 2)
+            if abs(registrado - esperado) > TOLERANCIA:
+                descuadres.append({
+                    'usuario_id': rid,
+                    'nombre': nombre,
+                    'rol': 'repartidor',
+                    'campo': campo,
+                    'saldo_registrado': registrado,
+                    'saldo_libro': esperado,
+                    'diferencia': round(registrado - esperado, 2),
+                    'primer_descuadre': primer_descuadre,
+                    'sin_libro': False
+                })
+                correcciones.setdefault(rid, {'id': rid})[campo] = esperado
+
+    # Revendedores: el libro de cargos ya sabe compararse (y corregirse) en bloque
+    for d in verificar_saldos(corregir=corregir):
+        descuadres.append({
+            'usuario_id': d['revendedor_id'],
+            'nombre': d['nombre'],
+            'rol': 'revendedor',
+            'campo': 'saldo_pendiente',
+            'saldo_registrado': d['saldo_registrado'],
+            'saldo_libro': d['saldo_libro'],
+            'diferencia': d['diferencia'],
+            'primer_descuadre': None,
+            'sin_libro': d['sin_libro']
+        })
+
+    if corregir and correcciones:
+        db.session.execute(update(Usuario), list(correcciones.values()))
+        db.session.commit()
+        logger.info(f"Saldos de efectivo corregidos para {len(correcciones)} repartidores")
+
+    segundos = time.monotonic() - inicio
+    logger.info(f"Conciliacion: {len(descuadres)} descuadres en {segundos:.2f}s")
+
+    return {
+        'descuadres': descuadres,
+        'repartidores': len(repartidores),
+        'segundos': segundos
+    }
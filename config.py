@@ -5,6 +5,18 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///remesas.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Compresion de respuestas (ver compresion.py)
+    COMPRESION_NIVEL = int(os.environ.get('COMPRESION_NIVEL') or 6)  # gzip 1-9
+    COMPRESION_NIVEL_BROTLI = int(os.environ.get('COMPRESION_NIVEL_BROTLI') or 4)  # brotli 0-11
+    COMPRESION_MINIMO = int(os.environ.get('COMPRESION_MINIMO') or 1024)  # bytes
+
+    # Segundos de consultas por solicitud en filtros libres (ver presupuesto_consultas.py)
+    PRESUPUESTO_CONSULTAS = float(os.environ.get('PRESUPUESTO_CONSULTAS') or 5)
+
+    # Feed en vivo por SSE (ver eventos.py). Cada conexion ocupa un worker:
+    # con workers de un solo hilo (PythonAnywhere) se desactiva y las paginas consultan cada tanto
+    EVENTOS_EN_VIVO = (os.environ.get('EVENTOS_EN_VIVO') or '1') == '1'
+
     # Configuracion de monedas por defecto
     MONEDA_ORIGEN = 'USD'
     MONEDA_DESTINO = 'LOCAL'
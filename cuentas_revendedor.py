@@ -0,0 +1,229 @@
+"""
+Cuenta corriente de revendedores
+Los cargos y pagos se aplican con incrementos atomicos en SQL sobre
+usuarios.saldo_pendiente y los cargos quedan en un libro de solo insercion
+(cargos_revendedor) que permite verificar el saldo en cualquier momento.
+"""
+import logging
+from sqlalchemy import func, update, select, insert, case
+from models import db, Usuario, Remesa, CargoRevendedor, PagoRevendedor
+
+logger = logging.getLogger(__name__)
+
+# Diferencia maxima (USD) que se considera redondeo y no descuadre
+TOLERANCIA = 0.01
+
+
+def _incrementar_saldo(revendedor_id, delta):
+    """
+    Suma delta a saldo_pendiente directamente en la base de datos.
+    Nunca lee el saldo en Python, asi dos remesas concurrentes no se pisan.
+    """
+    db.session.execute(
+        update(Usuario)
+        .where(Usuario.id == revendedor_id)
+        .values(saldo_pendiente=func.coalesce(Usuario.saldo_pendiente, 0) + delta)
+        .execution_options(synchronize_session=False)
+    )
+    # Si el usuario esta cargado en la sesion, forzar recarga del saldo
+    usuario = db.session.identity_map.get(db.session.identity_key(Usuario, revendedor_id))
+    if usuario is not None:
+        db.session.expire(usuario, ['saldo_pendiente'])
+
+
+def calcular_cargo(revendedor, monto_envio, comision_plataforma):
+    """
+    Monto que el revendedor le debe a la plataforma por una remesa
+
+    Con logistica de Happy Remesitas paga monto + comision,
+    si solo usa la plataforma paga solo la comision.
+    """
+    if revendedor.usa_logistica:
+        return monto_envio + comision_plataforma
+    return comision_plataforma
+
+
+def registrar_cargo(revendedor_id, monto, remesa=None, concepto=None, tipo='remesa'):
+    """
+    Registra un cargo en el libro y lo suma al saldo pendiente.
+    No hace commit: el cargo queda en la misma transaccion que la remesa.
+    """
+    cargo = CargoRevendedor(
+        revendedor_id=revendedor_id,
+        tipo=tipo,
+        monto=monto,
+        concepto=concepto or (f'Remesa {remesa.codigo}' if remesa else None)
+    )
+    if remesa is not None:
+        cargo.remesa = remesa
+    db.session.add(cargo)
+    _incrementar_saldo(revendedor_id, monto)
+    return cargo
+
+
+def registrar_cargos_lote(revendedor_id, cargos):
+    """
+    Registra muchos cargos del mismo revendedor con un INSERT multiple y un
+    solo incremento del saldo por el total. No hace commit.
+
+    Args:
+        cargos: lista de dicts con remesa_id, monto y concepto
+    """
+    if not cargos:
+        return 0.0
+    db.session.execute(
+        insert(CargoRevendedor),
+        [dict(c, revendedor_id=revendedor_id, tipo='remesa') for c in cargos]
+    )
+    total = sum(c['monto'] for c in cargos)
+    _incrementar_saldo(revendedor_id, total)
+    return total
+
+
+def aplicar_pago(revendedor_id, monto):
+    """
+    Descuenta un pago del saldo pendiente sin bajar de 0.
+
+    El UPDATE bloquea la fila del revendedor hasta el commit, por lo que la
+    lectura posterior ve el saldo real. Si el pago excede la deuda, el
+    excedente se registra como ajuste en el libro para que
+    cargos - pagos siga coincidiendo con saldo_pendiente.
+    No hace commit. Retorna el nuevo saldo.
+    """
+    _incrementar_saldo(revendedor_id, -monto)
+    saldo = obtener_saldo(revendedor_id)
+
+    if saldo < 0:
+        registrar_cargo(
+            revendedor_id, -saldo,
+            concepto=f'Excedente de pago condonado (${-saldo:.2f})',
+            tipo='ajuste'
+        )
+        saldo = 0.0
+
+    return saldo
+
+
+def obtener_saldo(revendedor_id):
+    """Lectura rapida del saldo mantenido (una fila por clave primaria)"""
+    saldo = db.session.execute(
+        select(Usuario.saldo_pendiente).where(Usuario.id == revendedor_id)
+    ).scalar()
+    return saldo or 0.0
+
+
+def migrar_cargos_historicos():
+    """
+    Crea en bloque los cargos de remesas de revendedor anteriores al libro.
+    Usa la configuracion actual de logistica del revendedor.
+    Es idempotente: solo inserta para remesas sin cargo.
+    """
+    sin_cargo = ~select(CargoRevendedor.id).where(
+        CargoRevendedor.remesa_id == Remesa.id
+    ).exists()
+
+    monto = case(
+        (Usuario.usa_logistica == True,
+         Remesa.monto_envio + func.coalesce(Remesa.comision_plataforma, 0)),
+        else_=func.coalesce(Remesa.comision_plataforma, 0)
+    )
+
+    origen = select(
+        Remesa.revendedor_id,
+        Remesa.id,
+        monto,
+        Remesa.fecha_creacion
+    ).join(Usuario, Usuario.id == Remesa.revendedor_id).where(
+        Remesa.revendedor_id.isnot(None),
+        sin_cargo
+    )
+
+    resultado = db.session.execute(
+        insert(CargoRevendedor).from_select(
+            ['revendedor_id', 'remesa_id', 'monto', 'fecha'], origen
+        )
+    )
+    db.session.commit()
+    return resultado.rowcount or 0
+
+
+def saldos_segun_libro():
+    """
+    Recalcula el saldo de todos los revendedores desde el libro.
+    Dos consultas agregadas en total, sin importar cuantos revendedores haya.
+
+    Returns:
+        dict revendedor_id -> cargos - pagos
+    """
+    cargos = dict(db.session.execute(
+        select(CargoRevendedor.revendedor_id, func.sum(CargoRevendedor.monto))
+        .group_by(CargoRevendedor.revendedor_id)
+    ).all())
+    pagos = dict(db.session.execute(
+        select(PagoRevendedor.revendedor_id, func.sum(PagoRevendedor.monto))
+        .group_by(PagoRevendedor.revendedor_id)
+    ).all())
+
+    ids = set(cargos) | set(pagos)
+    return {i: (cargos.get(i) or 0) - (pagos.get(i) or 0) for i in ids}
+
+
+def _revendedores_sin_libro():
+    """Revendedores con alguna remesa (activa o archivada) sin cargo en el libro"""
+    from archivo import RemesaHistorica
+
+    return set(db.session.execute(
+        select(RemesaHistorica.revendedor_id).where(
+            RemesaHistorica.revendedor_id.isnot(None),
+            ~select(CargoRevendedor.id).where(CargoRevendedor.remesa_id == RemesaHistorica.id).exists()
+        ).distinct()
+    ).scalars())
+
+
+def verificar_saldos(corregir=False):
+    """
+    Compara saldo_pendiente con el libro para todos los revendedores.
+    El libro debe tener los cargos historicos (migrar_cargos_historicos()).
+
+    Args:
+        corregir: Si es True, ajusta saldo_pendiente al valor del libro. Nunca
+                  a los revendedores con remesas sin cargo (sin_libro): su
+                  libro esta incompleto y les borraria deuda real.
+
+    Returns:
+        lista de dicts con los revendedores descuadrados
+    """
+    libro = saldos_segun_libro()
+    sin_libro = _revendedores_sin_libro()
+    revendedores = db.session.execute(
+        select(Usuario.id, Usuario.nombre, Usuario.saldo_pendiente)
+        .where(Usuario.rol == 'revendedor')
+    ).all()
+
+    descuadres = []
+    for rid, nombre, saldo in revendedores:
+        esperado = round(libro.get(rid, 0), 2)
+        registrado = round(saldo or 0, 2)
+        if abs(esperado - registrado) > TOLERANCIA:
+            descuadres.append({
+                'revendedor_id': rid,
+                'nombre': nombre,
+                'saldo_registrado': registrado,
+                'saldo_libro': esperado,
+                'diferencia': round(registrado - esperado, 2),
+                'sin_libro': rid in sin_libro
+            })
+
+    corregibles = [d for d in descuadres if not d['sin_libro']]
+    if corregir and len(corregibles) < len(descuadres):
+        logger.warning(f"{len(descuadres) - len(corregibles)} revendedores con remesas sin cargo: "
+                       f"su saldo no se corrige")
+    if corregir and corregibles:
+        db.session.execute(
+            update(Usuario),
+            [{'id': d['revendedor_id'], 'saldo_pendiente': d['saldo_libro']} for d in corregibles]
+        )
+        db.session.commit()
+        logger.info(f"Saldos de {len(corregibles)} revendedores corregidos desde el libro")
+
+    return descuadres
@@ -0,0 +1,222 @@
+"""
+Directorio de contactos: remitentes y sus beneficiarios
+Los datos de cliente viven repetidos en cada Remesa; estas tablas guardan
+una fila por remitente (telefono normalizado) y por beneficiario de cada
+remitente (nombre normalizado), con cantidad de usos y ultimo uso, para que
+"datos del cliente" y "beneficiarios frecuentes" sean una lectura de indice.
+
+Cada remesa creada hace un upsert (INSERT ... ON CONFLICT DO UPDATE) en la
+misma transaccion que la remesa. migrar_directorio() arma el directorio
+desde el historial la primera vez.
+
+Los beneficiarios se identifican por nombre dentro de su remitente porque
+muchas remesas no traen su telefono.
+"""
+import logging
+import re
+from datetime import datetime
+from sqlalchemy import select, func
+from models import db, Remitente, Beneficiario
+from autocompletar import normalizar
+from archivo import RemesaHistorica
+
+logger = logging.getLogger(__name__)
+
+# Telefonos por consulta IN al buscar ids
+TAMANO_LOTE = 500
+# Menos digitos que esto no identifican a nadie
+MIN_DIGITOS = 7
+
+
+def normalizar_telefono(telefono):
+    """Solo digitos y los ultimos 10: "+1 (305) 555-1234" -> "3055551234" """
+    digitos = re.sub(r'\D', '', telefono or '')
+    return digitos[-10:] if len(digitos) >= MIN_DIGITOS else None
+
+
+def _insert(modelo):
+    """INSERT con ON CONFLICT del dialecto actual, o None si no lo soporta"""
+    dialecto = db.session.get_bind().dialect.name
+    if dialecto == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialecto == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    return insert(modelo)
+
+
+def _agrupar(filas):
+    """
+    Agrupa filas de remesa (dicts) en remitentes y beneficiarios.
+    Un mismo INSERT ... ON CONFLICT no puede tocar dos veces la misma fila.
+    """
+    remitentes = {}
+    beneficiarios = {}
+    for fila in filas:
+        telefono = normalizar_telefono(fila.get('remitente_telefono'))
+        if not telefono:
+            continue
+        fecha = fila.get('fecha_creacion') or datetime.utcnow()
+
+        remitente = remitentes.setdefault(telefono, {
+            'telefono_normalizado': telefono, 'usos': 0, 'ultimo_uso': fecha
+        })
+        remitente['usos'] += 1
+        if fecha >= remitente['ultimo_uso'] or 'nombre' not in remitente:
+            remitente.update(nombre=fila['remitente_nombre'], telefono=fila['remitente_telefono'],
+                             ultimo_uso=max(fecha, remitente['ultimo_uso']))
+
+        clave = normalizar(fila.get('beneficiario_nombre'))
+        if not clave:
+            continue
+        beneficiario = beneficiarios.setdefault((telefono, clave), {
+            'clave': clave, 'usos': 0, 'ultimo_uso': fecha, 'telefono': '', 'direccion': ''
+        })
+        beneficiario['usos'] += 1
+        if fecha >= beneficiario['ultimo_uso'] or 'nombre' not in beneficiario:
+            beneficiario['nombre'] = fila['beneficiario_nombre']
+            beneficiario['ultimo_uso'] = max(fecha, beneficiario['ultimo_uso'])
+            # Un telefono o direccion vacio no borra el anterior
+            for campo in ('telefono', 'direccion'):
+                if fila.get(f'beneficiario_{campo}'):
+                    beneficiario[campo] = fila[f'beneficiario_{campo}']
+
+    return remitentes, beneficiarios
+
+
+def _upsert_remitentes(filas):
+    consulta = _insert(Remitente)
+    if consulta is None:
+        for fila in filas:
+            remitente = Remitente.query.filter_by(telefono_normalizado=fila['telefono_normalizado']).first()
+            if remitente:
+                remitente.usos += fila['usos']
+                remitente.nombre, remitente.telefono, remitente.ultimo_uso = \
+                    fila['nombre'], fila['telefono'], fila['ultimo_uso']
+            else:
+                db.session.add(Remitente(**fila))
+        db.session.flush()
+        return
+
+    # Sentencia sin .values(): executemany de una sola sentencia compilada (y cacheada)
+    db.session.execute(consulta.on_conflict_do_update(
+        index_elements=['telefono_normalizado'],
+        set_={
+            'usos': Remitente.usos + consulta.excluded.usos,
+            'nombre': consulta.excluded.nombre,
+            'telefono': consulta.excluded.telefono,
+            'ultimo_uso': consulta.excluded.ultimo_uso
+        }
+    ), filas)
+
+
+def _upsert_beneficiarios(filas):
+    consulta = _insert(Beneficiario)
+    if consulta is None:
+        for fila in filas:
+            beneficiario = Beneficiario.query.filter_by(
+                remitente_id=fila['remitente_id'], clave=fila['clave']
+            ).first()
+            if beneficiario:
+                beneficiario.usos += fila['usos']
+                beneficiario.nombre, beneficiario.ultimo_uso = fila['nombre'], fila['ultimo_uso']
+                beneficiario.telefono = fila['telefono'] or beneficiario.telefono
+                beneficiario.direccion = fila['direccion'] or beneficiario.direccion
+            else:
+                db.session.add(Beneficiario(**fila))
+        db.session.flush()
+        return
+
+    excluido = consulta.excluded
+    db.session.execute(consulta.on_conflict_do_update(
+        index_elements=['remitente_id', 'clave'],
+        set_={
+            'usos': Beneficiario.usos + excluido.usos,
+            'nombre': excluido.nombre,
+            'telefono': func.coalesce(func.nullif(excluido.telefono, ''), Beneficiario.telefono),
+            'direccion': func.coalesce(func.nullif(excluido.direccion, ''), Beneficiario.direccion),
+            'ultimo_uso': excluido.ultimo_uso
+        }
+    ), filas)
+
+
+def registrar_contactos(filas):
+    """
+    Suma al directorio los contactos de un grupo de remesas. Sin commit:
+    se llama antes del commit que guarda las remesas.
+
+    Args:
+        filas: dicts con los campos remitente_* / beneficiario_* de Remesa
+               y opcionalmente fecha_creacion
+    """
+    remitentes, beneficiarios = _agrupar(filas)
+    if not remitentes:
+        return
+
+    _upsert_remitentes(list(remitentes.values()))
+
+    if not beneficiarios:
+        return
+    telefonos = list(remitentes)
+    ids = {}
+    for i in range(0, len(telefonos), TAMANO_LOTE):
+        ids.update(db.session.execute(
+            select(Remitente.telefono_normalizado, Remitente.id)
+            .where(Remitente.telefono_normalizado.in_(telefonos[i:i + TAMANO_LOTE]))
+        ).all())
+
+    _upsert_beneficiarios([
+        dict(valores, remitente_id=ids[telefono])
+        for (telefono, _), valores in beneficiarios.items()
+    ])
+
+
+CAMPOS = (
+    'remitente_nombre', 'remitente_telefono',
+    'beneficiario_nombre', 'beneficiario_telefono', 'beneficiario_direccion', 'fecha_creacion'
+)
+
+
+def registrar_remesa(remesa):
+    """Suma al directorio los contactos de una remesa nueva (antes del commit)"""
+    registrar_contactos([{campo: getattr(remesa, campo) for campo in CAMPOS}])
+
+
+def migrar_directorio():
+    """
+    Arma el directorio desde todas las remesas (activas y archivadas) si
+    todavia esta vacio. Seguro de llamar en cada arranque.
+
+    Returns:
+        Cantidad de remitentes creados
+    """
+    if db.session.execute(select(Remitente.id).limit(1)).first():
+        return 0
+
+    filas = db.session.execute(
+        select(*[getattr(RemesaHistorica, campo) for campo in CAMPOS])
+        .execution_options(yield_per=5000)
+    ).mappings()
+    registrar_contactos(filas)
+    db.session.commit()
+
+    total = db.session.execute(select(func.count(Remitente.id))).scalar()
+    if total:
+        logger.info(f"Directorio de contactos creado: {total} remitentes")
+    return total
+
+
+def datos_cliente(telefono):
+    """Remitente por telefono, o None"""
+    telefono = normalizar_telefono(telefono)
+    if not telefono:
+        return None
+    return Remitente.query.filter_by(telefono_normalizado=telefono).first()
+
+
+def beneficiarios_frecuentes(remitente, limite=5):
+    """Beneficiarios mas usados de un remitente (una lectura del indice)"""
+    return remitente.beneficiarios.order_by(
+        Beneficiario.usos.desc(), Beneficiario.ultimo_uso.desc()
+    ).limit(limite).all()
@@ -0,0 +1,278 @@
+"""
+Feed de eventos en vivo (Server-Sent Events)
+El dashboard, las solicitudes y el panel del repartidor se actualizan solos
+cuando se crea, asigna o entrega una remesa o llega una solicitud, sin
+recargar ni volver a calcular la pagina.
+
+- Los cambios a remesas por ORM se detectan en after_flush (como en
+  perfiles.py) y se guardan en la tabla eventos en la misma transaccion; las
+  operaciones con UPDATE/INSERT directo llaman a registrar_remesas()
+- El id del evento es el Last-Event-ID: al reconectar, EventSource lo manda
+  y se envia lo que falto
+- Los admins reciben todos los eventos; repartidores y revendedores solo los
+  de sus remesas
+- Dentro del proceso un commit despierta a las conexiones abiertas al
+  instante; los eventos escritos por otros procesos (otros workers, el
+  scheduler) se leen de la tabla cada SONDEO segundos
+
+Cada conexion ocupa un worker, asi que dura a lo sumo DURACION segundos y el
+navegador reconecta solo (sin perder eventos); pasadas MAX_CONEXIONES por
+proceso se le pide reintentar mas tarde. Con workers de un solo hilo (como
+en PythonAnywhere) eso no alcanza: con EVENTOS_EN_VIVO desactivado no se
+abren streams y las paginas consultan /eventos/recientes cada tanto, con
+los mismos eventos (abrirEventos() en base.html).
+
+limpiar_eventos() nunca borra el ultimo evento: sin AUTOINCREMENT, SQLite
+volveria a empezar los ids desde 1 con la tabla vacia y las paginas con un
+Last-Event-ID mayor no recibirian nada.
+"""
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import Blueprint, Response, request, stream_with_context, abort, jsonify, current_app
+from flask_login import login_required, current_user
+from sqlalchemy import event, inspect, select, insert, delete, func, or_
+from sqlalchemy.orm import Session
+from models import db, Remesa, Evento
+
+eventos_bp = Blueprint('eventos', __name__)
+
+DURACION = 25
+SONDEO = 3
+LATIDO = 15
+REINTENTO_MS = 3000
+REINTENTO_OCUPADO_MS = 15000
+MAX_CONEXIONES = 4
+MAX_POR_LECTURA = 100
+RETENCION = timedelta(days=1)
+
+_condicion = threading.Condition()
+_conexiones = 0
+
+
+def _datos(remesa, anterior=None):
+    return {
+        'id': remesa.id,
+        'codigo': remesa.codigo,
+        'estado': remesa.estado,
+        'anterior': anterior,
+        'remitente': remesa.remitente_nombre,
+        'beneficiario': remesa.beneficiario_nombre,
+        'monto': remesa.monto_envio,
+        'monto_entrega': remesa.monto_entrega,
+        'moneda': remesa.moneda_entrega,
+        'repartidor_id': remesa.repartidor_id,
+        'fecha': (remesa.fecha_creacion or datetime.utcnow()).strftime('%d/%m %H:%M')
+    }
+
+
+def _fila(tipo, datos, para_admins=True, usuario_id=None):
+    return {'tipo': tipo, 'para_admins': para_admins, 'usuario_id': usuario_id,
+            'datos': json.dumps(datos), 'fecha': datetime.utcnow()}
+
+
+def _eventos_remesa(remesa, tipo, anterior=None, repartidor_anterior=None):
+    """Filas de eventos para una remesa: admins y su repartidor, su revendedor y el repartidor que la perdio"""
+    datos = _datos(remesa, anterior)
+    filas = [_fila(tipo, datos, usuario_id=remesa.repartidor_id)]
+    if remesa.revendedor_id:
+        filas.append(_fila(tipo, datos, para_admins=False, usuario_id=remesa.revendedor_id))
+    if repartidor_anterior and repartidor_anterior != remesa.repartidor_id:
+        filas.append(_fila('remesa_retirada', datos, para_admins=False, usuario_id=repartidor_anterior))
+    return filas
+
+
+def _tipo_cambio(estado):
+    return {'entregada': 'remesa_entregada'}.get(estado, 'remesa_estado')
+
+
+# === Registro (en la transaccion que escribe) ===
+
+@event.listens_for(Session, 'after_flush')
+def _registrar_cambios(session, contexto):
+    pendientes = session.info.setdefault('eventos_pendientes', [])
+    for remesa in session.new:
+        if isinstance(remesa, Remesa):
+            tipo = 'solicitud_nueva' if remesa.estado == 'solicitud' else 'remesa_creada'
+            pendientes.extend(_eventos_remesa(remesa, tipo))
+
+    for remesa in session.dirty:
+        if not isinstance(remesa, Remesa):
+            continue
+        estado = inspect(remesa)
+        cambio_estado = estado.attrs.estado.history
+        cambio_repartidor = estado.attrs.repartidor_id.history
+        if not (cambio_estado.has_changes() or cambio_repartidor.has_changes()):
+            continue
+        anterior = cambio_estado.deleted[0] if cambio_estado.deleted else remesa.estado
+        repartidor_anterior = cambio_repartidor.deleted[0] if cambio_repartidor.deleted else None
+        if cambio_repartidor.has_changes() and remesa.repartidor_id:
+            tipo = 'remesa_asignada'
+        else:
+            tipo = _tipo_cambio(remesa.estado)
+        pendientes.extend(_eventos_remesa(remesa, tipo, anterior, repartidor_anterior))
+
+
+@event.listens_for(Session, 'before_commit')
+def _guardar_eventos(session):
+    session.flush()
+    pendientes = session.info.pop('eventos_pendientes', None)
+    if pendientes:
+        session.execute(insert(Evento), pendientes)
+        session.info['eventos_nuevos'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _avisar(session):
+    if session.info.pop('eventos_nuevos', False):
+        with _condicion:
+            _condicion.notify_all()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar(session):
+    session.info.pop('eventos_pendientes', None)
+    session.info.pop('eventos_nuevos', None)
+
+
+def registrar_remesas(ids, tipo, anteriores=None):
+    """
+    Eventos para remesas escritas con SQL directo (sin ORM). Sin commit.
+    anteriores: {id: fila con estado y repartidor_id de antes del cambio}, si se conocen.
+    """
+    anteriores = anteriores or {}
+    pendientes = db.session.info.setdefault('eventos_pendientes', [])
+    # populate_existing: el UPDATE directo no actualizo los objetos ya cargados en la sesion
+    for remesa in Remesa.query.filter(Remesa.id.in_(list(ids))).populate_existing():
+        antes = anteriores.get(remesa.id)
+        pendientes.extend(_eventos_remesa(remesa, tipo, antes and antes.estado, antes and antes.repartidor_id))
+
+
+def registrar(tipo, datos, para_admins=True, usuario_id=None):
+    """Evento que no corresponde a una sola remesa (p. ej. una importacion). Sin commit."""
+    db.session.info.setdefault('eventos_pendientes', []).append(_fila(tipo, datos, para_admins, usuario_id))
+
+
+def limpiar_eventos():
+    """Borra los eventos con mas de RETENCION. Returns: cantidad borrada"""
+    resultado = db.session.execute(delete(Evento).where(
+        Evento.fecha < datetime.utcnow() - RETENCION,
+        # El ultimo se conserva: los ids no deben volver a empezar
+        Evento.id < select(func.max(Evento.id)).scalar_subquery()
+    ))
+    db.session.commit()
+    return resultado.rowcount
+
+
+# === Consulta ===
+
+def ultimo_evento():
+    """Id del ultimo evento: la pagina lo pasa al conectarse para no perder lo ocurrido mientras cargaba"""
+    return db.session.execute(select(func.max(Evento.id))).scalar() or 0
+
+
+def _leer(conexion, desde, usuario_id, es_admin):
+    filtro = or_(Evento.para_admins.is_(True), Evento.usuario_id == usuario_id) if es_admin \
+        else Evento.usuario_id == usuario_id
+    return conexion.execute(
+        select(Evento.id, Evento.tipo, Evento.datos)
+        .where(Evento.id > desde, filtro)
+        .order_by(Evento.id)
+        .limit(MAX_POR_LECTURA)
+    ).all()
+
+
+def _vencido(conexion, desde):
+    """
+    True si la pagina debe recargarse: ya se borraron eventos posteriores a
+    desde, o desde es mayor que el ultimo id (la base se reemplazo).
+    """
+    primero, ultimo = conexion.execute(select(
+        select(func.min(Evento.id)).scalar_subquery(),
+        select(func.max(Evento.id)).scalar_subquery()
+    )).one()
+    if primero is None:
+        return False
+    return desde < primero - 1 or desde > ultimo
+
+
+def _transmitir(desde, usuario_id, es_admin):
+    yield f'retry: {REINTENTO_MS}\n\n'
+    fin = time.monotonic() + DURACION
+    ultimo_envio = time.monotonic()
+    with db.engine.connect() as conexion:
+        if desde and _vencido(conexion, desde):
+            yield 'event: recargar\ndata: {}\n\n'
+            return
+    while time.monotonic() < fin:
+        # Una conexion corta por lectura: no dejar una transaccion abierta que bloquee escrituras
+        with db.engine.connect() as conexion:
+            filas = _leer(conexion, desde, usuario_id, es_admin)
+        for fila in filas:
+            yield f'id: {fila.id}\nevent: {fila.tipo}\ndata: {fila.datos}\n\n'
+            desde = fila.id
+        if filas:
+            ultimo_envio = time.monotonic()
+            continue
+        if time.monotonic() - ultimo_envio >= LATIDO:
+            # Comentario: mantiene viva la conexion a traves de proxies
+            yield ': latido\n\n'
+            ultimo_envio = time.monotonic()
+        with _condicion:
+            _condicion.wait(min(SONDEO, max(fin - time.monotonic(), 0)))
+
+
+def _cerrar_conexion():
+    global _conexiones
+    with _condicion:
+        _conexiones -= 1
+
+
+@eventos_bp.route('/eventos')
+@login_required
+def stream():
+    """Stream SSE del usuario; ?desde=<id> en la primera conexion, Last-Event-ID al reconectar"""
+    global _conexiones
+    if current_user.rol not in ('admin', 'repartidor', 'revendedor'):
+        abort(403)
+    if not current_app.config['EVENTOS_EN_VIVO']:
+        # 204: EventSource deja de reconectar (paginas abiertas antes de desactivarlo)
+        return Response(status=204)
+    try:
+        desde = int(request.headers.get('Last-Event-ID') or request.args.get('desde') or 0)
+    except ValueError:
+        desde = 0
+    if not desde:
+        desde = ultimo_evento()
+
+    cabeceras = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    with _condicion:
+        if _conexiones >= MAX_CONEXIONES:
+            # Con 503 EventSource deja de reintentar: se responde vacio con un retry largo
+            return Response(f'retry: {REINTENTO_OCUPADO_MS}\n\n', mimetype='text/event-stream', headers=cabeceras)
+        _conexiones += 1
+
+    generador = _transmitir(desde, current_user.id, current_user.es_admin())
+    respuesta = Response(stream_with_context(generador), mimetype='text/event-stream', headers=cabeceras)
+    # Se descuenta al cerrar la respuesta, aunque el cliente se vaya antes del primer evento
+    respuesta.call_on_close(_cerrar_conexion)
+    return respuesta
+
+
+@eventos_bp.route('/eventos/recientes')
+@login_required
+def recientes():
+    """Eventos posteriores a ?desde=<id>, para las paginas que consultan en lugar del stream"""
+    if current_user.rol not in ('admin', 'repartidor', 'revendedor'):
+        abort(403)
+    desde = request.args.get('desde', 0, type=int)
+    with db.engine.connect() as conexion:
+        if desde and _vencido(conexion, desde):
+            eventos = [{'id': desde, 'tipo': 'recargar', 'datos': '{}'}]
+        else:
+            eventos = [{'id': f.id, 'tipo': f.tipo, 'datos': f.datos}
+                       for f in _leer(conexion, desde, current_user.id, current_user.es_admin())]
+    respuesta = jsonify({'eventos': eventos})
+    respuesta.headers['Cache-Control'] = 'no-store'
+    return respuesta
@@ -0,0 +1,150 @@
+"""
+Exportacion de datos en CSV por streaming
+Las filas se leen del cursor por lotes (yield_per) y se escriben al cliente
+a medida que llegan, asi que la memoria usada no depende del rango de fechas
+y los primeros bytes salen sin esperar a que termine la consulta.
+"""
+import csv
+import io
+import zlib
+from sqlalchemy import select, func
+from sqlalchemy.orm import aliased
+from models import db, Remesa, Usuario, MovimientoContable, MovimientoEfectivo, PagoRevendedor
+from archivo import RemesaArchivada, MovimientoArchivado
+
+TAMANO_LOTE = 1000
+
+
+def _consulta_remesas(R):
+    repartidor = aliased(Usuario)
+    revendedor = aliased(Usuario)
+    return select(
+        R.id, R.codigo, R.fecha_creacion, R.estado,
+        R.remitente_nombre, R.remitente_telefono,
+        R.beneficiario_nombre, R.beneficiario_telefono, R.beneficiario_direccion,
+        R.tipo_entrega, R.monto_envio, R.tasa_cambio,
+        R.monto_entrega, R.moneda_entrega,
+        R.total_comision, R.total_cobrado, R.comision_plataforma,
+        repartidor.nombre, revendedor.nombre,
+        R.fecha_entrega, R.facturada, R.fecha_facturacion
+    ).outerjoin(repartidor, R.repartidor_id == repartidor.id
+    ).outerjoin(revendedor, R.revendedor_id == revendedor.id)
+
+
+def _consulta_movimientos(M):
+    # El codigo de la remesa puede estar en la tabla activa o en el archivo
+    codigo = func.coalesce(
+        select(Remesa.codigo).where(Remesa.id == M.remesa_id).scalar_subquery(),
+        select(RemesaArchivada.codigo).where(RemesaArchivada.id == M.remesa_id).scalar_subquery()
+    )
+    return select(
+        M.id, M.fecha, M.tipo, M.concepto, M.monto, codigo, Usuario.nombre
+    ).outerjoin(Usuario, M.usuario_id == Usuario.id)
+
+
+def _consulta_efectivo(E):
+    codigo = func.coalesce(
+        select(Remesa.codigo).where(Remesa.id == E.remesa_id).scalar_subquery(),
+        select(RemesaArchivada.codigo).where(RemesaArchivada.id == E.remesa_id).scalar_subquery()
+    )
+    return select(
+        E.id, E.fecha, Usuario.nombre,
+        E.tipo, E.moneda, E.monto,
+        E.saldo_anterior, E.saldo_nuevo,
+        E.tasa_cambio, codigo, E.notas
+    ).outerjoin(Usuario, E.repartidor_id == Usuario.id)
+
+
+def _consulta_pagos(P):
+    return select(
+        P.id, P.fecha, Usuario.nombre,
+        P.monto, P.metodo_pago,
+        P.referencia, P.notas
+    ).outerjoin(Usuario, P.revendedor_id == Usuario.id)
+
+
+# nombre -> (consulta, tablas en orden de lectura (archivo primero), campo de fecha, encabezados)
+EXPORTACIONES = {
+    'remesas': (
+        _consulta_remesas, (RemesaArchivada, Remesa), 'fecha_creacion',
+        ['id', 'codigo', 'fecha_creacion', 'estado',
+         'remitente_nombre', 'remitente_telefono',
+         'beneficiario_nombre', 'beneficiario_telefono', 'beneficiario_direccion',
+         'tipo_entrega', 'monto_envio', 'tasa_cambio', 'monto_entrega', 'moneda_entrega',
+         'total_comision', 'total_cobrado', 'comision_plataforma',
+         'repartidor', 'revendedor', 'fecha_entrega', 'facturada', 'fecha_facturacion']
+    ),
+    'movimientos': (
+        _consulta_movimientos, (MovimientoArchivado, MovimientoContable), 'fecha',
+        ['id', 'fecha', 'tipo', 'concepto', 'monto', 'remesa', 'usuario']
+    ),
+    'efectivo': (
+        _consulta_efectivo, (MovimientoEfectivo,), 'fecha',
+        ['id', 'fecha', 'repartidor', 'tipo', 'moneda', 'monto',
+         'saldo_anterior', 'saldo_nuevo', 'tasa_cambio', 'remesa', 'notas']
+    ),
+    'pagos_revendedor': (
+        _consulta_pagos, (PagoRevendedor,), 'fecha',
+        ['id', 'fecha', 'revendedor', 'monto', 'metodo_pago', 'referencia', 'notas']
+    ),
+}
+
+
+def _valor(v):
+    if v is None:
+        return ''
+    if isinstance(v, bool):
+        return 'si' if v else 'no'
+    if hasattr(v, 'isoformat'):
+        return v.isoformat(sep=' ', timespec='seconds') if hasattr(v, 'hour') else v.isoformat()
+    return v
+
+
+def generar_csv(nombre, desde=None, hasta=None):
+    """
+    Generador de bloques CSV (str) para una exportacion.
+    El primer bloque (BOM + encabezados) se emite antes de ejecutar la
+    consulta; luego un bloque por cada lote leido del cursor.
+
+    Args:
+        nombre: Clave de EXPORTACIONES
+        desde, hasta: datetime opcionales; hasta es exclusivo
+    """
+    consulta, entidades, campo_fecha, encabezados = EXPORTACIONES[nombre]
+
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+
+    # El BOM hace que Excel abra el archivo como UTF-8
+    buffer.write('\ufeff')
+    escritor.writerow(encabezados)
+    yield buffer.getvalue()
+
+    # Una consulta por tabla (archivo y luego activa), cada una en orden de
+    # clave primaria: recorre el indice sin ordenar en memoria
+    for entidad in entidades:
+        stmt = consulta(entidad)
+        if desde:
+            stmt = stmt.where(getattr(entidad, campo_fecha) >= desde)
+        if hasta:
+            stmt = stmt.where(getattr(entidad, campo_fecha) < hasta)
+        stmt = stmt.order_by(entidad.id).execution_options(yield_per=TAMANO_LOTE, stream_results=True)
+
+        resultado = db.session.execute(stmt)
+        try:
+            for lote in resultado.partitions():
+                buffer.seek(0)
+                buffer.truncate()
+                escritor.writerows([_valor(v) for v in fila] for fila in lote)
+                yield buffer.getvalue()
+        finally:
+            resultado.close()
+
+
+def comprimir_gzip(bloques, nivel=6):
+    """Comprime un generador de bloques de texto como un flujo gzip"""
+    compresor = zlib.compressobj(nivel, zlib.DEFLATED, 31)  # wbits=31: cabecera gzip
+    for bloque in bloques:
+        # Z_SYNC_FLUSH por bloque: el cliente recibe datos en cuanto sale cada lote
+        yield compresor.compress(bloque.encode('utf-8')) + compresor.flush(zlib.Z_SYNC_FLUSH)
+    yield compresor.flush()
@@ -0,0 +1,298 @@
+"""
+Fotos de entrega
+Un celular manda fotos de 3 a 8 MB. guardar_foto() copia la subida por
+bloques a static/fotos_entrega/pendientes/ (con limite de tamano) calculando
+su sha256, y devuelve enseguida el nombre definitivo <ab>/<sha256>.jpg. En un
+pool de hilos, fuera de la solicitud, la foto se reduce a LADO_MAXIMO, se
+recodifica en JPEG sin EXIF (la ubicacion GPS de la casa del beneficiario no
+se guarda) y se genera la miniatura <ab>/<sha256>.min.jpg.
+
+Como el nombre sale del contenido, la misma foto reenviada (reintento de la
+cola offline) no ocupa lugar dos veces y /fotos/ se sirve con cache de un
+ano e immutable. Mientras se procesa se sirve la original sin cachear.
+
+Requiere Pillow para reducir y quitar EXIF; sin Pillow la foto se guarda tal
+cual (con el mismo nombre por contenido). Las fotos anteriores a este modulo
+(nombre sin carpeta) se migran con:
+
+    python fotos.py
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, send_from_directory, abort, url_for
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+CARPETA = os.path.join(RAIZ, 'static', 'fotos_entrega')
+PENDIENTES = os.path.join(CARPETA, 'pendientes')
+
+MAX_BYTES = 15 * 1024 * 1024
+LADO_MAXIMO = 1600  # Se lee bien la cara y el billete; ~200 KB en JPEG 80
+LADO_MINIATURA = 320
+CALIDAD = 80
+CALIDAD_MINIATURA = 70
+BLOQUE = 64 * 1024
+HILOS = 2
+# Pendientes mas viejas que esto se dan por abandonadas (proceso reiniciado)
+ANTIGUEDAD_REINTENTO = 60
+
+NOMBRE = re.compile(r'^([0-9a-f]{2})/([0-9a-f]{64})(\.min)?\.jpg$')
+UN_ANO = 365 * 24 * 3600
+
+fotos_bp = Blueprint('fotos', __name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class FotoInvalida(ValueError):
+    """La subida esta vacia o supera MAX_BYTES"""
+
+
+def _nombre(digest, miniatura=False):
+    return f"{digest[:2]}/{digest}{'.min' if miniatura else ''}.jpg"
+
+
+def _ruta(nombre):
+    return os.path.join(CARPETA, *nombre.split('/'))
+
+
+def _pendiente(digest):
+    return os.path.join(PENDIENTES, digest)
+
+
+def _encolar(digest):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=HILOS, thread_name_prefix='fotos')
+    _pool.submit(_procesar_seguro, digest)
+
+
+# === Subida ===
+
+def guardar_foto(archivo, en_segundo_plano=True):
+    """
+    Guarda una foto subida (FileStorage) y programa su procesamiento, o la
+    procesa en el momento si en_segundo_plano es False.
+
+    Returns:
+        Nombre relativo para Remesa.foto_entrega ('ab/<sha256>.jpg')
+
+    Raises:
+        FotoInvalida: si esta vacia o supera MAX_BYTES
+    """
+    os.makedirs(PENDIENTES, exist_ok=True)
+    temporal = os.path.join(PENDIENTES, f'subida.{os.getpid()}.{threading.get_ident()}.tmp')
+    h = hashlib.sha256()
+    total = 0
+    try:
+        with open(temporal, 'wb') as destino:
+            while True:
+                bloque = archivo.stream.read(BLOQUE)
+                if not bloque:
+                    break
+                total += len(bloque)
+                if total > MAX_BYTES:
+                    raise FotoInvalida(f'La foto supera {MAX_BYTES // (1024 * 1024)} MB')
+                h.update(bloque)
+                destino.write(bloque)
+        if not total:
+            raise FotoInvalida('La foto esta vacia')
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+    return _agregar(temporal, h.hexdigest(), en_segundo_plano)
+
+
+def guardar_archivo(ruta, en_segundo_plano=True):
+    """
+    Como guardar_foto() pero con un archivo ya escrito en disco (subidas.py).
+    El archivo se mueve: no debe usarse despues.
+    """
+    if os.path.getsize(ruta) > MAX_BYTES:
+        raise FotoInvalida(f'La foto supera {MAX_BYTES // (1024 * 1024)} MB')
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(BLOQUE), b''):
+            h.update(bloque)
+    return _agregar(ruta, h.hexdigest(), en_segundo_plano)
+
+
+def _agregar(temporal, digest, en_segundo_plano):
+    if os.path.exists(_ruta(_nombre(digest))):
+        os.remove(temporal)  # Ya procesada: misma foto reenviada
+    else:
+        os.replace(temporal, _pendiente(digest))
+        if en_segundo_plano:
+            _encolar(digest)
+        else:
+            procesar(digest)
+    return _nombre(digest)
+
+
+# === Procesamiento ===
+
+def _guardar_jpeg(imagen, ruta, calidad):
+    temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}.tmp'
+    imagen.save(temporal, 'JPEG', quality=calidad, optimize=True, progressive=True)
+    os.replace(temporal, ruta)
+
+
+def procesar(digest):
+    """Reduce, quita EXIF y genera la miniatura de una foto pendiente"""
+    origen = _pendiente(digest)
+    if not os.path.exists(origen):
+        return
+    destino = _ruta(_nombre(digest))
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+
+    if Image is None:
+        os.replace(origen, destino)
+        return
+
+    try:
+        with Image.open(origen) as original:
+            # JPEG: decodifica ya reducida a 1/2, 1/4 u 1/8 (mucho menos CPU y memoria)
+            original.draft('RGB', (LADO_MAXIMO, LADO_MAXIMO))
+            imagen = ImageOps.exif_transpose(original)
+            if imagen.mode != 'RGB':
+                imagen = imagen.convert('RGB')
+            imagen.thumbnail((LADO_MAXIMO, LADO_MAXIMO))
+            miniatura = imagen.copy()
+            miniatura.thumbnail((LADO_MINIATURA, LADO_MINIATURA))
+            # Sin exif=: el JPEG nuevo no lleva metadatos. La foto va al final:
+            # que exista indica que la miniatura tambien
+            _guardar_jpeg(miniatura, _ruta(_nombre(digest, miniatura=True)), CALIDAD_MINIATURA)
+            _guardar_jpeg(imagen, destino, CALIDAD)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        # No es una imagen que Pillow entienda: se conserva la original
+        logger.warning(f"Foto {digest} sin procesar: {e}")
+        os.replace(origen, destino)
+        return
+    os.remove(origen)
+
+
+def _procesar_seguro(digest):
+    try:
+        procesar(digest)
+    except Exception:
+        logger.exception(f"Error procesando foto {digest}")
+
+
+def procesar_pendientes():
+    """Procesa las fotos que quedaron pendientes (p. ej. por un reinicio). Returns: cantidad"""
+    if not os.path.isdir(PENDIENTES):
+        return 0
+    limite = time.time() - ANTIGUEDAD_REINTENTO
+    cantidad = 0
+    for archivo in os.listdir(PENDIENTES):
+        ruta = os.path.join(PENDIENTES, archivo)
+        if os.path.getmtime(ruta) > limite:
+            continue
+        if re.fullmatch(r'[0-9a-f]{64}', archivo):
+            _procesar_seguro(archivo)
+            cantidad += 1
+        elif archivo.endswith('.tmp'):
+            os.remove(ruta)  # Subida cortada
+    return cantidad
+
+
+# === Consulta ===
+
+def url_foto(nombre, miniatura=False):
+    """URL de una foto de entrega (global de Jinja). Las anteriores a fotos.py siguen en static/"""
+    if not nombre:
+        return ''
+    coincidencia = NOMBRE.match(nombre)
+    if not coincidencia:
+        return url_for('static', filename=f'fotos_entrega/{nombre}')
+    return url_for('fotos.servir', nombre=_nombre(coincidencia.group(2), miniatura))
+
+
+@fotos_bp.route('/fotos/<path:nombre>')
+def servir(nombre):
+    """Foto procesada con cache immutable; si todavia se procesa, la original sin cachear"""
+    coincidencia = NOMBRE.match(nombre)
+    if not coincidencia:
+        abort(404)
+
+    if os.path.isfile(_ruta(nombre)):
+        respuesta = send_from_directory(CARPETA, nombre, mimetype='image/jpeg', max_age=UN_ANO)
+        respuesta.cache_control.public = True
+        respuesta.cache_control.immutable = True
+        return respuesta
+
+    digest = coincidencia.group(2)
+    # Sin Pillow no hay miniatura: se usa la foto completa
+    if coincidencia.group(3) and os.path.isfile(_ruta(_nombre(digest))):
+        return send_from_directory(CARPETA, _nombre(digest), mimetype='image/jpeg', max_age=UN_ANO)
+    if os.path.isfile(_pendiente(digest)):
+        respuesta = send_from_directory(PENDIENTES, digest, mimetype='image/jpeg')
+        respuesta.cache_control.no_cache = True
+        return respuesta
+    abort(404)
+
+
+# === Migracion ===
+
+def migrar_fotos():
+    """
+    Procesa las fotos guardadas antes de este modulo (static/fotos_entrega/<archivo>)
+    y actualiza las remesas (activas y archivadas) que las usan.
+
+    Returns:
+        (fotos migradas, bytes antes, bytes despues)
+    """
+    from sqlalchemy import update
+    from models import db, Remesa, remesas_archivo
+
+    migradas = antes = despues = 0
+    for archivo in sorted(os.listdir(CARPETA)):
+        ruta = os.path.join(CARPETA, archivo)
+        if not os.path.isfile(ruta):
+            continue
+        with open(ruta, 'rb') as f:
+            nombre = guardar_foto(_Archivo(f), en_segundo_plano=False)
+        for tabla in (Remesa.__table__, remesas_archivo):
+            db.session.execute(update(tabla).where(tabla.c.foto_entrega == archivo).values(foto_entrega=nombre))
+        db.session.commit()
+
+        antes += os.path.getsize(ruta)
+        despues += os.path.getsize(_ruta(nombre))
+        os.remove(ruta)
+        migradas += 1
+    return migradas, antes, despues
+
+
+class _Archivo:
+    """Archivo local con la interfaz de FileStorage que usa guardar_foto()"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+
+if __name__ == '__main__':
+    import sys
+    sys.path.insert(0, RAIZ)
+    from app import crear_app
+
+    logging.basicConfig(level=logging.INFO)
+    app = crear_app()
+    with app.app_context():
+        migradas, antes, despues = migrar_fotos()
+    print(f'{migradas} fotos migradas: {antes / 1e6:.1f} MB -> {despues / 1e6:.1f} MB'
+          f"{'' if Image else ' (sin Pillow: no se redujeron)'}")
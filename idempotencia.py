@@ -0,0 +1,174 @@
+"""
+Claves de idempotencia para solicitudes que crean o cambian datos
+Con conexiones inestables el usuario reenvia formularios y la PWA reintenta
+POSTs: sin esto se duplican remesas o se descuenta dos veces el efectivo.
+
+Cada solicitud trae una clave unica: la cabecera Idempotency-Key (PWA, API)
+o el campo oculto _idempotencia que pone campo_idempotencia() en los
+formularios. La clave se reserva en la misma transaccion que la vista, asi
+que queda guardada si y solo si la vista hizo commit; despues se guarda la
+respuesta. Un reintento con la misma clave recibe esa respuesta sin volver a
+ejecutar la vista; si la original todavia se esta procesando se espera unos
+segundos a que termine.
+
+Las claves vencen a las TTL horas (limpiar_claves() en el scheduler).
+"""
+import hashlib
+import time
+import uuid
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import request, flash, redirect, jsonify, make_response
+from flask_login import current_user
+from markupsafe import Markup
+from sqlalchemy import event, select, update, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models import db, ClaveIdempotencia
+
+CABECERA = 'Idempotency-Key'
+CAMPO = '_idempotencia'
+TTL = timedelta(hours=24)
+# Un reintento que llega mientras la original se procesa espera hasta esto
+ESPERA_MAXIMA = 5.0
+INTERVALO_ESPERA = 0.2
+MAX_LARGO_CLAVE = 64
+
+
+@event.listens_for(Session, 'after_commit')
+def _marcar_commit(session):
+    if 'idempotencia' in session.info:
+        session.info['idempotencia'] = True
+
+
+def campo_idempotencia():
+    """Campo oculto con una clave nueva para los formularios (global de Jinja)"""
+    return Markup(f'<input type="hidden" name="{CAMPO}" value="{uuid.uuid4().hex}">')
+
+
+def _clave():
+    clave = request.headers.get(CABECERA) or request.form.get(CAMPO)
+    if not clave or len(clave) > MAX_LARGO_CLAVE:
+        return None
+    return clave
+
+
+def _huella():
+    """Hash de lo enviado: la misma clave con otros datos es un error del cliente"""
+    h = hashlib.sha256(request.path.encode())
+    for campo, valor in sorted(request.form.items(multi=True)):
+        if campo != CAMPO:
+            h.update(f'\0{campo}={valor}'.encode())
+    for campo, archivo in sorted(request.files.items(multi=True)):
+        h.update(f'\0{campo}@{archivo.filename}'.encode())
+    if request.is_json:
+        h.update(request.get_data())
+    return h.hexdigest()
+
+
+def _error(mensaje, status):
+    """Error en JSON para la PWA y la API; en formularios, mensaje y de vuelta al formulario"""
+    if request.headers.get(CABECERA):
+        respuesta = jsonify({'error': mensaje})
+        respuesta.status_code = status
+        if status == 409:
+            respuesta.headers['Retry-After'] = '1'
+        return respuesta
+    flash(mensaje, 'warning')
+    return redirect(request.url)
+
+
+def _repetir(registro):
+    """Respuesta guardada de la solicitud original"""
+    respuesta = make_response(registro.cuerpo or b'', registro.status)
+    if registro.tipo_contenido:
+        respuesta.headers['Content-Type'] = registro.tipo_contenido
+    if registro.ubicacion:
+        respuesta.headers['Location'] = registro.ubicacion
+        if not request.headers.get(CABECERA):
+            flash('Esta solicitud ya se habia procesado', 'info')
+    respuesta.headers['Idempotent-Replayed'] = 'true'
+    return respuesta
+
+
+def _guardar(id, respuesta):
+    db.session.execute(update(ClaveIdempotencia).where(ClaveIdempotencia.id == id).values(
+        estado='completa',
+        status=respuesta.status_code,
+        tipo_contenido=respuesta.headers.get('Content-Type'),
+        ubicacion=respuesta.headers.get('Location'),
+        cuerpo=respuesta.get_data()
+    ))
+    db.session.commit()
+
+
+def idempotente(vista):
+    """
+    Decorador para vistas POST que crean o cambian datos. Sin clave la vista
+    se ejecuta igual que siempre. Va debajo de login_required.
+    """
+    @wraps(vista)
+    def envoltura(*args, **kwargs):
+        clave = _clave() if request.method == 'POST' else None
+        if not clave:
+            return vista(*args, **kwargs)
+
+        usuario_id = int(current_user.get_id()) if current_user.is_authenticated else 0
+        huella = _huella()
+        limite = time.monotonic() + ESPERA_MAXIMA
+        while True:
+            registro = ClaveIdempotencia(
+                clave=clave, usuario_id=usuario_id, endpoint=request.endpoint,
+                huella=huella, expira=datetime.utcnow() + TTL
+            )
+            db.session.add(registro)
+            try:
+                db.session.flush()
+                break
+            except IntegrityError:
+                db.session.rollback()
+
+            existente = db.session.execute(select(ClaveIdempotencia).where(
+                ClaveIdempotencia.usuario_id == usuario_id, ClaveIdempotencia.clave == clave
+            )).scalar_one_or_none()
+            if existente is None:
+                continue  # La original fallo y libero la clave
+            if existente.endpoint != request.endpoint or existente.huella != huella:
+                db.session.rollback()
+                return _error('Este formulario ya se envio con otros datos. Reviselo y envielo de nuevo.', 422)
+            if existente.estado == 'completa':
+                respuesta = _repetir(existente)
+                db.session.rollback()
+                return respuesta
+            # Cerrar la transaccion de lectura para ver el commit de la original
+            db.session.rollback()
+            if time.monotonic() >= limite:
+                return _error('La solicitud anterior todavia se esta procesando', 409)
+            time.sleep(INTERVALO_ESPERA)
+
+        id = registro.id
+        db.session.info['idempotencia'] = False
+        try:
+            respuesta = make_response(vista(*args, **kwargs))
+        except Exception:
+            if db.session.info.pop('idempotencia', False):
+                # La vista ya guardo sus cambios: un reintento no debe repetirlos
+                db.session.rollback()
+                _guardar(id, make_response('Error procesando la solicitud', 500))
+            raise
+        if db.session.info.pop('idempotencia', False):
+            _guardar(id, respuesta)
+        else:
+            # Sin commit (validacion fallida, error): la clave queda libre para reintentar
+            db.session.rollback()
+        return respuesta
+    return envoltura
+
+
+def limpiar_claves():
+    """Borra las claves vencidas. Returns: cantidad borrada"""
+    resultado = db.session.execute(
+        delete(ClaveIdempotencia).where(ClaveIdempotencia.expira < datetime.utcnow())
+    )
+    db.session.commit()
+    return resultado.rowcount
@@ -0,0 +1,246 @@
+"""
+Importacion masiva de remesas desde CSV
+El archivo se decodifica entero antes de guardar nada (un byte que no es
+UTF-8 en la fila 800 no puede dejar importados los primeros lotes y
+reportarse como archivo ilegible), luego cada fila se valida y se le aplican las mismas reglas de precio que a una remesa individual, y
+las filas validas se guardan por lotes: un INSERT multiple de remesas, uno
+de movimientos contables (o de cargos del revendedor) y un commit por lote.
+"""
+import csv
+import io
+import itertools
+import logging
+from datetime import datetime
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from models import db, Remesa, Usuario, MovimientoContable
+from tarifas import montos_remesa, montos_remesa_revendedor
+from cuentas_revendedor import calcular_cargo, registrar_cargos_lote
+from directorio import registrar_contactos
+from perfiles import marcar_remesas
+import eventos
+
+logger = logging.getLogger(__name__)
+
+TAMANO_LOTE = 500
+
+COLUMNAS_OBLIGATORIAS = ('remitente_nombre', 'beneficiario_nombre', 'monto_envio')
+COLUMNAS_OPCIONALES = (
+    'remitente_telefono', 'beneficiario_telefono', 'beneficiario_direccion',
+    'tipo_entrega', 'tasa_entrega', 'repartidor', 'notas'
+)
+LARGO_MAXIMO = {
+    'remitente_nombre': 100, 'beneficiario_nombre': 100,
+    'remitente_telefono': 20, 'beneficiario_telefono': 20
+}
+
+
+class ErrorImportacion(Exception):
+    """El archivo completo no se puede importar (encabezados invalidos, etc.)"""
+
+
+def _leer_filas(archivo):
+    """
+    Itera las filas del CSV como dicts con encabezados normalizados.
+    Acepta coma o punto y coma (Excel en espanol exporta con ;).
+    """
+    try:
+        texto = io.StringIO(archivo.read().decode('utf-8-sig'), newline='')
+    except UnicodeDecodeError as e:
+        raise ErrorImportacion(f'El archivo no esta en UTF-8 (byte {e.start}); '
+                               'guardelo como "CSV UTF-8" e intente de nuevo')
+    encabezado = texto.readline()
+    separador = ';' if encabezado.count(';') > encabezado.count(',') else ','
+
+    lector = csv.reader(itertools.chain([encabezado], texto), delimiter=separador)
+    columnas = [c.strip().lower() for c in next(lector, [])]
+    faltantes = [c for c in COLUMNAS_OBLIGATORIAS if c not in columnas]
+    if faltantes:
+        raise ErrorImportacion(f'Faltan columnas obligatorias: {", ".join(faltantes)}')
+
+    for valores in lector:
+        yield dict(zip(columnas, (v.strip() for v in valores)))
+
+
+def _numero(valor, campo):
+    try:
+        numero = float(valor.replace(',', '.'))
+    except (ValueError, AttributeError):
+        raise ValueError(f'{campo} no es un numero: "{valor}"')
+    if numero <= 0:
+        raise ValueError(f'{campo} debe ser mayor que 0')
+    return numero
+
+
+def _preparar_fila(fila, usuario, tasa, repartidores):
+    """
+    Valida una fila y arma los valores de la remesa.
+    Lanza ValueError con un mensaje para el reporte si la fila es invalida.
+    """
+    for campo in COLUMNAS_OBLIGATORIAS:
+        if not fila.get(campo):
+            raise ValueError(f'Falta {campo}')
+    for campo, largo in LARGO_MAXIMO.items():
+        if len(fila.get(campo) or '') > largo:
+            raise ValueError(f'{campo} excede {largo} caracteres')
+
+    monto_envio = _numero(fila['monto_envio'], 'monto_envio')
+
+    tipo_entrega = (fila.get('tipo_entrega') or 'MN').upper()
+    if tipo_entrega == 'CUP':
+        tipo_entrega = 'MN'
+    if tipo_entrega not in ('MN', 'USD'):
+        raise ValueError(f'tipo_entrega invalido: "{fila["tipo_entrega"]}" (use MN o USD)')
+
+    valores = {
+        'codigo': Remesa.generar_codigo(),
+        'remitente_nombre': fila['remitente_nombre'],
+        'remitente_telefono': fila.get('remitente_telefono', ''),
+        'beneficiario_nombre': fila['beneficiario_nombre'],
+        'beneficiario_telefono': fila.get('beneficiario_telefono', ''),
+        'beneficiario_direccion': fila.get('beneficiario_direccion', ''),
+        'notas': fila.get('notas', ''),
+        'creado_por': usuario.id,
+        'estado': 'pendiente',
+        'repartidor_id': None,
+        'revendedor_id': None
+    }
+
+    if usuario.es_revendedor():
+        # El revendedor siempre usa la tasa del dia, igual que en el formulario
+        valores.update(montos_remesa_revendedor(usuario, monto_envio, tipo_entrega, tasa))
+        valores['revendedor_id'] = usuario.id
+        return valores
+
+    tasa_entrega = None
+    if tipo_entrega != 'USD':
+        tasa_entrega = _numero(fila['tasa_entrega'], 'tasa_entrega') if fila.get('tasa_entrega') else tasa
+    valores.update(montos_remesa(monto_envio, tipo_entrega, tasa_entrega))
+
+    if fila.get('repartidor'):
+        repartidor_id = repartidores.get(fila['repartidor'].lower())
+        if not repartidor_id:
+            raise ValueError(f'Repartidor desconocido: "{fila["repartidor"]}"')
+        valores['repartidor_id'] = repartidor_id
+        valores['estado'] = 'en_proceso'
+
+    return valores
+
+
+def _insertar_lote(lote, usuario):
+    """INSERT multiple de remesas, de sus movimientos o cargos y del directorio. Sin commit."""
+    ahora = datetime.utcnow()
+    for _, valores in lote:
+        valores['fecha_creacion'] = ahora
+
+    db.session.execute(insert(Remesa), [valores for _, valores in lote])
+
+    codigos = [valores['codigo'] for _, valores in lote]
+    ids = dict(db.session.execute(
+        select(Remesa.codigo, Remesa.id).where(Remesa.codigo.in_(codigos))
+    ).all())
+
+    if usuario.es_revendedor():
+        registrar_cargos_lote(usuario.id, [{
+            'remesa_id': ids[v['codigo']],
+            'monto': calcular_cargo(usuario, v['monto_envio'], v['comision_plataforma']),
+            'concepto': f'Remesa {v["codigo"]}',
+            'fecha': ahora
+        } for _, v in lote])
+    else:
+        db.session.execute(insert(MovimientoContable), [{
+            'tipo': 'ingreso',
+            'concepto': f'Comision remesa {v["codigo"]}',
+            'monto': v['total_comision'],
+            'remesa_id': ids[v['codigo']],
+            'usuario_id': usuario.id,
+            'fecha': ahora
+        } for _, v in lote])
+
+    registrar_contactos(valores for _, valores in lote)
+    marcar_remesas(ids.values())
+    eventos.registrar('remesas_importadas', {'cantidad': len(ids)})
+    return ids
+
+
+def _guardar_lote(lote, usuario, resumen):
+    """Guarda un lote en su propia transaccion; si falla, todas sus filas van al reporte"""
+    ids = None
+    for intento in range(2):
+        try:
+            ids = _insertar_lote(lote, usuario)
+            db.session.commit()
+            break
+        except IntegrityError:
+            # Casi seguro un codigo repetido: se regeneran y se reintenta una vez
+            db.session.rollback()
+            ids = None
+            for _, valores in lote:
+                valores['codigo'] = Remesa.generar_codigo()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            ids = None
+            logger.error(f"Error guardando lote de importacion: {e}")
+            break
+
+    if ids is None:
+        resumen['errores'].extend(
+            {'fila': n, 'error': 'No se pudo guardar el lote; reintente estas filas'} for n, _ in lote
+        )
+        return
+
+    resumen['importadas'] += len(lote)
+    for _, valores in lote:
+        if valores['repartidor_id']:
+            resumen['por_repartidor'].setdefault(valores['repartidor_id'], []).append(ids[valores['codigo']])
+
+
+def importar_remesas(archivo, usuario, tasa):
+    """
+    Importa remesas desde un CSV.
+
+    Args:
+        archivo: Stream binario del CSV (p. ej. FileStorage.stream)
+        usuario: Admin o revendedor que importa; define reglas de precio
+        tasa: Tasa USD->CUP por defecto para entregas MN
+
+    Returns:
+        dict con 'importadas', 'errores' (lista de {'fila', 'error'}) y
+        'por_repartidor' (repartidor_id -> ids asignados)
+
+    Raises:
+        ErrorImportacion si el archivo no es UTF-8 o no tiene las columnas
+        obligatorias (en ambos casos antes de guardar ninguna fila)
+    """
+    repartidores = {}
+    if not usuario.es_revendedor():
+        repartidores = {
+            username.lower(): id for id, username in db.session.execute(
+                select(Usuario.id, Usuario.username).where(
+                    Usuario.rol == 'repartidor', Usuario.activo == True
+                )
+            ).all()
+        }
+
+    resumen = {'importadas': 0, 'errores': [], 'por_repartidor': {}}
+    lote = []
+
+    # La fila 1 es el encabezado
+    for numero, fila in enumerate(_leer_filas(archivo), start=2):
+        if not any(fila.values()):
+            continue
+        try:
+            lote.append((numero, _preparar_fila(fila, usuario, tasa, repartidores)))
+        except ValueError as e:
+            resumen['errores'].append({'fila': numero, 'error': str(e)})
+
+        if len(lote) >= TAMANO_LOTE:
+            _guardar_lote(lote, usuario, resumen)
+            lote = []
+
+    if lote:
+        _guardar_lote(lote, usuario, resumen)
+
+    logger.info(f"Importacion de {usuario.username}: {resumen['importadas']} remesas, "
+                f"{len(resumen['errores'])} filas con error")
+    return resumen
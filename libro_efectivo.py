@@ -0,0 +1,202 @@
+"""
+Libro de efectivo de repartidores
+Cierres diarios del saldo por repartidor y moneda. El saldo en cualquier
+momento se obtiene leyendo un cierre y sumando los pocos movimientos
+posteriores, sin recorrer todo el historial.
+Los dias se cierran en UTC, igual que MovimientoEfectivo.fecha.
+"""
+import logging
+from datetime import datetime, date, time, timedelta
+from sqlalchemy import func, select, case, delete, insert, and_, or_, union
+from models import db, MovimientoEfectivo, CierreEfectivo, Configuracion
+
+logger = logging.getLogger(__name__)
+
+# Configuracion: ultimo dia cerrado (YYYY-MM-DD)
+CLAVE_CERRADO_HASTA = 'efectivo_cerrado_hasta'
+
+
+def monto_firmado():
+    """
+    Expresion SQL con el efecto de cada movimiento sobre el saldo.
+    Suman: asignacion, recogida y el CUP recibido en una venta de USD.
+    Restan: retiro, entrega y el USD vendido.
+    """
+    M = MovimientoEfectivo
+    entra = or_(
+        M.tipo.in_(['asignacion', 'recogida']),
+        and_(M.tipo == 'venta_usd', M.moneda == 'CUP')
+    )
+    return case((entra, M.monto), else_=-M.monto)
+
+
+def _a_fecha(valor):
+    """func.date() devuelve texto en SQLite y date en otros motores"""
+    if isinstance(valor, date):
+        return valor
+    return date.fromisoformat(str(valor)[:10])
+
+
+def _inicio(dia):
+    return datetime.combine(dia, time.min)
+
+
+def cerrar_dia(dia):
+    """
+    Crea (o recrea) los cierres de un dia para todos los repartidores
+    que tuvieron movimientos ese dia. Los grupos sin movimientos no
+    necesitan cierre: su ultimo cierre sigue siendo valido.
+    No hace commit. Retorna la cantidad de cierres creados.
+    """
+    M = MovimientoEfectivo
+    C = CierreEfectivo
+    inicio = _inicio(dia)
+    corte = inicio + timedelta(days=1)
+
+    db.session.execute(delete(C).where(C.fecha == dia))
+
+    del_dia = db.session.execute(
+        select(M.repartidor_id, M.moneda, func.sum(monto_firmado()), func.count(M.id))
+        .where(M.fecha >= inicio, M.fecha < corte)
+        .group_by(M.repartidor_id, M.moneda)
+    ).all()
+    if not del_dia:
+        return 0
+
+    # Ultimo cierre anterior de cada repartidor y moneda
+    ultimo = select(
+        C.repartidor_id, C.moneda, func.max(C.fecha).label('fecha')
+    ).where(C.fecha < dia).group_by(C.repartidor_id, C.moneda).subquery()
+
+    anteriores = {
+        (rid, moneda): saldo
+        for rid, moneda, saldo in db.session.execute(
+            select(C.repartidor_id, C.moneda, C.saldo).join(ultimo, and_(
+                C.repartidor_id == ultimo.c.repartidor_id,
+                C.moneda == ultimo.c.moneda,
+                C.fecha == ultimo.c.fecha
+            ))
+        ).all()
+    }
+
+    filas = [{
+        'repartidor_id': rid,
+        'moneda': moneda,
+        'fecha': dia,
+        'corte': corte,
+        'saldo': (anteriores.get((rid, moneda)) or 0) + (neto or 0),
+        'movimientos': cantidad,
+        'fecha_creacion': datetime.utcnow()
+    } for rid, moneda, neto, cantidad in del_dia]
+
+    db.session.execute(insert(C), filas)
+    return len(filas)
+
+
+def cerrar_pendientes(hasta=None):
+    """
+    Cierra todos los dias pendientes hasta `hasta` (por defecto ayer).
+    Solo visita dias con movimientos o con cierres que haya que rehacer.
+
+    Returns:
+        cantidad de cierres creados
+    """
+    M = MovimientoEfectivo
+    C = CierreEfectivo
+    hasta = hasta or (datetime.utcnow().date() - timedelta(days=1))
+
+    cerrado_hasta = Configuracion.obtener(CLAVE_CERRADO_HASTA)
+    desde = date.fromisoformat(cerrado_hasta) + timedelta(days=1) if cerrado_hasta else None
+    if desde and desde > hasta:
+        return 0
+
+    dias_mov = select(func.date(M.fecha).label('dia')).where(M.fecha < _inicio(hasta + timedelta(days=1)))
+    dias_cierre = select(C.fecha.label('dia')).where(C.fecha <= hasta)
+    if desde:
+        dias_mov = dias_mov.where(M.fecha >= _inicio(desde))
+        dias_cierre = dias_cierre.where(C.fecha >= desde)
+
+    dias = sorted({_a_fecha(d) for d, in db.session.execute(union(dias_mov, dias_cierre)).all()})
+
+    creados = 0
+    for dia in dias:
+        creados += cerrar_dia(dia)
+
+    db.session.commit()
+    Configuracion.establecer(CLAVE_CERRADO_HASTA, hasta.isoformat(), 'Ultimo dia con cierre de efectivo')
+    logger.info(f"Cierres de efectivo hasta {hasta}: {creados} en {len(dias)} dias")
+    return creados
+
+
+def invalidar_cierres(desde_dia):
+    """
+    Descarta los cierres desde un dia (p.ej. al borrar movimientos pasados)
+    para que el proximo cierre programado los recalcule. No hace commit.
+    """
+    db.session.execute(delete(CierreEfectivo).where(CierreEfectivo.fecha >= desde_dia))
+
+    cerrado_hasta = Configuracion.query.filter_by(clave=CLAVE_CERRADO_HASTA).first()
+    anterior = desde_dia - timedelta(days=1)
+    if cerrado_hasta and date.fromisoformat(cerrado_hasta.valor) > anterior:
+        cerrado_hasta.valor = anterior.isoformat()
+
+
+def saldo_en(repartidor_id, moneda, momento):
+    """
+    Saldo de un repartidor en una moneda en un instante dado.
+    Lee el ultimo cierre anterior y suma solo los movimientos desde su corte.
+    """
+    M = MovimientoEfectivo
+    C = CierreEfectivo
+
+    cierre = db.session.execute(
+        select(C.saldo, C.corte).where(
+            C.repartidor_id == repartidor_id,
+            C.moneda == moneda,
+            C.corte <= momento
+        ).order_by(C.corte.desc()).limit(1)
+    ).first()
+
+    consulta = select(func.coalesce(func.sum(monto_firmado()), 0)).where(
+        M.repartidor_id == repartidor_id,
+        M.moneda == moneda,
+        M.fecha < momento
+    )
+    base = 0.0
+    if cierre:
+        base = cierre.saldo
+        consulta = consulta.where(M.fecha >= cierre.corte)
+
+    return base + (db.session.execute(consulta).scalar() or 0)
+
+
+def libro(repartidor_id, moneda, desde, hasta, pagina=1, por_pagina=100):
+    """
+    Movimientos de un rango con saldo corrido.
+    El saldo de apertura sale de saldo_en(); el corrido se calcula en SQL
+    con una suma de ventana, asi cualquier pagina muestra el saldo correcto.
+
+    Returns:
+        dict con apertura, cierre, filas [(movimiento, efecto, saldo)] y hay_mas
+    """
+    M = MovimientoEfectivo
+    apertura = saldo_en(repartidor_id, moneda, desde)
+
+    efecto = monto_firmado()
+    corrido = (apertura + func.sum(efecto).over(order_by=(M.fecha, M.id))).label('saldo')
+
+    filas = db.session.execute(
+        select(M, efecto.label('efecto'), corrido).where(
+            M.repartidor_id == repartidor_id,
+            M.moneda == moneda,
+            M.fecha >= desde,
+            M.fecha < hasta
+        ).order_by(M.fecha, M.id).limit(por_pagina + 1).offset((pagina - 1) * por_pagina)
+    ).all()
+
+    return {
+        'apertura': apertura,
+        'cierre': saldo_en(repartidor_id, moneda, hasta),
+        'filas': filas[:por_pagina],
+        'hay_mas': len(filas) > por_pagina
+    }
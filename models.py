@@ -2,6 +2,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from sqlalchemy.schema import CreateColumn
 import uuid
 
 db = SQLAlchemy()
@@ -47,6 +48,17 @@ class Usuario(UserMixin, db.Model):
 
 class Remesa(db.Model):
     __tablename__ = 'remesas'
+    __table_args__ = (
+        # Consultas de trabajo activo: por estado y por repartidor
+        db.Index('ix_remesas_estado_fecha', 'estado', 'fecha_creacion'),
+        db.Index('ix_remesas_repartidor_estado', 'repartidor_id', 'estado'),
+        # Sincronizacion incremental de la PWA del repartidor (ver sincronizacion.py)
+        db.Index('ix_remesas_repartidor_actualizado', 'repartidor_id', 'actualizado_en'),
+        # Version de los datos de los calculos compartidos (ver calculo_compartido.py)
+        db.Index('ix_remesas_actualizado', 'actualizado_en'),
+        # Ids nunca reutilizados: los archivados no deben repetirse (ver archivo.py)
+        {'sqlite_autoincrement': True},
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     codigo = db.Column(db.String(20), unique=True, nullable=False)
@@ -89,6 +101,8 @@ class Remesa(db.Model):
     # Fechas
     fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
     fecha_entrega = db.Column(db.DateTime, nullable=True)
+    # Ultima escritura de la fila (ORM o UPDATE en bloque); base de los ETag (ver cache_http.py)
+    actualizado_en = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Facturacion
     facturada = db.Column(db.Boolean, default=False)
@@ -180,8 +194,172 @@ class PagoRevendedor(db.Model):
     admin = db.relationship('Usuario', foreign_keys=[registrado_por])
 
 
+class CargoRevendedor(db.Model):
+    """Libro de cargos de revendedores (solo insercion, nunca se edita)"""
+    __tablename__ = 'cargos_revendedor'
+
+    id = db.Column(db.Integer, primary_key=True)
+    revendedor_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False, index=True)
+    remesa_id = db.Column(db.Integer, db.ForeignKey('remesas.id'), nullable=True, index=True)
+    tipo = db.Column(db.String(20), nullable=False, default='remesa')  # remesa, ajuste
+    monto = db.Column(db.Float, nullable=False)
+    concepto = db.Column(db.String(200))
+    fecha = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Relaciones
+    revendedor = db.relationship('Usuario', foreign_keys=[revendedor_id], backref='cargos')
+    remesa = db.relationship('Remesa', backref='cargos_revendedor')
+
+
+class Remitente(db.Model):
+    """Directorio de clientes que envian, uno por telefono normalizado (ver directorio.py)"""
+    __tablename__ = 'remitentes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    telefono_normalizado = db.Column(db.String(20), unique=True, nullable=False)  # Ultimos 10 digitos
+    telefono = db.Column(db.String(20))  # Como se escribio la ultima vez
+    nombre = db.Column(db.String(100), nullable=False)
+    usos = db.Column(db.Integer, default=0, nullable=False)
+    ultimo_uso = db.Column(db.DateTime, index=True)
+
+    beneficiarios = db.relationship('Beneficiario', backref='remitente', lazy='dynamic')
+
+
+class Beneficiario(db.Model):
+    """Beneficiarios de cada remitente, uno por nombre normalizado"""
+    __tablename__ = 'beneficiarios'
+    __table_args__ = (
+        db.UniqueConstraint('remitente_id', 'clave', name='uq_beneficiario_remitente_clave'),
+        # Frecuentes de un remitente: una sola lectura del indice
+        db.Index('ix_beneficiarios_remitente_usos', 'remitente_id', 'usos', 'ultimo_uso'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    remitente_id = db.Column(db.Integer, db.ForeignKey('remitentes.id'), nullable=False)
+    clave = db.Column(db.String(100), nullable=False)  # Nombre sin acentos ni mayusculas
+    nombre = db.Column(db.String(100), nullable=False)
+    telefono = db.Column(db.String(20))
+    direccion = db.Column(db.Text)
+    usos = db.Column(db.Integer, default=0, nullable=False)
+    ultimo_uso = db.Column(db.DateTime, index=True)
+
+
+class PerfilCliente(db.Model):
+    """Perfil precalculado de un remitente para el formulario publico (ver perfiles.py)"""
+    __tablename__ = 'perfiles_cliente'
+
+    telefono_normalizado = db.Column(db.String(20), primary_key=True)
+    version = db.Column(db.Integer, default=1, nullable=False)  # Base del ETag
+    datos = db.Column(db.Text, nullable=False)  # JSON listo para responder
+    actualizado = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class BajaRemesa(db.Model):
+    """Remesa que dejo de estar asignada a un repartidor (ver sincronizacion.py)"""
+    __tablename__ = 'remesas_bajas'
+    __table_args__ = (
+        db.Index('ix_remesas_bajas_repartidor_fecha', 'repartidor_id', 'fecha'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    remesa_id = db.Column(db.Integer, nullable=False)  # Sin FK: la remesa puede haberse borrado
+    repartidor_id = db.Column(db.Integer, nullable=False)
+    fecha = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class ClaveIdempotencia(db.Model):
+    """Resultado de una solicitud con clave de idempotencia (ver idempotencia.py)"""
+    __tablename__ = 'claves_idempotencia'
+    __table_args__ = (
+        db.UniqueConstraint('usuario_id', 'clave', name='uq_clave_idempotencia_usuario'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    clave = db.Column(db.String(64), nullable=False)
+    usuario_id = db.Column(db.Integer, nullable=False, default=0)  # 0 = formulario publico
+    endpoint = db.Column(db.String(80), nullable=False)
+    huella = db.Column(db.String(64), nullable=False)  # Hash de los datos enviados
+    estado = db.Column(db.String(20), nullable=False, default='en_curso')  # en_curso, completa
+    status = db.Column(db.Integer)
+    tipo_contenido = db.Column(db.String(100))
+    ubicacion = db.Column(db.String(500))  # Location de las redirecciones
+    cuerpo = db.Column(db.LargeBinary)
+    creada = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expira = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class SubidaFoto(db.Model):
+    """Subida reanudable de una foto de entrega (ver subidas.py)"""
+    __tablename__ = 'subidas_foto'
+
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex, va en la URL
+    remesa_id = db.Column(db.Integer, db.ForeignKey('remesas.id'), nullable=False)
+    repartidor_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
+    tamano = db.Column(db.Integer, nullable=False)  # Bytes anunciados al crearla
+    estado = db.Column(db.String(20), nullable=False, default='abierta')  # abierta, completa
+    foto = db.Column(db.String(255))  # Nombre en fotos.py al completarse
+    creada = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
+class Evento(db.Model):
+    """Evento del feed en vivo (ver eventos.py); el id es el Last-Event-ID"""
+    __tablename__ = 'eventos'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(30), nullable=False)
+    para_admins = db.Column(db.Boolean, nullable=False, default=True)
+    usuario_id = db.Column(db.Integer, nullable=True)  # Repartidor o revendedor que tambien lo recibe
+    datos = db.Column(db.Text, nullable=False)  # JSON
+    fecha = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
+class VersionDatos(db.Model):
+    """Contador por dia de las escrituras que afectan a los reportes (ver cache_reportes.py)"""
+    __tablename__ = 'versiones_datos'
+
+    dia = db.Column(db.Date, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class CacheReporte(db.Model):
+    """Resultado guardado de un reporte para un rango de fechas (ver cache_reportes.py)"""
+    __tablename__ = 'cache_reportes'
+    __table_args__ = (
+        db.UniqueConstraint('reporte', 'desde', 'hasta', name='uq_cache_reportes_rango'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    reporte = db.Column(db.String(50), nullable=False)
+    desde = db.Column(db.String(32), nullable=False, default='')  # '' = sin limite
+    hasta = db.Column(db.String(32), nullable=False, default='')
+    version = db.Column(db.Integer, nullable=False)  # Suma de versiones_datos del rango al calcularlo
+    cerrado = db.Column(db.Boolean, nullable=False, default=False)  # Rango terminado antes de hoy
+    datos = db.Column(db.Text, nullable=False)  # JSON
+    creado = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
+class TrabajoReporte(db.Model):
+    """Calculo de un reporte grande en segundo plano (ver trabajos_reporte.py)"""
+    __tablename__ = 'trabajos_reporte'
+    __table_args__ = (
+        db.UniqueConstraint('reporte', 'desde', 'hasta', 'version', name='uq_trabajos_reporte_rango'),
+    )
+
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex, va en la URL
+    reporte = db.Column(db.String(50), nullable=False)
+    desde = db.Column(db.String(32), nullable=False, default='')
+    hasta = db.Column(db.String(32), nullable=False, default='')
+    version = db.Column(db.Integer, nullable=False)  # Version del rango al pedirlo
+    estado = db.Column(db.String(20), nullable=False, default='pendiente')  # pendiente, en_curso, completo, error
+    progreso = db.Column(db.Integer, nullable=False, default=0)  # 0 a 100
+    error = db.Column(db.Text)
+    creado = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    terminado = db.Column(db.DateTime)
+
+
 class MovimientoContable(db.Model):
     __tablename__ = 'movimientos_contables'
+    __table_args__ = {'sqlite_autoincrement': True}
 
     id = db.Column(db.Integer, primary_key=True)
     tipo = db.Column(db.String(20), nullable=False)
@@ -195,6 +373,31 @@ class MovimientoContable(db.Model):
     usuario = db.relationship('Usuario', backref='movimientos')
 
 
+def _tabla_archivo(modelo, nombre, *indices):
+    """
+    Tabla con las mismas columnas (y en el mismo orden) que la del modelo,
+    sin claves foraneas ni defaults: guarda filas archivadas con su id original.
+    """
+    columnas = [
+        db.Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable)
+        for c in modelo.__table__.columns
+    ]
+    return db.Table(nombre, db.metadata, *columnas, *indices)
+
+
+# Remesas entregadas/canceladas antiguas y sus movimientos contables (ver archivo.py)
+remesas_archivo = _tabla_archivo(
+    Remesa, 'remesas_archivo',
+    db.Index('ix_remesas_archivo_codigo', 'codigo', unique=True),
+    db.Index('ix_remesas_archivo_fecha_creacion', 'fecha_creacion'),
+)
+
+movimientos_contables_archivo = _tabla_archivo(
+    MovimientoContable, 'movimientos_contables_archivo',
+    db.Index('ix_mov_contables_archivo_fecha', 'fecha'),
+)
+
+
 class MovimientoEfectivo(db.Model):
     """Registro de movimientos de efectivo de repartidores"""
     __tablename__ = 'movimientos_efectivo'
@@ -217,6 +420,31 @@ class MovimientoEfectivo(db.Model):
     admin = db.relationship('Usuario', foreign_keys=[registrado_por])
     remesa = db.relationship('Remesa', backref='movimiento_efectivo')
 
+    __table_args__ = (
+        db.Index('ix_mov_efectivo_repartidor_moneda_fecha', 'repartidor_id', 'moneda', 'fecha'),
+    )
+
+
+class CierreEfectivo(db.Model):
+    """Saldo de efectivo de un repartidor al cierre de un dia (punto de control)"""
+    __tablename__ = 'cierres_efectivo'
+
+    id = db.Column(db.Integer, primary_key=True)
+    repartidor_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
+    moneda = db.Column(db.String(10), nullable=False)  # USD o CUP
+    fecha = db.Column(db.Date, nullable=False)  # Dia cerrado
+    corte = db.Column(db.DateTime, nullable=False)  # Inicio del dia siguiente (limite exclusivo)
+    saldo = db.Column(db.Float, nullable=False)  # Saldo al corte
+    movimientos = db.Column(db.Integer, default=0)  # Movimientos del dia cerrado
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+
+    repartidor = db.relationship('Usuario', foreign_keys=[repartidor_id])
+
+    __table_args__ = (
+        db.UniqueConstraint('repartidor_id', 'moneda', 'fecha', name='uq_cierre_efectivo_dia'),
+        db.Index('ix_cierre_efectivo_repartidor_moneda_corte', 'repartidor_id', 'moneda', 'corte'),
+    )
+
 
 class Configuracion(db.Model):
     __tablename__ = 'configuracion'
@@ -256,3 +484,21 @@ class SuscripcionPush(db.Model):
 
     # Relacion con usuario (opcional, para suscripciones anonimas)
     usuario = db.relationship('Usuario', backref='suscripciones_push')
+
+
+def asegurar_esquema():
+    """
+    db.create_all() solo crea tablas nuevas.
+    Agrega las columnas y crea los indices agregados despues sobre tablas
+    que ya existian. Las columnas nuevas deben admitir NULL.
+    """
+    inspector = db.inspect(db.engine)
+    for tabla in db.metadata.sorted_tables:
+        existentes = {c['name'] for c in inspector.get_columns(tabla.name)}
+        for columna in tabla.columns:
+            if columna.name not in existentes:
+                ddl = CreateColumn(columna).compile(dialect=db.engine.dialect)
+                with db.engine.begin() as conexion:
+                    conexion.execute(db.text(f'ALTER TABLE {tabla.name} ADD COLUMN {ddl}'))
+        for indice in tabla.indexes:
+            indice.create(db.engine, checkfirst=True)
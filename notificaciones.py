@@ -210,6 +210,30 @@ Beneficiario: {remesa.beneficiario_nombre}"""
     return enviar_whatsapp(repartidor.telefono, mensaje)
 
 
+def notificar_lote_remesas(repartidor, remesas):
+    """
+    Notifica a un repartidor (Cuba) un lote de remesas asignadas
+    en un solo WhatsApp en lugar de uno por remesa
+    """
+    if len(remesas) == 1:
+        return notificar_nueva_remesa(repartidor, remesas[0])
+
+    if not repartidor.telefono:
+        logger.warning(f"Repartidor {repartidor.nombre} sin telefono")
+        return {'exito': False, 'error': 'Sin telefono configurado'}
+
+    lineas = [
+        f"- {r.codigo}: {r.beneficiario_nombre}, {r.monto_entrega:.2f} {r.moneda_entrega}"
+        f"\n  {r.beneficiario_direccion or 'Sin direccion'}"
+        for r in remesas
+    ]
+    mensaje = f"""*{len(remesas)} Remesas Asignadas*
+
+""" + '\n'.join(lineas)
+
+    return enviar_whatsapp(repartidor.telefono, mensaje)
+
+
 def notificar_remitente(remesa):
     """
     Notifica al remitente/cliente (USA) que su remesa fue creada
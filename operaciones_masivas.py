@@ -0,0 +1,223 @@
+"""
+Operaciones masivas sobre remesas
+Cada operacion resuelve todas las remesas con una consulta IN y aplica los
+cambios con sentencias set-based, por lotes para respetar el limite de
+parametros de SQLite. El costo es un numero fijo de sentencias por lote,
+no por remesa.
+"""
+import logging
+from datetime import datetime
+from sqlalchemy import select, delete, update, func, case
+from models import db, Remesa, MovimientoContable, MovimientoEfectivo, CargoRevendedor
+from libro_efectivo import invalidar_cierres
+from perfiles import marcar_remesas
+import eventos
+
+logger = logging.getLogger(__name__)
+
+# SQLite antiguo admite 999 parametros por sentencia; 500 deja margen
+TAMANO_LOTE = 500
+
+
+def _lotes(items, tamano=TAMANO_LOTE):
+    for i in range(0, len(items), tamano):
+        yield items[i:i + tamano]
+
+
+def eliminar_remesas(codigos):
+    """
+    Elimina remesas por codigo junto con sus movimientos contables y de
+    efectivo. Los cargos de revendedor se conservan (el libro es de solo
+    insercion) pero se desvinculan de la remesa eliminada.
+
+    Returns:
+        dict con 'eliminadas' y 'no_encontradas' (listas de codigos)
+    """
+    codigos = list(dict.fromkeys(codigos))  # Sin duplicados, conserva el orden
+    encontrados = set()
+    primer_movimiento = None
+
+    for lote in _lotes(codigos):
+        filas = db.session.execute(
+            select(Remesa.id, Remesa.codigo).where(Remesa.codigo.in_(lote))
+        ).all()
+        if not filas:
+            continue
+
+        ids = [f.id for f in filas]
+        encontrados.update(f.codigo for f in filas)
+
+        # Si se borran movimientos de efectivo de dias ya cerrados, hay que recalcular esos cierres
+        fecha = db.session.execute(
+            select(func.min(MovimientoEfectivo.fecha)).where(MovimientoEfectivo.remesa_id.in_(ids))
+        ).scalar()
+        if fecha and (primer_movimiento is None or fecha < primer_movimiento):
+            primer_movimiento = fecha
+
+        # Antes de borrar: marcar_remesas lee el telefono de cada remesa
+        marcar_remesas(ids)
+
+        opciones = {'synchronize_session': False}
+        db.session.execute(
+            delete(MovimientoContable).where(MovimientoContable.remesa_id.in_(ids)),
+            execution_options=opciones
+        )
+        db.session.execute(
+            delete(MovimientoEfectivo).where(MovimientoEfectivo.remesa_id.in_(ids)),
+            execution_options=opciones
+        )
+        db.session.execute(
+            update(CargoRevendedor).where(CargoRevendedor.remesa_id.in_(ids)).values(remesa_id=None),
+            execution_options=opciones
+        )
+        db.session.execute(
+            delete(Remesa).where(Remesa.id.in_(ids)),
+            execution_options=opciones
+        )
+
+    if primer_movimiento:
+        invalidar_cierres(primer_movimiento.date())
+
+    db.session.commit()
+
+    eliminadas = [c for c in codigos if c in encontrados]
+    no_encontradas = [c for c in codigos if c not in encontrados]
+    if eliminadas:
+        logger.info(f"Eliminadas {len(eliminadas)} remesas")
+
+    return {'eliminadas': eliminadas, 'no_encontradas': no_encontradas}
+
+
+def _resolver(ids):
+    """Carga id, codigo, estado, repartidor y facturada de las remesas pedidas, por lotes"""
+    filas = {}
+    for lote in _lotes(ids):
+        for f in db.session.execute(
+            select(Remesa.id, Remesa.codigo, Remesa.estado, Remesa.repartidor_id, Remesa.facturada)
+            .where(Remesa.id.in_(lote))
+        ).all():
+            filas[f.id] = f
+    return filas
+
+
+def _resultado(id, fila, resultado):
+    return {'id': id, 'codigo': fila.codigo if fila else None, 'resultado': resultado}
+
+
+def asignar_remesas(ids, repartidor_id):
+    """
+    Asigna un repartidor a varias remesas pendientes o en proceso.
+    Las pendientes pasan a en_proceso, igual que en la asignacion individual.
+
+    Returns:
+        (resultados por remesa, ids asignados)
+    """
+    ids = list(dict.fromkeys(ids))
+    filas = _resolver(ids)
+
+    resultados = []
+    validos = []
+    for id in ids:
+        fila = filas.get(id)
+        if not fila:
+            resultados.append(_resultado(id, None, 'no_encontrada'))
+        elif fila.estado not in ('pendiente', 'en_proceso'):
+            resultados.append(_resultado(id, fila, 'estado_invalido'))
+        else:
+            validos.append(id)
+            resultados.append(_resultado(id, fila, 'asignada'))
+
+    for lote in _lotes(validos):
+        db.session.execute(
+            update(Remesa).where(Remesa.id.in_(lote)).values(
+                repartidor_id=repartidor_id,
+                estado=case((Remesa.estado == 'pendiente', 'en_proceso'), else_=Remesa.estado)
+            ),
+            execution_options={'synchronize_session': False}
+        )
+        marcar_remesas(lote)
+        eventos.registrar_remesas(lote, 'remesa_asignada', filas)
+    db.session.commit()
+
+    return resultados, validos
+
+
+def facturar_remesas(ids, facturada=True):
+    """
+    Marca (o desmarca) varias remesas como pagadas.
+
+    Returns:
+        (resultados por remesa, ids modificados)
+    """
+    ids = list(dict.fromkeys(ids))
+    filas = _resolver(ids)
+
+    resultados = []
+    validos = []
+    for id in ids:
+        fila = filas.get(id)
+        if not fila:
+            resultados.append(_resultado(id, None, 'no_encontrada'))
+        elif bool(fila.facturada) == facturada:
+            resultados.append(_resultado(id, fila, 'sin_cambios'))
+        else:
+            validos.append(id)
+            resultados.append(_resultado(id, fila, 'facturada' if facturada else 'desfacturada'))
+
+    fecha = datetime.utcnow() if facturada else None
+    for lote in _lotes(validos):
+        db.session.execute(
+            update(Remesa).where(Remesa.id.in_(lote)).values(
+                facturada=facturada,
+                fecha_facturacion=fecha
+            ),
+            execution_options={'synchronize_session': False}
+        )
+    db.session.commit()
+
+    return resultados, validos
+
+
+def cancelar_remesas(ids):
+    """
+    Cancela varias remesas que aun no fueron entregadas.
+
+    Returns:
+        (resultados por remesa, ids cancelados)
+    """
+    ids = list(dict.fromkeys(ids))
+    filas = _resolver(ids)
+
+    resultados = []
+    validos = []
+    for id in ids:
+        fila = filas.get(id)
+        if not fila:
+            resultados.append(_resultado(id, None, 'no_encontrada'))
+        elif fila.estado in ('entregada', 'cancelada'):
+            resultados.append(_resultado(id, fila, 'estado_invalido'))
+        else:
+            validos.append(id)
+            resultados.append(_resultado(id, fila, 'cancelada'))
+
+    for lote in _lotes(validos):
+        db.session.execute(
+            update(Remesa).where(
+                Remesa.id.in_(lote),
+                Remesa.estado.notin_(['entregada', 'cancelada'])
+            ).values(estado='cancelada'),
+            execution_options={'synchronize_session': False}
+        )
+        marcar_remesas(lote)
+        eventos.registrar_remesas(lote, 'remesa_estado', filas)
+    db.session.commit()
+
+    return resultados, validos
+
+
+def cargar_remesas(ids):
+    """Carga las remesas modificadas (por lotes) para enviar notificaciones"""
+    remesas = []
+    for lote in _lotes(ids):
+        remesas.extend(Remesa.query.filter(Remesa.id.in_(lote)).all())
+    return remesas
@@ -0,0 +1,220 @@
+"""
+Perfil precalculado de cada cliente para el formulario publico
+Al escribir un telefono en /solicitar se muestran su nombre, sus
+beneficiarios frecuentes y sus ultimas remesas. En vez de buscar todo eso en
+remesas por telefono (LIKE '%...%', sin indice) se guarda un perfil por
+telefono normalizado con el JSON ya armado, y se sirve con una lectura por
+clave primaria y un ETag basado en su version.
+
+El perfil se recalcula en la misma transaccion en que se escribe la remesa:
+- los cambios por ORM (crear, editar, cambiar estado, borrar) se detectan en
+  after_flush y se aplican en before_commit
+- las operaciones con UPDATE/INSERT directo llaman a marcar_remesas()
+"""
+import json
+import logging
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+from models import db, Remesa, Remitente, Beneficiario, PerfilCliente
+from directorio import normalizar_telefono, beneficiarios_frecuentes
+from archivo import RemesaHistorica
+
+logger = logging.getLogger(__name__)
+
+MAX_REMESAS = 10
+MAX_BENEFICIARIOS = 5
+# Campos de Remesa que aparecen en el perfil
+CAMPOS_PERFIL = ('codigo', 'remitente_telefono', 'beneficiario_nombre', 'monto_envio', 'estado')
+
+ESTADOS_COLOR = {
+    'entregada': 'success',
+    'en_proceso': 'primary',
+    'pendiente': 'warning',
+    'solicitud': 'info',
+    'cancelada': 'danger'
+}
+
+
+def _resumen(remesa):
+    return {
+        'id': remesa.id,
+        'codigo': remesa.codigo,
+        'beneficiario': remesa.beneficiario_nombre,
+        'monto': str(remesa.monto_envio),
+        'fecha': remesa.fecha_creacion.strftime('%d/%m/%Y') if remesa.fecha_creacion else '',
+        'estado': remesa.estado.replace('_', ' ').title(),
+        'estado_color': ESTADOS_COLOR.get(remesa.estado, 'secondary')
+    }
+
+
+def _beneficiario(b):
+    return {'nombre': b.nombre, 'telefono': b.telefono or '', 'direccion': b.direccion or ''}
+
+
+def _datos(remitente, beneficiarios, remesas):
+    return json.dumps({
+        'encontrado': True,
+        'remitente_nombre': remitente.nombre,
+        'remitente_telefono': remitente.telefono,
+        'beneficiarios': beneficiarios,
+        'remesas': remesas
+    })
+
+
+# === Mantenimiento ===
+
+def marcar_remesas(ids):
+    """
+    Marca remesas escritas con SQL directo (sin ORM) para recalcular sus
+    perfiles al hacer commit.
+    """
+    pendientes = db.session.info.setdefault('perfiles_pendientes', {})
+    filas = db.session.execute(
+        select(Remesa.id, Remesa.remitente_telefono).where(Remesa.id.in_(list(ids)))
+    ).all()
+    for id, telefono in filas:
+        telefono = normalizar_telefono(telefono)
+        if telefono:
+            pendientes.setdefault(telefono, set()).add(id)
+
+
+@event.listens_for(Session, 'after_flush')
+def _registrar_cambios(session, contexto):
+    pendientes = session.info.setdefault('perfiles_pendientes', {})
+
+    def marcar(remesa, telefono):
+        telefono = normalizar_telefono(telefono)
+        if telefono:
+            pendientes.setdefault(telefono, set()).add(remesa.id)
+
+    for remesa in session.new | session.deleted:
+        if isinstance(remesa, Remesa):
+            marcar(remesa, remesa.remitente_telefono)
+
+    for remesa in session.dirty:
+        if not isinstance(remesa, Remesa):
+            continue
+        estado = inspect(remesa)
+        if not any(estado.attrs[c].history.has_changes() for c in CAMPOS_PERFIL):
+            continue
+        marcar(remesa, remesa.remitente_telefono)
+        # Si cambio el telefono, la remesa sale del perfil anterior
+        for telefono in estado.attrs.remitente_telefono.history.deleted:
+            marcar(remesa, telefono)
+
+
+@event.listens_for(Session, 'before_commit')
+def _aplicar_cambios(session):
+    # commit() hace el flush final despues de este evento: se adelanta para verlo
+    session.flush()
+    pendientes = session.info.pop('perfiles_pendientes', None)
+    if pendientes:
+        actualizar_perfiles(pendientes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_cambios(session):
+    session.info.pop('perfiles_pendientes', None)
+
+
+def actualizar_perfiles(pendientes):
+    """
+    Recalcula los perfiles afectados. Sin commit.
+
+    Args:
+        pendientes: telefono normalizado -> ids de remesas que cambiaron
+    """
+    ids = set().union(*pendientes.values())
+    remesas = {r.id: r for r in Remesa.query.filter(Remesa.id.in_(list(ids)))}
+    remitentes = {
+        r.telefono_normalizado: r for r in
+        Remitente.query.filter(Remitente.telefono_normalizado.in_(list(pendientes)))
+    }
+    perfiles = {
+        p.telefono_normalizado: p for p in
+        PerfilCliente.query.filter(PerfilCliente.telefono_normalizado.in_(list(pendientes)))
+    }
+
+    for telefono, cambiadas in pendientes.items():
+        remitente = remitentes.get(telefono)
+        if not remitente:
+            continue
+        perfil = perfiles.get(telefono)
+
+        anteriores = json.loads(perfil.datos)['remesas'] if perfil else []
+        resumenes = {r['id']: r for r in anteriores if r['id'] not in cambiadas}
+        for id in cambiadas:
+            remesa = remesas.get(id)
+            if remesa and normalizar_telefono(remesa.remitente_telefono) == telefono:
+                resumenes[id] = _resumen(remesa)
+        ultimas = [resumenes[id] for id in sorted(resumenes, reverse=True)[:MAX_REMESAS]]
+
+        datos = _datos(
+            remitente,
+            [_beneficiario(b) for b in beneficiarios_frecuentes(remitente, MAX_BENEFICIARIOS)],
+            ultimas
+        )
+        if perfil:
+            perfil.datos = datos
+            perfil.version = PerfilCliente.version + 1  # Incremento en SQL
+        else:
+            db.session.add(PerfilCliente(telefono_normalizado=telefono, datos=datos, version=1))
+
+
+def migrar_perfiles():
+    """
+    Arma los perfiles de todos los remitentes del directorio si todavia no
+    hay ninguno. Seguro de llamar en cada arranque.
+
+    Returns:
+        Cantidad de perfiles creados
+    """
+    if db.session.execute(select(PerfilCliente.telefono_normalizado).limit(1)).first():
+        return 0
+    remitentes = {r.telefono_normalizado: r for r in Remitente.query}
+    if not remitentes:
+        return 0
+
+    # Ultimas remesas de cada telefono: un recorrido del historial, de la mas nueva a la mas vieja
+    remesas = {}
+    filas = db.session.execute(
+        select(RemesaHistorica.id, RemesaHistorica.remitente_telefono,
+               *[getattr(RemesaHistorica, c) for c in CAMPOS_PERFIL if c != 'remitente_telefono'],
+               RemesaHistorica.fecha_creacion)
+        .order_by(RemesaHistorica.id.desc())
+        .execution_options(yield_per=5000)
+    )
+    for fila in filas:
+        lista = remesas.setdefault(normalizar_telefono(fila.remitente_telefono), [])
+        if len(lista) < MAX_REMESAS:
+            lista.append(_resumen(fila))
+
+    beneficiarios = {}
+    for b in db.session.execute(
+        select(Beneficiario).order_by(
+            Beneficiario.remitente_id, Beneficiario.usos.desc(), Beneficiario.ultimo_uso.desc()
+        ).execution_options(yield_per=5000)
+    ).scalars():
+        lista = beneficiarios.setdefault(b.remitente_id, [])
+        if len(lista) < MAX_BENEFICIARIOS:
+            lista.append(_beneficiario(b))
+
+    db.session.execute(PerfilCliente.__table__.insert(), [{
+        'telefono_normalizado': telefono,
+        'version': 1,
+        'datos': _datos(r, beneficiarios.get(r.id, []), remesas.get(telefono, []))
+    } for telefono, r in remitentes.items()])
+    db.session.commit()
+
+    logger.info(f"Perfiles de cliente creados: {len(remitentes)}")
+    return len(remitentes)
+
+
+# === Consulta ===
+
+def obtener_perfil(telefono):
+    """PerfilCliente del telefono (una lectura por clave primaria), o None"""
+    telefono = normalizar_telefono(telefono)
+    if not telefono:
+        return None
+    return db.session.get(PerfilCliente, telefono)
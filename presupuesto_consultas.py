@@ -0,0 +1,123 @@
+"""
+Presupuesto de tiempo para las consultas de filtros libres
+Un balance con un rango enorme o una busqueda de una letra en la lista de
+remesas podia recorrer tablas enteras: mientras tanto la consulta tiene el
+lock de lectura de SQLite y los repartidores no pueden guardar entregas.
+
+Las vistas decoradas con @con_presupuesto tienen PRESUPUESTO_CONSULTAS
+segundos (config) para todas sus consultas. En SQLite lo controla un
+progress handler instalado en cada conexion: cada PASOS instrucciones de la
+maquina virtual revisa el limite de la solicitud actual y, si paso, SQLite
+corta la consulta y suelta el lock. En PostgreSQL y MySQL el limite va por
+consulta (statement_timeout / max_execution_time). La consulta cortada se
+registra en el log con los parametros de la vista y el usuario ve una
+pagina que le pide acotar el rango o la busqueda.
+
+Fuera de una vista decorada (scheduler, reportes en segundo plano) no hay
+limite: el handler solo mira una variable de contexto.
+"""
+import contextvars
+import logging
+import sqlite3
+import time
+from functools import wraps
+from flask import current_app, request, render_template
+from flask_login import current_user
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from models import db
+
+logger = logging.getLogger(__name__)
+
+# Instrucciones de SQLite entre revisiones del limite (~0.1 ms)
+PASOS = 10000
+
+
+class _Limite:
+    """Limite de la solicitud actual; cortada indica que SQLite interrumpio una consulta"""
+
+    def __init__(self, segundos):
+        self.segundos = segundos
+        self.fin = time.monotonic() + segundos
+        self.cortada = False
+
+
+_limite = contextvars.ContextVar('presupuesto_consultas', default=None)
+
+
+def _revisar():
+    limite = _limite.get()
+    if limite is None or time.monotonic() < limite.fin:
+        return 0
+    limite.cortada = True
+    return 1  # Distinto de 0: SQLite interrumpe la consulta
+
+
+@event.listens_for(Engine, 'connect')
+def _instalar(conexion_dbapi, registro):
+    if isinstance(conexion_dbapi, sqlite3.Connection):
+        conexion_dbapi.set_progress_handler(_revisar, PASOS)
+
+
+def _limitar_consultas(milisegundos):
+    """Limite por consulta en bases que no son SQLite (en SQLite lo hace _revisar)"""
+    dialecto = db.engine.dialect.name
+    if dialecto == 'postgresql':
+        # SET LOCAL: vale hasta el fin de la transaccion de la solicitud
+        db.session.execute(text(f'SET LOCAL statement_timeout = {int(milisegundos)}'))
+    elif dialecto == 'mysql':
+        db.session.execute(text(f'SET SESSION max_execution_time = {int(milisegundos)}'))
+
+
+def _liberar_consultas():
+    if db.engine.dialect.name == 'mysql':
+        db.session.execute(text('SET SESSION max_execution_time = 0'))
+
+
+def _excedida(error, limite):
+    """True si el error es la cancelacion por presupuesto y no otro problema de la base"""
+    if limite.cortada:
+        return True
+    original = error.orig
+    # PostgreSQL: query_canceled; MySQL: ER_QUERY_TIMEOUT
+    codigo = getattr(original, 'pgcode', None) or getattr(original, 'sqlstate', None)
+    return codigo == '57014' or (bool(original.args) and original.args[0] == 3024)
+
+
+def con_presupuesto(*parametros):
+    """
+    Decorador para vistas con filtros que pueden ser caros.
+
+    Args:
+        parametros: nombres de request.args que definen el costo (se registran
+                    en el log si la consulta se cancela)
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            segundos = current_app.config['PRESUPUESTO_CONSULTAS']
+            limite = _Limite(segundos)
+            marca = _limite.set(limite)
+            try:
+                _limitar_consultas(segundos * 1000)
+                return vista(*args, **kwargs)
+            except DBAPIError as e:
+                if not _excedida(e, limite):
+                    raise
+            finally:
+                _limite.reset(marca)
+                try:
+                    _liberar_consultas()
+                except DBAPIError:
+                    db.session.rollback()
+
+            db.session.rollback()
+            valores = {p: request.args.get(p) for p in parametros if request.args.get(p)}
+            logger.warning(
+                f"Consulta cancelada en {request.endpoint} tras {segundos}s: "
+                f"usuario={current_user.get_id()} parametros={valores}"
+            )
+            return render_template('consulta_cancelada.html', valores=valores), 503
+        return envoltura
+    return decorador
@@ -380,3 +380,26 @@ def push_nueva_solicitud_admin(remesa):
     mensaje = f"Solicitud de {remesa.remitente_nombre} - ${remesa.monto_envio:.2f} USD"
     url = "/dashboard"
     return notificar_admins_push(titulo, mensaje, url)
+
+
+def push_remesas_asignadas_lote(repartidor_id, remesas):
+    """Notifica al repartidor un lote de remesas asignadas con un solo push"""
+    if len(remesas) == 1:
+        return push_remesa_asignada(remesas[0])
+
+    titulo = f"{len(remesas)} Nuevas Entregas Asignadas"
+    codigos = ', '.join(r.codigo for r in remesas[:5])
+    if len(remesas) > 5:
+        codigos += f' y {len(remesas) - 5} mas'
+    url = "/repartidor/panel"
+    return notificar_repartidor_push(repartidor_id, titulo, codigos, url)
+
+
+def push_remesas_canceladas_lote(repartidor_id, remesas):
+    """Notifica al repartidor que remesas suyas fueron canceladas, en un solo push"""
+    titulo = "Remesa Cancelada" if len(remesas) == 1 else f"{len(remesas)} Remesas Canceladas"
+    mensaje = ', '.join(r.codigo for r in remesas[:5])
+    if len(remesas) > 5:
+        mensaje += f' y {len(remesas) - 5} mas'
+    url = "/repartidor/panel"
+    return notificar_repartidor_push(repartidor_id, titulo, mensaje, url)
@@ -2,8 +2,10 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request,
 from flask_login import login_required, current_user
 from models import db, Usuario, TasaCambio, Comision, Configuracion, MovimientoEfectivo
 from functools import wraps
-from datetime import datetime
+from datetime import datetime, timedelta
 from tasas_externas import obtener_tasa_actual as obtener_tasa_externa
+import cache_http
+import calculo_compartido
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -116,8 +118,12 @@ def usuario_eliminar(id):
         flash('No puedes eliminarte a ti mismo', 'error')
         return redirect(url_for('admin.usuarios'))
 
-    from models import Remesa
-    remesas = Remesa.query.filter_by(repartidor_id=id).count()
+    # Incluye las archivadas: siguen apuntando al usuario por repartidor_id
+    from sqlalchemy import func
+    from archivo import RemesaHistorica
+    remesas = db.session.query(func.count(RemesaHistorica.id)).filter(
+        RemesaHistorica.repartidor_id == id
+    ).scalar()
     if remesas > 0:
         flash(f'No se puede eliminar: {usuario.nombre} tiene {remesas} remesas asignadas', 'error')
         return redirect(url_for('admin.usuarios'))
@@ -245,6 +251,22 @@ def api_tasa_externa():
 
 # === COMISIONES ===
 
+@admin_bp.route('/api/cache-http')
+@login_required
+@admin_required
+def api_cache_http():
+    """Respuestas completas, 304 y bytes ahorrados por endpoint (este proceso)"""
+    return jsonify(cache_http.estadisticas())
+
+
+@admin_bp.route('/api/calculo-compartido')
+@login_required
+@admin_required
+def api_calculo_compartido():
+    """Agregados calculados, compartidos con un calculo en curso y reutilizados (este proceso)"""
+    return jsonify(calculo_compartido.estadisticas())
+
+
 @admin_bp.route('/comisiones')
 @login_required
 @admin_required
@@ -420,28 +442,31 @@ Happy Remesitas"""
 
 # === REVENDEDORES ===
 
+@calculo_compartido.compartido()
+def _estadisticas_revendedores():
+    """Remesas y monto enviado por revendedor, en una consulta agrupada"""
+    from archivo import RemesaHistorica
+    from sqlalchemy import func, case
+
+    # Totales de siempre: incluyen las remesas archivadas
+    filas = db.session.query(
+        RemesaHistorica.revendedor_id,
+        func.count(RemesaHistorica.id),
+        func.sum(case((RemesaHistorica.estado != 'cancelada', RemesaHistorica.monto_envio), else_=0))
+    ).filter(RemesaHistorica.revendedor_id.isnot(None)).group_by(RemesaHistorica.revendedor_id).all()
+    return {id: {'total_remesas': cantidad, 'total_enviado': enviado or 0} for id, cantidad, enviado in filas}
+
+
 @admin_bp.route('/revendedores')
 @login_required
 @admin_required
 def revendedores():
     """Lista todos los revendedores"""
-    from models import Remesa
-    from sqlalchemy import func
-
     revendedores = Usuario.query.filter_by(rol='revendedor').order_by(Usuario.nombre).all()
 
-    # Calcular estadisticas por revendedor
-    stats = {}
-    for r in revendedores:
-        total_remesas = Remesa.query.filter_by(revendedor_id=r.id).count()
-        total_enviado = db.session.query(func.sum(Remesa.monto_envio)).filter(
-            Remesa.revendedor_id == r.id,
-            Remesa.estado != 'cancelada'
-        ).scalar() or 0
-        stats[r.id] = {
-            'total_remesas': total_remesas,
-            'total_enviado': total_enviado
-        }
+    agregados = _estadisticas_revendedores()
+    sin_remesas = {'total_remesas': 0, 'total_enviado': 0}
+    stats = {r.id: agregados.get(r.id, sin_remesas) for r in revendedores}
 
     return render_template('admin/revendedores.html', revendedores=revendedores, stats=stats)
 
@@ -510,6 +535,7 @@ def revendedor_editar(id):
 def revendedor_balance(id):
     """Ver balance y pagos de un revendedor"""
     from models import Remesa, PagoRevendedor
+    from archivo import RemesaHistorica
     from sqlalchemy import func
 
     revendedor = Usuario.query.get_or_404(id)
@@ -523,10 +549,10 @@ def revendedor_balance(id):
         PagoRevendedor.revendedor_id == id
     ).scalar() or 0
 
-    # Comisiones generadas
-    total_comisiones = db.session.query(func.sum(Remesa.comision_plataforma)).filter(
-        Remesa.revendedor_id == id,
-        Remesa.estado != 'cancelada'
+    # Comisiones generadas (con las remesas archivadas)
+    total_comisiones = db.session.query(func.sum(RemesaHistorica.comision_plataforma)).filter(
+        RemesaHistorica.revendedor_id == id,
+        RemesaHistorica.estado != 'cancelada'
     ).scalar() or 0
 
     # Remesas del revendedor
@@ -548,6 +574,7 @@ def revendedor_balance(id):
 def revendedor_registrar_pago(id):
     """Registrar pago de un revendedor"""
     from models import PagoRevendedor
+    from cuentas_revendedor import aplicar_pago
 
     revendedor = Usuario.query.get_or_404(id)
     monto = float(request.form.get('monto', 0))
@@ -569,11 +596,11 @@ def revendedor_registrar_pago(id):
     )
     db.session.add(pago)
 
-    # Actualizar saldo pendiente
-    revendedor.saldo_pendiente = max(0, revendedor.saldo_pendiente - monto)
+    # Actualizar saldo pendiente (descuento atomico en SQL, minimo 0)
+    nuevo_saldo = aplicar_pago(id, monto)
     db.session.commit()
 
-    flash(f'Pago de ${monto:.2f} registrado. Nuevo saldo: ${revendedor.saldo_pendiente:.2f}', 'success')
+    flash(f'Pago de ${monto:.2f} registrado. Nuevo saldo: ${nuevo_saldo:.2f}', 'success')
     return redirect(url_for('admin.revendedor_balance', id=id))
 
 
@@ -610,12 +637,15 @@ def revendedor_reset_password(id):
 @admin_required
 def revendedor_eliminar(id):
     """Elimina un revendedor"""
-    from models import Remesa
+    from sqlalchemy import func
+    from archivo import RemesaHistorica
 
     revendedor = Usuario.query.get_or_404(id)
 
-    # Verificar si tiene remesas asociadas
-    remesas = Remesa.query.filter_by(revendedor_id=id).count()
+    # Verificar si tiene remesas asociadas (activas o archivadas)
+    remesas = db.session.query(func.count(RemesaHistorica.id)).filter(
+        RemesaHistorica.revendedor_id == id
+    ).scalar()
     if remesas > 0:
         flash(f'No se puede eliminar: {revendedor.nombre} tiene {remesas} remesas asociadas. Desactivalo en su lugar.', 'error')
         return redirect(url_for('admin.revendedores'))
@@ -664,6 +694,70 @@ def efectivo_repartidor(id):
                          movimientos=movimientos)
 
 
+@admin_bp.route('/efectivo/<int:id>/libro')
+@login_required
+@admin_required
+def efectivo_libro(id):
+    """Libro de movimientos de un repartidor con saldo corrido en cualquier rango"""
+    from libro_efectivo import libro
+
+    repartidor = Usuario.query.get_or_404(id)
+
+    hoy = datetime.utcnow().date()
+    moneda = request.args.get('moneda', 'USD')
+    inicio_defecto, fin_defecto = (hoy - timedelta(days=30)).isoformat(), hoy.isoformat()
+    fecha_inicio = request.args.get('fecha_inicio', inicio_defecto)
+    fecha_fin = request.args.get('fecha_fin', fin_defecto)
+    pagina = max(request.args.get('pagina', 1, type=int), 1)
+
+    try:
+        desde = datetime.fromisoformat(fecha_inicio)
+        hasta = datetime.fromisoformat(fecha_fin)
+    except ValueError:
+        flash('Fecha invalida, se muestran los ultimos 30 dias', 'error')
+        fecha_inicio, fecha_fin = inicio_defecto, fin_defecto
+        desde, hasta = datetime.fromisoformat(fecha_inicio), datetime.fromisoformat(fecha_fin)
+
+    resultado = libro(
+        id, moneda,
+        desde,
+        hasta + timedelta(days=1),  # Incluir todo el dia
+        pagina=pagina
+    )
+
+    return render_template('admin/efectivo_libro.html',
+                         repartidor=repartidor,
+                         moneda=moneda,
+                         fecha_inicio=fecha_inicio,
+                         fecha_fin=fecha_fin,
+                         pagina=pagina,
+                         **resultado)
+
+
+@admin_bp.route('/api/efectivo/<int:id>/saldo')
+@login_required
+@admin_required
+def api_efectivo_saldo(id):
+    """Saldo de un repartidor en un instante (?fecha=ISO, por defecto ahora; ?moneda=USD|CUP)"""
+    from libro_efectivo import saldo_en
+
+    Usuario.query.get_or_404(id)
+    fecha = request.args.get('fecha')
+    moneda = request.args.get('moneda')
+
+    try:
+        momento = datetime.fromisoformat(fecha) if fecha else datetime.utcnow()
+    except ValueError:
+        return jsonify({'error': 'Fecha invalida, use formato ISO (YYYY-MM-DD o YYYY-MM-DDTHH:MM)'}), 400
+
+    monedas = [moneda] if moneda else ['USD', 'CUP']
+    return jsonify({
+        'repartidor_id': id,
+        'fecha': momento.isoformat(),
+        'saldos': {m: round(saldo_en(id, m, momento), 2) for m in monedas}
+    })
+
+
 @admin_bp.route('/efectivo/<int:id>/asignar', methods=['POST'])
 @login_required
 @admin_required
@@ -860,6 +954,34 @@ def efectivo_recogida(id):
     return redirect(url_for('admin.efectivo_repartidor', id=id))
 
 
+# === CONCILIACION DE SALDOS ===
+
+@admin_bp.route('/conciliacion')
+@login_required
+@admin_required
+def conciliacion():
+    """Compara los saldos de repartidores y revendedores con sus libros"""
+    from conciliacion import conciliar
+
+    resultado = conciliar()
+    return render_template('admin/conciliacion.html', **resultado)
+
+
+@admin_bp.route('/conciliacion/corregir', methods=['POST'])
+@login_required
+@admin_required
+def conciliacion_corregir():
+    """Ajusta los saldos descuadrados al valor de los libros"""
+    from conciliacion import conciliar
+
+    resultado = conciliar(corregir=True)
+    sin_libro = sum(1 for d in resultado['descuadres'] if d['sin_libro'])
+    flash(f'{len(resultado["descuadres"]) - sin_libro} saldos corregidos segun los libros', 'success')
+    if sin_libro:
+        flash(f'{sin_libro} revendedores tienen remesas sin cargo en el libro: su saldo no se corrigio', 'error')
+    return redirect(url_for('admin.conciliacion'))
+
+
 # === ELIMINACION DE REMESAS ===
 
 @admin_bp.route('/remesa/<codigo>/eliminar', methods=['POST'])
@@ -870,7 +992,8 @@ def remesa_eliminar(codigo):
     Elimina una remesa y todos sus registros relacionados.
     Usar con cuidado - para remesas procesadas por error.
     """
-    from models import Remesa, MovimientoContable
+    from models import Remesa
+    from operaciones_masivas import eliminar_remesas
 
     remesa = Remesa.query.filter_by(codigo=codigo).first()
 
@@ -882,15 +1005,8 @@ def remesa_eliminar(codigo):
     beneficiario = remesa.beneficiario_nombre
     monto = remesa.monto_envio
 
-    # Eliminar movimientos contables relacionados
-    MovimientoContable.query.filter_by(remesa_id=remesa.id).delete()
-
-    # Eliminar movimientos de efectivo relacionados
-    MovimientoEfectivo.query.filter_by(remesa_id=remesa.id).delete()
-
-    # Eliminar la remesa
-    db.session.delete(remesa)
-    db.session.commit()
+    # Eliminar la remesa con sus movimientos contables y de efectivo
+    eliminar_remesas([codigo])
 
     flash(f'Remesa {codigo} eliminada (Beneficiario: {beneficiario}, Monto: ${monto:.2f})', 'success')
     return redirect(url_for('remesas.dashboard'))
@@ -904,33 +1020,16 @@ def remesas_eliminar_multiple():
     Elimina multiples remesas por codigo.
     Espera JSON: {"codigos": ["REM-XXX", "REM-YYY"]}
     """
-    from models import Remesa, MovimientoContable
+    from operaciones_masivas import eliminar_remesas
 
     data = request.get_json()
     if not data or 'codigos' not in data:
         return jsonify({'error': 'Se requiere lista de codigos'}), 400
 
-    codigos = data['codigos']
-    eliminadas = []
-    no_encontradas = []
-
-    for codigo in codigos:
-        remesa = Remesa.query.filter_by(codigo=codigo).first()
-        if not remesa:
-            no_encontradas.append(codigo)
-            continue
-
-        # Eliminar registros relacionados
-        MovimientoContable.query.filter_by(remesa_id=remesa.id).delete()
-        MovimientoEfectivo.query.filter_by(remesa_id=remesa.id).delete()
-
-        db.session.delete(remesa)
-        eliminadas.append(codigo)
-
-    db.session.commit()
+    resultado = eliminar_remesas(data['codigos'])
 
     return jsonify({
-        'eliminadas': eliminadas,
-        'no_encontradas': no_encontradas,
-        'mensaje': f'Eliminadas {len(eliminadas)} remesas'
+        'eliminadas': resultado['eliminadas'],
+        'no_encontradas': resultado['no_encontradas'],
+        'mensaje': f'Eliminadas {len(resultado["eliminadas"])} remesas'
     })
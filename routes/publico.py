@@ -1,11 +1,17 @@
 """
 Rutas publicas para clientes - Solicitar remesas
 """
-from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
+from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, abort, Response
 from models import db, Remesa, TasaCambio, Usuario
 from notificaciones import enviar_whatsapp, notificar_admin_nueva_solicitud
 from push_notifications import push_nueva_solicitud_admin
+from archivo import RemesaHistorica, obtener_remesa
+import autocompletar
+import directorio
+import perfiles
+from idempotencia import idempotente
 from datetime import datetime
+import json
 
 publico_bp = Blueprint('publico', __name__)
 
@@ -15,6 +21,7 @@ DESCUENTO_MN = 15    # 15 CUP menos por dolar
 
 
 @publico_bp.route('/solicitar', methods=['GET', 'POST'])
+@idempotente
 def solicitar_remesa():
     """Formulario publico para solicitar remesa"""
     
@@ -76,7 +83,9 @@ def solicitar_remesa():
         )
         
         db.session.add(nueva_remesa)
+        directorio.registrar_remesa(nueva_remesa)
         db.session.commit()
+        autocompletar.registrar_remesa(nueva_remesa)
 
         # Enviar Push Notification a admins
         try:
@@ -124,7 +133,9 @@ Revisa el panel para aprobar o modificar."""
 @publico_bp.route('/repetir/<int:id>')
 def repetir_remesa(id):
     """Pre-llena el formulario con datos de una remesa anterior"""
-    remesa = Remesa.query.get_or_404(id)
+    remesa = obtener_remesa(id)
+    if not remesa:
+        abort(404)
     
     tasa_usd = TasaCambio.query.filter_by(moneda_origen='USD', activa=True).first()
     tasa_actual = tasa_usd.tasa if tasa_usd else 435
@@ -174,11 +185,10 @@ def mis_remesas():
         telefono = request.form.get('telefono', '').strip()
         
         if telefono:
-            # Buscar remesas donde el telefono coincida con remitente
-            from models import Remesa
-            remesas = Remesa.query.filter(
-                Remesa.remitente_telefono.ilike(f'%{telefono[-10:]}%')
-            ).order_by(Remesa.fecha_creacion.desc()).all()
+            # Buscar remesas donde el telefono coincida con remitente (incluye archivadas)
+            remesas = db.session.query(RemesaHistorica).filter(
+                RemesaHistorica.remitente_telefono.ilike(f'%{telefono[-10:]}%')
+            ).order_by(RemesaHistorica.fecha_creacion.desc()).all()
             
             if not remesas:
                 error = 'No encontramos remesas con ese numero. Verifica que sea el mismo numero con el que solicitaste.'
@@ -191,48 +201,64 @@ def mis_remesas():
                          error=error)
 
 
+@publico_bp.route('/api/cliente-perfil', methods=['POST'])
+def api_cliente_perfil():
+    """
+    Nombre, beneficiarios frecuentes y ultimas remesas del cliente en una sola
+    respuesta, con ETag: si no cambio nada responde 304 sin cuerpo.
+    POST para que el telefono no quede en la URL ni en los logs de acceso; el
+    navegador no guarda respuestas a POST, asi que la pagina guarda la suya y
+    manda el ETag en If-None-Match.
+    """
+    data = request.get_json(silent=True) or {}
+    telefono = str(data.get('telefono', '')).strip()
+    if len(telefono) < 8:
+        return jsonify({'encontrado': False})
+
+    perfil = perfiles.obtener_perfil(telefono)
+    if not perfil:
+        return jsonify({'encontrado': False})
+
+    etag = f'{perfil.telefono_normalizado}-{perfil.version}'
+    # Comparacion debil: compresion.py entrega el ETag como W/"..."
+    if request.if_none_match.contains_weak(etag):
+        respuesta = Response(status=304)
+    else:
+        respuesta = Response(perfil.datos, mimetype='application/json')
+    respuesta.set_etag(etag)
+    respuesta.headers['Cache-Control'] = 'no-store'
+    return respuesta
+
+
 @publico_bp.route('/api/cliente-datos', methods=['POST'])
 def api_cliente_datos():
-    """Retorna datos del cliente basado en su telefono (ultima remesa)"""
+    """Retorna datos del cliente basado en su telefono (directorio de contactos)"""
     data = request.get_json()
     telefono = data.get('telefono', '').strip()
     
     if not telefono or len(telefono) < 8:
         return jsonify({'encontrado': False})
     
-    # Buscar ultima remesa del cliente
-    remesa = Remesa.query.filter(
-        Remesa.remitente_telefono.ilike(f'%{telefono[-10:]}%')
-    ).order_by(Remesa.fecha_creacion.desc()).first()
+    remitente = directorio.datos_cliente(telefono)
     
-    if remesa:
+    if remitente:
         return jsonify({
             'encontrado': True,
-            'remitente_nombre': remesa.remitente_nombre,
-            'remitente_telefono': remesa.remitente_telefono,
-            'beneficiarios': obtener_beneficiarios_frecuentes(telefono)
+            'remitente_nombre': remitente.nombre,
+            'remitente_telefono': remitente.telefono,
+            'beneficiarios': obtener_beneficiarios_frecuentes(remitente)
         })
     
     return jsonify({'encontrado': False})
 
 
-def obtener_beneficiarios_frecuentes(telefono):
+def obtener_beneficiarios_frecuentes(remitente):
     """Obtiene los beneficiarios mas frecuentes de un remitente"""
-    remesas = Remesa.query.filter(
-        Remesa.remitente_telefono.ilike(f'%{telefono[-10:]}%')
-    ).order_by(Remesa.fecha_creacion.desc()).limit(10).all()
-    
-    beneficiarios = {}
-    for r in remesas:
-        key = r.beneficiario_nombre.lower()
-        if key not in beneficiarios:
-            beneficiarios[key] = {
-                'nombre': r.beneficiario_nombre,
-                'telefono': r.beneficiario_telefono or '',
-                'direccion': r.beneficiario_direccion or ''
-            }
-    
-    return list(beneficiarios.values())[:5]
+    return [{
+        'nombre': b.nombre,
+        'telefono': b.telefono or '',
+        'direccion': b.direccion or ''
+    } for b in directorio.beneficiarios_frecuentes(remitente)]
 
 
 @publico_bp.route('/api/historial-cliente', methods=['POST'])
@@ -244,26 +270,8 @@ def api_historial_cliente():
     if not telefono or len(telefono) < 8:
         return jsonify({'remesas': []})
     
-    remesas = Remesa.query.filter(
-        Remesa.remitente_telefono.ilike(f'%{telefono[-10:]}%')
-    ).order_by(Remesa.fecha_creacion.desc()).limit(10).all()
-    
-    estados_color = {
-        'entregada': 'success',
-        'en_proceso': 'primary', 
-        'pendiente': 'warning',
-        'solicitud': 'info',
-        'cancelada': 'danger'
-    }
+    perfil = perfiles.obtener_perfil(telefono)
     
     return jsonify({
-        'remesas': [{
-            'id': r.id,
-            'codigo': r.codigo,
-            'beneficiario': r.beneficiario_nombre,
-            'monto': str(r.monto_envio),
-            'fecha': r.fecha_creacion.strftime('%d/%m/%Y'),
-            'estado': r.estado.replace('_', ' ').title(),
-            'estado_color': estados_color.get(r.estado, 'secondary')
-        } for r in remesas]
+        'remesas': json.loads(perfil.datos)['remesas'] if perfil else []
     })
@@ -1,20 +1,34 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, abort
 from flask_login import login_required, current_user
-from models import db, Remesa, Usuario, TasaCambio, Comision, MovimientoContable, MovimientoEfectivo
+from models import db, Remesa, Usuario, TasaCambio, Comision, MovimientoContable, MovimientoEfectivo, Remitente, Beneficiario
 from datetime import datetime, timedelta
 from functools import wraps
 from notificaciones import (
-    notificar_nueva_remesa, notificar_remitente, notificar_beneficiario,
+    notificar_nueva_remesa, notificar_lote_remesas, notificar_remitente, notificar_beneficiario,
     notificar_entrega_admin, notificar_entrega_remitente, generar_link_whatsapp,
     notificar_admin_nueva_remesa, notificar_admin_cambio_estado,
     obtener_links_notificacion_remesa
 )
 from push_notifications import (
-    push_nueva_remesa_admin, push_remesa_asignada, push_remesa_entregada_admin
+    push_nueva_remesa_admin, push_remesa_asignada, push_remesa_entregada_admin,
+    push_remesas_asignadas_lote, push_remesas_canceladas_lote
 )
+from tarifas import montos_remesa
+from archivo import obtener_remesa, buscar_por_codigo, RemesaHistorica
+from busqueda import filtrar_remesas
+import autocompletar
+import directorio
+from cache_http import condicional, version_repartidor, version_remesa
+from importacion import importar_remesas, ErrorImportacion, COLUMNAS_OBLIGATORIAS, COLUMNAS_OPCIONALES
+from operaciones_masivas import asignar_remesas, facturar_remesas, cancelar_remesas, cargar_remesas
+from idempotencia import idempotente
+from calculo_compartido import compartido
+from presupuesto_consultas import con_presupuesto
 
 remesas_bp = Blueprint('remesas', __name__)
 
+REMESAS_POR_PAGINA = 100
+
 
 def admin_required(f):
     @wraps(f)
@@ -26,12 +40,9 @@ def admin_required(f):
     return decorated_function
 
 
-@remesas_bp.route('/dashboard')
-@login_required
-@admin_required
-def dashboard():
-    hoy = datetime.utcnow().date()
-    inicio_semana = hoy - timedelta(days=hoy.weekday())
+@compartido()
+def _agregados_dashboard(hoy):
+    """Contadores y sumas del dashboard, compartidos entre los admins que lo abren a la vez"""
     inicio_mes = hoy.replace(day=1)
 
     total_remesas = Remesa.query.count()
@@ -54,12 +65,6 @@ def dashboard():
         Remesa.estado != 'cancelada'
     ).scalar() or 0
 
-    ultimas_remesas = Remesa.query.order_by(
-        Remesa.fecha_creacion.desc()
-    ).limit(10).all()
-
-    tasa_actual = TasaCambio.obtener_tasa_actual()
-
     # Estadisticas de pagos
     remesas_sin_pagar = Remesa.query.filter_by(facturada=False, estado='entregada').count()
     monto_sin_pagar = db.session.query(
@@ -90,6 +95,32 @@ def dashboard():
         ).count()
     }
 
+    return {
+        'total_remesas': total_remesas,
+        'remesas_pendientes': remesas_pendientes,
+        'remesas_hoy': remesas_hoy,
+        'ingresos_mes': ingresos_mes,
+        'total_movido_hoy': total_movido_hoy,
+        'remesas_sin_pagar': remesas_sin_pagar,
+        'monto_sin_pagar': monto_sin_pagar,
+        'remesas_pagadas_mes': remesas_pagadas_mes,
+        'monto_pagado_mes': monto_pagado_mes,
+        'alertas': alertas
+    }
+
+
+@remesas_bp.route('/dashboard')
+@login_required
+@admin_required
+def dashboard():
+    agregados = _agregados_dashboard(datetime.utcnow().date())
+
+    ultimas_remesas = Remesa.query.order_by(
+        Remesa.fecha_creacion.desc()
+    ).limit(10).all()
+
+    tasa_actual = TasaCambio.obtener_tasa_actual()
+
     # Solicitudes pendientes de aprobacion
     solicitudes_pendientes = Remesa.query.filter_by(
         estado='solicitud',
@@ -111,48 +142,42 @@ Te contactamos para confirmar los detalles."""
             sol.link_whatsapp_remitente = generar_link_whatsapp(sol.remitente_telefono, msg)
 
     return render_template('dashboard.html',
-        total_remesas=total_remesas,
-        remesas_pendientes=remesas_pendientes,
-        remesas_hoy=remesas_hoy,
-        ingresos_mes=ingresos_mes,
-        total_movido_hoy=total_movido_hoy,
         ultimas_remesas=ultimas_remesas,
         tasa_actual=tasa_actual,
-        remesas_sin_pagar=remesas_sin_pagar,
-        monto_sin_pagar=monto_sin_pagar,
-        remesas_pagadas_mes=remesas_pagadas_mes,
-        monto_pagado_mes=monto_pagado_mes,
-        alertas=alertas,
-        solicitudes_pendientes=solicitudes_pendientes
+        solicitudes_pendientes=solicitudes_pendientes,
+        **agregados
     )
 
 
 @remesas_bp.route('/remesas')
 @login_required
 @admin_required
+@con_presupuesto('buscar', 'estado', 'facturada')
 def lista():
     estado = request.args.get('estado', '')
     buscar = request.args.get('buscar', '')
     facturada = request.args.get('facturada', '')
+    pagina = max(request.args.get('pagina', 1, type=int), 1)
 
     query = Remesa.query
 
     if estado:
         query = query.filter_by(estado=estado)
+    ordenada = False
     if buscar:
-        query = query.filter(
-            db.or_(
-                Remesa.codigo.contains(buscar),
-                Remesa.remitente_nombre.contains(buscar),
-                Remesa.beneficiario_nombre.contains(buscar)
-            )
-        )
+        query, ordenada = filtrar_remesas(query, buscar)
     if facturada == 'si':
         query = query.filter_by(facturada=True)
     elif facturada == 'no':
         query = query.filter_by(facturada=False)
 
-    remesas = query.order_by(Remesa.fecha_creacion.desc()).all()
+    # Con busqueda de texto los resultados ya vienen por relevancia
+    if not ordenada:
+        query = query.order_by(Remesa.fecha_creacion.desc())
+    # Una fila de mas para saber si hay pagina siguiente
+    remesas = query.limit(REMESAS_POR_PAGINA + 1).offset((pagina - 1) * REMESAS_POR_PAGINA).all()
+    hay_mas = len(remesas) > REMESAS_POR_PAGINA
+    remesas = remesas[:REMESAS_POR_PAGINA]
     repartidores = Usuario.query.filter_by(rol='repartidor', activo=True).all()
 
     # Calcular alertas
@@ -177,6 +202,8 @@ def lista():
         estado_filtro=estado,
         buscar=buscar,
         facturada_filtro=facturada,
+        pagina=pagina,
+        hay_mas=hay_mas,
         alertas=alertas
     )
 
@@ -184,30 +211,15 @@ def lista():
 @remesas_bp.route('/remesas/nueva', methods=['GET', 'POST'])
 @login_required
 @admin_required
+@idempotente
 def nueva():
     if request.method == 'POST':
         monto_envio = float(request.form.get('monto_envio', 0))
         tipo_entrega = request.form.get('tipo_entrega', 'MN')
-        tasa_mercado = TasaCambio.obtener_tasa_actual()
-
-        if tipo_entrega == 'USD':
-            porcentaje = 5.0
-            fija = 0.0
-            total_comision = monto_envio * (porcentaje / 100)
-        else:
-            porcentaje = 0.0
-            fija = 0.0
-            total_comision = 0.0
-
-        if tipo_entrega == 'USD':
-            monto_entrega = monto_envio
-            moneda_entrega = 'USD'
-            tasa_aplicada = 1.0
-        else:
-            tasa_entrega = float(request.form.get('tasa_entrega', tasa_mercado))
-            monto_entrega = monto_envio * tasa_entrega
-            moneda_entrega = 'CUP'
-            tasa_aplicada = tasa_entrega
+        tasa_entrega = None
+        if tipo_entrega != 'USD':
+            tasa_entrega = float(request.form.get('tasa_entrega', TasaCambio.obtener_tasa_actual()))
+        montos = montos_remesa(monto_envio, tipo_entrega, tasa_entrega)
 
         remesa = Remesa(
             remitente_nombre=request.form.get('remitente_nombre'),
@@ -215,17 +227,9 @@ def nueva():
             beneficiario_nombre=request.form.get('beneficiario_nombre'),
             beneficiario_telefono=request.form.get('beneficiario_telefono'),
             beneficiario_direccion=request.form.get('beneficiario_direccion'),
-            tipo_entrega=tipo_entrega,
-            monto_envio=monto_envio,
-            tasa_cambio=tasa_aplicada,
-            monto_entrega=monto_entrega,
-            moneda_entrega=moneda_entrega,
-            comision_porcentaje=porcentaje,
-            comision_fija=fija,
-            total_comision=total_comision,
-            total_cobrado=monto_envio + total_comision,
             notas=request.form.get('notas'),
-            creado_por=current_user.id
+            creado_por=current_user.id,
+            **montos
         )
 
         repartidor_id = request.form.get('repartidor_id')
@@ -240,13 +244,15 @@ def nueva():
         movimiento = MovimientoContable(
             tipo='ingreso',
             concepto=f'Comision remesa {remesa.codigo}',
-            monto=total_comision,
-            remesa_id=remesa.id,
+            monto=montos['total_comision'],
+            remesa=remesa,
             usuario_id=current_user.id
         )
         db.session.add(movimiento)
+        directorio.registrar_remesa(remesa)
 
         db.session.commit()
+        autocompletar.registrar_remesa(remesa)
 
         # Enviar Push Notification a admins
         try:
@@ -293,10 +299,50 @@ def nueva():
     )
 
 
+@remesas_bp.route('/remesas/importar', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def importar():
+    """Importar remesas desde un archivo CSV"""
+    resumen = None
+    if request.method == 'POST':
+        archivo = request.files.get('archivo')
+        if not archivo or not archivo.filename:
+            flash('Seleccione un archivo CSV', 'error')
+            return redirect(url_for('remesas.importar'))
+
+        try:
+            resumen = importar_remesas(archivo.stream, current_user, TasaCambio.obtener_tasa_actual())
+        except ErrorImportacion as e:
+            flash(f'No se pudo leer el archivo: {e}', 'error')
+            return redirect(url_for('remesas.importar'))
+
+        # Un push por repartidor con todas sus remesas importadas
+        for repartidor_id, ids in resumen['por_repartidor'].items():
+            try:
+                push_remesas_asignadas_lote(repartidor_id, cargar_remesas(ids))
+            except Exception as e:
+                print(f"Error enviando push a repartidor: {e}")
+
+        if resumen['importadas']:
+            flash(f'{resumen["importadas"]} remesas importadas', 'success')
+
+    return render_template('remesas/importar.html',
+        resumen=resumen,
+        obligatorias=COLUMNAS_OBLIGATORIAS,
+        opcionales=COLUMNAS_OPCIONALES,
+        volver=url_for('remesas.lista')
+    )
+
+
 @remesas_bp.route('/remesas/<int:id>')
 @login_required
+@condicional(version_remesa)
 def detalle(id):
-    remesa = Remesa.query.get_or_404(id)
+    # Incluye remesas archivadas
+    remesa = obtener_remesa(id)
+    if not remesa:
+        abort(404)
 
     if not current_user.es_admin() and remesa.repartidor_id != current_user.id:
         flash('No tienes acceso a esta remesa', 'error')
@@ -421,10 +467,134 @@ def desfacturar(id):
     return redirect(url_for('remesas.lista'))
 
 
+# === OPERACIONES MASIVAS ===
+
+def _datos_peticion():
+    """Cuerpo JSON de una operacion masiva; {} si no es un objeto"""
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else {}
+
+
+def _ids_de_peticion(data):
+    """Lista de ids enteros del JSON, o None si no es valida"""
+    ids = data.get('ids', [])
+    if not isinstance(ids, list):
+        return None
+    try:
+        ids = [int(i) for i in ids]
+    except (TypeError, ValueError):
+        return None
+    return ids or None
+
+
+@remesas_bp.route('/remesas/masivo/asignar', methods=['POST'])
+@login_required
+@admin_required
+def asignar_masivo():
+    """
+    Asigna un repartidor a varias remesas en una sola transaccion.
+    Espera JSON: {"ids": [1, 2], "repartidor_id": 5, "notificar_beneficiarios": true}
+    """
+    data = _datos_peticion()
+    ids = _ids_de_peticion(data)
+    if not ids:
+        return jsonify({'error': 'Se requiere lista de ids'}), 400
+
+    try:
+        repartidor = db.session.get(Usuario, int(data.get('repartidor_id') or 0))
+    except (TypeError, ValueError):
+        repartidor = None
+    if not repartidor or repartidor.rol != 'repartidor':
+        return jsonify({'error': 'Repartidor no valido'}), 400
+
+    resultados, asignados = asignar_remesas(ids, repartidor.id)
+    remesas = cargar_remesas(asignados)
+
+    if remesas:
+        # Un solo push y un solo WhatsApp al repartidor por todo el lote
+        try:
+            push_remesas_asignadas_lote(repartidor.id, remesas)
+        except Exception as e:
+            print(f"Error enviando push a repartidor: {e}")
+        notificar_lote_remesas(repartidor, remesas)
+
+        # Un mensaje por beneficiario aunque tenga varias remesas en el lote
+        if data.get('notificar_beneficiarios', True):
+            notificados = set()
+            for remesa in remesas:
+                if remesa.beneficiario_telefono and remesa.beneficiario_telefono not in notificados:
+                    notificados.add(remesa.beneficiario_telefono)
+                    notificar_beneficiario(remesa)
+
+    return jsonify({
+        'resultados': resultados,
+        'procesadas': len(asignados),
+        'mensaje': f'{len(asignados)} remesas asignadas a {repartidor.nombre}'
+    })
+
+
+@remesas_bp.route('/remesas/masivo/facturar', methods=['POST'])
+@login_required
+@admin_required
+def facturar_masivo():
+    """
+    Marca o desmarca varias remesas como pagadas.
+    Espera JSON: {"ids": [1, 2], "facturada": true}
+    """
+    data = _datos_peticion()
+    ids = _ids_de_peticion(data)
+    if not ids:
+        return jsonify({'error': 'Se requiere lista de ids'}), 400
+
+    facturada = bool(data.get('facturada', True))
+    resultados, modificados = facturar_remesas(ids, facturada)
+
+    accion = 'marcadas como pagadas' if facturada else 'desmarcadas como pagadas'
+    return jsonify({
+        'resultados': resultados,
+        'procesadas': len(modificados),
+        'mensaje': f'{len(modificados)} remesas {accion}'
+    })
+
+
+@remesas_bp.route('/remesas/masivo/cancelar', methods=['POST'])
+@login_required
+@admin_required
+def cancelar_masivo():
+    """
+    Cancela varias remesas no entregadas.
+    Espera JSON: {"ids": [1, 2]}
+    """
+    data = _datos_peticion()
+    ids = _ids_de_peticion(data)
+    if not ids:
+        return jsonify({'error': 'Se requiere lista de ids'}), 400
+
+    resultados, cancelados = cancelar_remesas(ids)
+
+    # Un push por repartidor afectado
+    por_repartidor = {}
+    for remesa in cargar_remesas(cancelados):
+        if remesa.repartidor_id:
+            por_repartidor.setdefault(remesa.repartidor_id, []).append(remesa)
+    for repartidor_id, remesas in por_repartidor.items():
+        try:
+            push_remesas_canceladas_lote(repartidor_id, remesas)
+        except Exception as e:
+            print(f"Error enviando push a repartidor: {e}")
+
+    return jsonify({
+        'resultados': resultados,
+        'procesadas': len(cancelados),
+        'mensaje': f'{len(cancelados)} remesas canceladas'
+    })
+
+
 # === RUTAS PARA REPARTIDORES ===
 
 @remesas_bp.route('/mis-entregas')
 @login_required
+@condicional(version_repartidor)
 def mis_entregas():
     remesas = Remesa.query.filter(
         Remesa.repartidor_id == current_user.id,
@@ -437,10 +607,11 @@ def mis_entregas():
 @remesas_bp.route('/historial')
 @login_required
 def historial():
-    remesas = Remesa.query.filter(
-        Remesa.repartidor_id == current_user.id,
-        Remesa.estado.in_(['entregada', 'cancelada'])
-    ).order_by(Remesa.fecha_entrega.desc()).limit(50).all()
+    # Las entregadas y pagadas hace meses estan en el archivo
+    remesas = db.session.query(RemesaHistorica).filter(
+        RemesaHistorica.repartidor_id == current_user.id,
+        RemesaHistorica.estado.in_(['entregada', 'cancelada'])
+    ).order_by(RemesaHistorica.fecha_entrega.desc()).limit(50).all()
 
     return render_template('remesas/historial.html', remesas=remesas)
 
@@ -553,24 +724,8 @@ def buscar_remitentes():
     if len(q) < 2:
         return jsonify([])
 
-    # Buscar remitentes unicos en remesas anteriores
-    remesas = Remesa.query.filter(
-        Remesa.remitente_nombre.ilike(f'%{q}%')
-    ).order_by(Remesa.fecha_creacion.desc()).limit(10).all()
-
-    # Eliminar duplicados manteniendo el mas reciente
-    vistos = set()
-    resultados = []
-    for r in remesas:
-        clave = r.remitente_nombre.lower()
-        if clave not in vistos:
-            vistos.add(clave)
-            resultados.append({
-                'nombre': r.remitente_nombre,
-                'telefono': r.remitente_telefono or ''
-            })
-
-    return jsonify(resultados)
+    # Indice en memoria: sin acentos ni mayusculas, mas recientes primero
+    return jsonify(autocompletar.buscar_remitentes(q))
 
 
 @remesas_bp.route('/api/buscar-beneficiarios')
@@ -581,69 +736,39 @@ def buscar_beneficiarios():
     if len(q) < 2:
         return jsonify([])
 
-    remesas = Remesa.query.filter(
-        Remesa.beneficiario_nombre.ilike(f'%{q}%')
-    ).order_by(Remesa.fecha_creacion.desc()).limit(10).all()
-
-    vistos = set()
-    resultados = []
-    for r in remesas:
-        clave = r.beneficiario_nombre.lower()
-        if clave not in vistos:
-            vistos.add(clave)
-            resultados.append({
-                'nombre': r.beneficiario_nombre,
-                'telefono': r.beneficiario_telefono or '',
-                'direccion': r.beneficiario_direccion or ''
-            })
-
-    return jsonify(resultados)
+    return jsonify(autocompletar.buscar_beneficiarios(q))
 
 
 @remesas_bp.route('/api/listar-remitentes')
 @login_required
 def listar_remitentes():
-    """API para listar todos los remitentes (ultimos 20 unicos)"""
-    remesas = Remesa.query.order_by(Remesa.fecha_creacion.desc()).limit(100).all()
+    """API para listar los remitentes usados mas recientemente (20)"""
+    remitentes = Remitente.query.order_by(Remitente.ultimo_uso.desc()).limit(20).all()
 
-    vistos = set()
-    resultados = []
-    for r in remesas:
-        clave = r.remitente_nombre.lower()
-        if clave not in vistos and len(resultados) < 20:
-            vistos.add(clave)
-            resultados.append({
-                'nombre': r.remitente_nombre,
-                'telefono': r.remitente_telefono or ''
-            })
-
-    return jsonify(resultados)
+    return jsonify([{
+        'nombre': r.nombre,
+        'telefono': r.telefono or ''
+    } for r in remitentes])
 
 
 @remesas_bp.route('/api/listar-beneficiarios')
 @login_required
 def listar_beneficiarios():
-    """API para listar todos los beneficiarios (ultimos 20 unicos)"""
-    remesas = Remesa.query.order_by(Remesa.fecha_creacion.desc()).limit(100).all()
-
-    vistos = set()
-    resultados = []
-    for r in remesas:
-        clave = r.beneficiario_nombre.lower()
-        if clave not in vistos and len(resultados) < 20:
-            vistos.add(clave)
-            resultados.append({
-                'nombre': r.beneficiario_nombre,
-                'telefono': r.beneficiario_telefono or '',
-                'direccion': r.beneficiario_direccion or ''
-            })
+    """API para listar los beneficiarios usados mas recientemente (20)"""
+    beneficiarios = Beneficiario.query.order_by(Beneficiario.ultimo_uso.desc()).limit(20).all()
 
-    return jsonify(resultados)
+    return jsonify([{
+        'nombre': b.nombre,
+        'telefono': b.telefono or '',
+        'direccion': b.direccion or ''
+    } for b in beneficiarios])
 
 
 # === PAGINA PUBLICA DE SEGUIMIENTO ===
 
 @remesas_bp.route('/seguimiento', methods=['GET', 'POST'])
+# El formulario vacio es igual para todos; los resultados (POST) no se cachean
+@condicional(lambda: 'formulario', cache_control='public, max-age=3600')
 def seguimiento():
     """Pagina publica para consultar estado de remesa"""
     remesa = None
@@ -652,7 +777,7 @@ def seguimiento():
     if request.method == 'POST':
         codigo = request.form.get('codigo', '').strip().upper()
         if codigo:
-            remesa = Remesa.query.filter_by(codigo=codigo).first()
+            remesa = buscar_por_codigo(codigo)
             if not remesa:
                 error = 'No se encontro ninguna remesa con ese codigo'
 
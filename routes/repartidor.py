@@ -1,22 +1,47 @@
 """
 Panel simplificado para repartidores
 """
-from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
+from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, abort
 from flask_login import login_required, current_user
-from models import db, Remesa, MovimientoEfectivo
+from models import db, Remesa, MovimientoEfectivo, SubidaFoto
 from notificaciones import enviar_whatsapp, notificar_entrega_admin, generar_link_whatsapp, notificar_admin_cambio_estado
 from push_notifications import push_remesa_entregada_admin
-from datetime import datetime
+from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
-import os
+from cache_http import condicional, version_repartidor
+from sincronizacion import cambios_repartidor
+from idempotencia import idempotente
+from fotos import guardar_foto, FotoInvalida, url_foto
+from archivo import RemesaHistorica
+import subidas
 
 repartidor_bp = Blueprint('repartidor', __name__, url_prefix='/repartidor')
 
-UPLOAD_FOLDER = 'static/fotos_entrega'
+# Acciones encoladas sin conexion (sw.js): se acepta la hora del telefono
+# dentro de este margen hacia atras, y hasta unos minutos de reloj adelantado
+MAX_ATRASO_CLIENTE = timedelta(days=7)
+MAX_ADELANTO_CLIENTE = timedelta(minutes=5)
+
+
+def _fecha_cliente():
+    """
+    Hora en que el repartidor hizo la accion, enviada por la PWA en
+    X-Fecha-Cliente (milisegundos desde epoch). Si falta o no es creible se
+    usa la hora del servidor.
+    """
+    ahora = datetime.now()
+    try:
+        fecha = datetime.fromtimestamp(int(request.headers['X-Fecha-Cliente']) / 1000)
+    except (KeyError, ValueError, OverflowError, OSError):
+        return ahora
+    if ahora - MAX_ATRASO_CLIENTE <= fecha <= ahora + MAX_ADELANTO_CLIENTE:
+        return min(fecha, ahora)
+    return ahora
 
 
 @repartidor_bp.route('/panel')
 @login_required
+@condicional(version_repartidor)
 def panel():
     """Panel principal del repartidor"""
     if current_user.rol != 'repartidor':
@@ -47,8 +72,24 @@ def panel():
                          entregadas_hoy=entregadas_hoy)
 
 
+@repartidor_bp.route('/api/sync')
+@login_required
+def api_sync():
+    """
+    Cambios de las remesas del repartidor desde ?since=<cursor> (ver
+    sincronizacion.py). Sin cursor, o con uno vencido, la lista completa.
+    """
+    if current_user.rol != 'repartidor':
+        return jsonify({'error': 'No autorizado'}), 403
+
+    respuesta = jsonify(cambios_repartidor(current_user.id, request.args.get('since')))
+    respuesta.headers['Cache-Control'] = 'no-store'
+    return respuesta
+
+
 @repartidor_bp.route('/en-camino/<int:id>', methods=['POST'])
 @login_required
+@idempotente
 def marcar_en_camino(id):
     """Marca una remesa como en camino"""
     remesa = Remesa.query.get_or_404(id)
@@ -56,6 +97,12 @@ def marcar_en_camino(id):
     if remesa.repartidor_id != current_user.id:
         return jsonify({'error': 'No autorizado'}), 403
 
+    # Reintento de la cola offline, o llega despues de la entrega: no retroceder
+    if remesa.estado in ('en_proceso', 'entregada'):
+        return jsonify({'success': True, 'repetida': True, 'mensaje': 'Remesa ya estaba en camino'})
+    if remesa.estado == 'cancelada':
+        return jsonify({'error': 'La remesa fue cancelada'}), 409
+
     remesa.estado = 'en_proceso'
     db.session.commit()
 
@@ -79,6 +126,7 @@ Happy Remesitas"""
 
 @repartidor_bp.route('/entregar/<int:id>', methods=['POST'])
 @login_required
+@idempotente
 def marcar_entregada(id):
     """Marca una remesa como entregada"""
     remesa = Remesa.query.get_or_404(id)
@@ -86,17 +134,23 @@ def marcar_entregada(id):
     if remesa.repartidor_id != current_user.id:
         return jsonify({'error': 'No autorizado'}), 403
 
-    # Guardar foto si se envio
+    # Reintento de la cola offline: la entrega ya se registro y el saldo ya se desconto
+    if remesa.estado == 'entregada':
+        return jsonify({'success': True, 'repetida': True, 'mensaje': 'Remesa ya entregada'})
+    if remesa.estado == 'cancelada':
+        return jsonify({'error': 'La remesa fue cancelada'}), 409
+
+    # Guardar foto si se envio (se reduce y se quita el EXIF en segundo plano)
     foto = request.files.get('foto')
     if foto and foto.filename:
-        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-        filename = f"{remesa.codigo}_{datetime.now().strftime('%Y%m%d%H%M%S')}.jpg"
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        foto.save(filepath)
-        remesa.foto_entrega = filename
+        try:
+            remesa.foto_entrega = guardar_foto(foto)
+        except FotoInvalida as e:
+            return jsonify({'error': str(e)}), 400
 
     remesa.estado = 'entregada'
-    remesa.fecha_entrega = datetime.now()
+    # Entregas confirmadas sin conexion conservan la hora real de entrega
+    remesa.fecha_entrega = _fecha_cliente()
 
     # Descontar del saldo del repartidor automaticamente
     monto_entrega = remesa.monto_entrega
@@ -159,6 +213,94 @@ Gracias por usar Happy Remesitas!"""
     })
 
 
+# === Subida reanudable de la foto de entrega (ver subidas.py) ===
+
+def _subida_propia(id):
+    subida = SubidaFoto.query.get_or_404(id)
+    if subida.repartidor_id != current_user.id:
+        abort(404)
+    return subida
+
+
+@repartidor_bp.route('/subidas', methods=['POST'])
+@login_required
+@idempotente
+def crear_subida():
+    """Abre una subida para la foto de una remesa: {"remesa_id", "tamano"}"""
+    datos = request.get_json(silent=True)
+    if not isinstance(datos, dict):
+        return jsonify({'error': 'Cuerpo JSON invalido'}), 400
+    try:
+        remesa = db.session.get(Remesa, int(datos.get('remesa_id') or 0))
+        tamano = int(datos.get('tamano') or 0)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'remesa_id y tamano deben ser numeros'}), 400
+    if not remesa or remesa.repartidor_id != current_user.id:
+        return jsonify({'error': 'No autorizado'}), 403
+    try:
+        subida = subidas.crear_subida(remesa, current_user.id, tamano)
+    except subidas.SubidaInvalida as e:
+        return jsonify({'error': str(e)}), 400
+    db.session.commit()
+
+    respuesta = jsonify({'id': subida.id, 'offset': 0})
+    respuesta.status_code = 201
+    respuesta.headers['Location'] = url_for('repartidor.estado_subida', id=subida.id)
+    return respuesta
+
+
+@repartidor_bp.route('/subidas/<id>', methods=['GET'])
+@login_required
+def estado_subida(id):
+    """Bytes recibidos, para retomar desde ahi"""
+    subida = _subida_propia(id)
+    respuesta = jsonify({'offset': subidas.offset(subida), 'tamano': subida.tamano, 'estado': subida.estado})
+    respuesta.headers['Cache-Control'] = 'no-store'
+    return respuesta
+
+
+@repartidor_bp.route('/subidas/<id>', methods=['PUT'])
+@login_required
+def subir_bloque(id):
+    """Agrega un bloque; la cabecera Upload-Offset indica donde empieza"""
+    subida = _subida_propia(id)
+    try:
+        inicio = int(request.headers['Upload-Offset'])
+        largo = int(request.headers['Content-Length'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Faltan Upload-Offset o Content-Length'}), 400
+    try:
+        nuevo = subidas.escribir_bloque(subida, inicio, request.stream, largo)
+    except subidas.OffsetIncorrecto as e:
+        return jsonify({'error': 'Offset incorrecto', 'offset': e.offset}), 409
+    except subidas.SubidaInvalida as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'offset': nuevo})
+
+
+@repartidor_bp.route('/subidas/<id>/finalizar', methods=['POST'])
+@login_required
+@idempotente
+def finalizar_subida(id):
+    """Pasa la foto a la remesa (se procesa en segundo plano)"""
+    subida = _subida_propia(id)
+    # La remesa pudo borrarse, archivarse o reasignarse durante la subida:
+    # 404/409 sacan la foto de la cola del service worker (un 500 la reintenta)
+    remesa = db.session.get(Remesa, subida.remesa_id)
+    if remesa is None:
+        return jsonify({'error': 'La remesa ya no existe'}), 404
+    if remesa.repartidor_id != current_user.id:
+        return jsonify({'error': 'La remesa ya no esta asignada a este repartidor'}), 409
+    try:
+        nombre = subidas.finalizar(subida, remesa)
+    except subidas.SubidaInvalida as e:
+        return jsonify({'error': str(e), 'offset': subidas.offset(subida)}), 409
+    except FotoInvalida as e:
+        return jsonify({'error': str(e)}), 400
+    db.session.commit()
+    return jsonify({'success': True, 'foto': url_foto(nombre, miniatura=True)})
+
+
 @repartidor_bp.route('/historial')
 @login_required
 def historial():
@@ -166,9 +308,10 @@ def historial():
     if current_user.rol != 'repartidor':
         return redirect(url_for('auth.login'))
 
-    entregas = Remesa.query.filter_by(
-        repartidor_id=current_user.id,
-        estado='entregada'
-    ).order_by(Remesa.fecha_entrega.desc()).limit(50).all()
+    # Las entregadas y pagadas hace meses estan en el archivo
+    entregas = db.session.query(RemesaHistorica).filter(
+        RemesaHistorica.repartidor_id == current_user.id,
+        RemesaHistorica.estado == 'entregada'
+    ).order_by(RemesaHistorica.fecha_entrega.desc()).limit(50).all()
 
     return render_template('repartidor/historial.html', entregas=entregas)
@@ -1,9 +1,14 @@
-from flask import Blueprint, render_template, request
+from flask import Blueprint, render_template, request, redirect, url_for, abort, Response, stream_with_context, jsonify
 from flask_login import login_required, current_user
-from models import db, Remesa, Usuario, MovimientoContable
+from models import db, Remesa, Usuario, MovimientoContable, TrabajoReporte
 from datetime import datetime, timedelta
 from functools import wraps
-from sqlalchemy import func
+from sqlalchemy import func, case, select
+from archivo import RemesaHistorica, MovimientoHistorico
+from exportar import EXPORTACIONES, generar_csv, comprimir_gzip
+from cache_reportes import cacheado
+from trabajos_reporte import resolver, avanzar
+from presupuesto_consultas import con_presupuesto
 
 reportes_bp = Blueprint('reportes', __name__, url_prefix='/reportes')
 
@@ -17,118 +22,145 @@ def admin_required(f):
     return decorated_function
 
 
-@reportes_bp.route('/balance')
-@login_required
-@admin_required
-def balance():
-    # Obtener rango de fechas
-    hoy = datetime.utcnow().date()
-    fecha_inicio = request.args.get('fecha_inicio', (hoy - timedelta(days=30)).isoformat())
-    fecha_fin = request.args.get('fecha_fin', hoy.isoformat())
-
+@cacheado('balance')
+def _agregados_balance(fecha_inicio, fecha_fin):
+    """Totales del balance para un rango (ver cache_reportes.py)"""
     fecha_inicio_dt = datetime.fromisoformat(fecha_inicio)
     fecha_fin_dt = datetime.fromisoformat(fecha_fin) + timedelta(days=1)  # Incluir todo el dia
 
-    # Estadisticas del periodo
-    remesas_periodo = Remesa.query.filter(
-        Remesa.fecha_creacion >= fecha_inicio_dt,
-        Remesa.fecha_creacion < fecha_fin_dt,
-        Remesa.estado != 'cancelada'
-    )
-
-    total_remesas = remesas_periodo.count()
-    total_enviado = db.session.query(func.sum(Remesa.monto_envio)).filter(
-        Remesa.fecha_creacion >= fecha_inicio_dt,
-        Remesa.fecha_creacion < fecha_fin_dt,
-        Remesa.estado != 'cancelada'
-    ).scalar() or 0
-
-    total_comisiones = db.session.query(func.sum(Remesa.total_comision)).filter(
-        Remesa.fecha_creacion >= fecha_inicio_dt,
-        Remesa.fecha_creacion < fecha_fin_dt,
-        Remesa.estado != 'cancelada'
-    ).scalar() or 0
-
-    total_cobrado = db.session.query(func.sum(Remesa.total_cobrado)).filter(
-        Remesa.fecha_creacion >= fecha_inicio_dt,
-        Remesa.fecha_creacion < fecha_fin_dt,
-        Remesa.estado != 'cancelada'
-    ).scalar() or 0
+    # Estadisticas del periodo (una sola pasada)
+    total_remesas, total_enviado, total_comisiones, total_cobrado = db.session.query(
+        func.count(RemesaHistorica.id),
+        func.sum(RemesaHistorica.monto_envio),
+        func.sum(RemesaHistorica.total_comision),
+        func.sum(RemesaHistorica.total_cobrado)
+    ).filter(
+        RemesaHistorica.fecha_creacion >= fecha_inicio_dt,
+        RemesaHistorica.fecha_creacion < fecha_fin_dt,
+        RemesaHistorica.estado != 'cancelada'
+    ).one()
+    avanzar(1, 3)
 
     # Remesas por estado
     por_estado = db.session.query(
-        Remesa.estado,
-        func.count(Remesa.id)
+        RemesaHistorica.estado,
+        func.count(RemesaHistorica.id)
     ).filter(
-        Remesa.fecha_creacion >= fecha_inicio_dt,
-        Remesa.fecha_creacion < fecha_fin_dt
-    ).group_by(Remesa.estado).all()
+        RemesaHistorica.fecha_creacion >= fecha_inicio_dt,
+        RemesaHistorica.fecha_creacion < fecha_fin_dt
+    ).group_by(RemesaHistorica.estado).all()
+    avanzar(2, 3)
 
     # Remesas por dia
     por_dia = db.session.query(
-        func.date(Remesa.fecha_creacion).label('fecha'),
-        func.count(Remesa.id).label('cantidad'),
-        func.sum(Remesa.monto_envio).label('monto'),
-        func.sum(Remesa.total_comision).label('comision')
+        func.date(RemesaHistorica.fecha_creacion).label('fecha'),
+        func.count(RemesaHistorica.id).label('cantidad'),
+        func.sum(RemesaHistorica.monto_envio).label('monto'),
+        func.sum(RemesaHistorica.total_comision).label('comision')
     ).filter(
-        Remesa.fecha_creacion >= fecha_inicio_dt,
-        Remesa.fecha_creacion < fecha_fin_dt,
-        Remesa.estado != 'cancelada'
-    ).group_by(func.date(Remesa.fecha_creacion)).order_by(
-        func.date(Remesa.fecha_creacion).desc()
+        RemesaHistorica.fecha_creacion >= fecha_inicio_dt,
+        RemesaHistorica.fecha_creacion < fecha_fin_dt,
+        RemesaHistorica.estado != 'cancelada'
+    ).group_by(func.date(RemesaHistorica.fecha_creacion)).order_by(
+        func.date(RemesaHistorica.fecha_creacion).desc()
     ).all()
 
+    return {
+        'total_remesas': total_remesas,
+        'total_enviado': total_enviado or 0,
+        'total_comisiones': total_comisiones or 0,
+        'total_cobrado': total_cobrado or 0,
+        'por_estado': dict(por_estado),
+        'por_dia': [fila._asdict() for fila in por_dia]
+    }
+
+
+@reportes_bp.route('/balance')
+@login_required
+@admin_required
+@con_presupuesto('fecha_inicio', 'fecha_fin')
+def balance():
+    # Obtener rango de fechas
+    hoy = datetime.utcnow().date()
+    fecha_inicio = request.args.get('fecha_inicio', (hoy - timedelta(days=30)).isoformat())
+    fecha_fin = request.args.get('fecha_fin', hoy.isoformat())
+
+    datos, trabajo = resolver(_agregados_balance, fecha_inicio, fecha_fin, request.args.get('trabajo'))
+    if trabajo:
+        return _procesando(trabajo, 'Balance')
+
     return render_template('reportes/balance.html',
         fecha_inicio=fecha_inicio,
         fecha_fin=fecha_fin,
-        total_remesas=total_remesas,
-        total_enviado=total_enviado,
-        total_comisiones=total_comisiones,
-        total_cobrado=total_cobrado,
-        por_estado=dict(por_estado),
-        por_dia=por_dia
+        **datos
     )
 
 
+def _procesando(trabajo, titulo):
+    """Pagina de espera mientras el reporte se calcula en segundo plano"""
+    return render_template('reportes/procesando.html', trabajo=trabajo, titulo=titulo), 202
+
+
+@reportes_bp.route('/trabajos/<id>')
+@login_required
+@admin_required
+def trabajo_estado(id):
+    """Avance de un reporte en segundo plano (lo consulta reportes/procesando.html)"""
+    trabajo = db.session.get(TrabajoReporte, id)
+    if trabajo is None:
+        abort(404)
+    respuesta = jsonify({'estado': trabajo.estado, 'progreso': trabajo.progreso, 'error': trabajo.error})
+    respuesta.headers['Cache-Control'] = 'no-store'
+    return respuesta
+
+
+@cacheado('repartidores')
+def _agregados_repartidores(fecha_inicio, fecha_fin):
+    """Remesas y monto entregado por repartidor en un rango, en una consulta agrupada"""
+    fecha_inicio_dt = datetime.fromisoformat(fecha_inicio)
+    fecha_fin_dt = datetime.fromisoformat(fecha_fin) + timedelta(days=1)
+
+    entregada = RemesaHistorica.estado == 'entregada'
+    filas = db.session.query(
+        RemesaHistorica.repartidor_id,
+        func.count(RemesaHistorica.id).label('total'),
+        func.sum(case((entregada, 1), else_=0)).label('entregadas'),
+        func.sum(case((RemesaHistorica.estado.in_(['pendiente', 'en_proceso']), 1), else_=0)).label('pendientes'),
+        func.sum(case((entregada, RemesaHistorica.monto_entrega), else_=0)).label('monto_entregado')
+    ).filter(
+        RemesaHistorica.repartidor_id.isnot(None),
+        RemesaHistorica.fecha_creacion >= fecha_inicio_dt,
+        RemesaHistorica.fecha_creacion < fecha_fin_dt
+    ).group_by(RemesaHistorica.repartidor_id).all()
+    return [fila._asdict() for fila in filas]
+
+
 @reportes_bp.route('/repartidores')
 @login_required
 @admin_required
+@con_presupuesto('fecha_inicio', 'fecha_fin')
 def por_repartidor():
     hoy = datetime.utcnow().date()
     fecha_inicio = request.args.get('fecha_inicio', (hoy - timedelta(days=30)).isoformat())
     fecha_fin = request.args.get('fecha_fin', hoy.isoformat())
 
-    fecha_inicio_dt = datetime.fromisoformat(fecha_inicio)
-    fecha_fin_dt = datetime.fromisoformat(fecha_fin) + timedelta(days=1)
-
     # Estadisticas por repartidor
+    datos, trabajo = resolver(_agregados_repartidores, fecha_inicio, fecha_fin, request.args.get('trabajo'))
+    if trabajo:
+        return _procesando(trabajo, 'Repartidores')
+
     repartidores = Usuario.query.filter_by(rol='repartidor').all()
+    agregados = {fila['repartidor_id']: fila for fila in datos}
 
     stats_repartidores = []
     for rep in repartidores:
-        remesas = Remesa.query.filter(
-            Remesa.repartidor_id == rep.id,
-            Remesa.fecha_creacion >= fecha_inicio_dt,
-            Remesa.fecha_creacion < fecha_fin_dt
-        )
-
-        total = remesas.count()
-        entregadas = remesas.filter_by(estado='entregada').count()
-        pendientes = remesas.filter(Remesa.estado.in_(['pendiente', 'en_proceso'])).count()
-
-        monto_entregado = db.session.query(func.sum(Remesa.monto_entrega)).filter(
-            Remesa.repartidor_id == rep.id,
-            Remesa.estado == 'entregada',
-            Remesa.fecha_creacion >= fecha_inicio_dt,
-            Remesa.fecha_creacion < fecha_fin_dt
-        ).scalar() or 0
-
+        fila = agregados.get(rep.id, {})
         stats_repartidores.append({
             'repartidor': rep,
-            'total': total,
-            'entregadas': entregadas,
-            'pendientes': pendientes,
-            'monto_entregado': monto_entregado
+            'total': fila.get('total', 0),
+            'entregadas': fila.get('entregadas', 0),
+            'pendientes': fila.get('pendientes', 0),
+            'monto_entregado': fila.get('monto_entregado') or 0
         })
 
     return render_template('reportes/repartidores.html',
@@ -138,59 +170,132 @@ def por_repartidor():
     )
 
 
-@reportes_bp.route('/ingresos')
-@login_required
-@admin_required
-def ingresos():
-    hoy = datetime.utcnow().date()
-    fecha_inicio = request.args.get('fecha_inicio', (hoy - timedelta(days=30)).isoformat())
-    fecha_fin = request.args.get('fecha_fin', hoy.isoformat())
-
+@cacheado('ingresos')
+def _agregados_ingresos(fecha_inicio, fecha_fin):
+    """Movimientos contables de un rango con el codigo de su remesa, y sus totales"""
     fecha_inicio_dt = datetime.fromisoformat(fecha_inicio)
     fecha_fin_dt = datetime.fromisoformat(fecha_fin) + timedelta(days=1)
 
     # Movimientos contables
-    movimientos = MovimientoContable.query.filter(
-        MovimientoContable.fecha >= fecha_inicio_dt,
-        MovimientoContable.fecha < fecha_fin_dt
-    ).order_by(MovimientoContable.fecha.desc()).all()
+    movimientos = [fila._asdict() for fila in db.session.query(
+        MovimientoHistorico.fecha,
+        MovimientoHistorico.tipo,
+        MovimientoHistorico.concepto,
+        MovimientoHistorico.monto,
+        MovimientoHistorico.remesa_id
+    ).filter(
+        MovimientoHistorico.fecha >= fecha_inicio_dt,
+        MovimientoHistorico.fecha < fecha_fin_dt
+    ).order_by(MovimientoHistorico.fecha.desc()).all()]
+    avanzar(1, 3)
+
+    # Codigos de las remesas (activas o archivadas), por lotes de ids
+    ids = sorted({m['remesa_id'] for m in movimientos if m['remesa_id']})
+    codigos = {}
+    for i in range(0, len(ids), 500):
+        codigos.update(db.session.execute(
+            select(RemesaHistorica.id, RemesaHistorica.codigo).where(RemesaHistorica.id.in_(ids[i:i + 500]))
+        ).all())
+    for m in movimientos:
+        m['remesa_codigo'] = codigos.get(m['remesa_id'])
+    avanzar(2, 3)
 
     # Totales
-    total_ingresos = db.session.query(func.sum(MovimientoContable.monto)).filter(
-        MovimientoContable.tipo == 'ingreso',
-        MovimientoContable.fecha >= fecha_inicio_dt,
-        MovimientoContable.fecha < fecha_fin_dt
+    total_ingresos = db.session.query(func.sum(MovimientoHistorico.monto)).filter(
+        MovimientoHistorico.tipo == 'ingreso',
+        MovimientoHistorico.fecha >= fecha_inicio_dt,
+        MovimientoHistorico.fecha < fecha_fin_dt
     ).scalar() or 0
 
-    total_egresos = db.session.query(func.sum(MovimientoContable.monto)).filter(
-        MovimientoContable.tipo == 'egreso',
-        MovimientoContable.fecha >= fecha_inicio_dt,
-        MovimientoContable.fecha < fecha_fin_dt
+    total_egresos = db.session.query(func.sum(MovimientoHistorico.monto)).filter(
+        MovimientoHistorico.tipo == 'egreso',
+        MovimientoHistorico.fecha >= fecha_inicio_dt,
+        MovimientoHistorico.fecha < fecha_fin_dt
     ).scalar() or 0
 
+    return {
+        'movimientos': movimientos,
+        'total_ingresos': total_ingresos,
+        'total_egresos': total_egresos,
+        'balance': total_ingresos - total_egresos
+    }
+
+
+@reportes_bp.route('/ingresos')
+@login_required
+@admin_required
+@con_presupuesto('fecha_inicio', 'fecha_fin')
+def ingresos():
+    hoy = datetime.utcnow().date()
+    fecha_inicio = request.args.get('fecha_inicio', (hoy - timedelta(days=30)).isoformat())
+    fecha_fin = request.args.get('fecha_fin', hoy.isoformat())
+
+    datos, trabajo = resolver(_agregados_ingresos, fecha_inicio, fecha_fin, request.args.get('trabajo'))
+    if trabajo:
+        return _procesando(trabajo, 'Ingresos')
+
     return render_template('reportes/ingresos.html',
         fecha_inicio=fecha_inicio,
         fecha_fin=fecha_fin,
-        movimientos=movimientos,
-        total_ingresos=total_ingresos,
-        total_egresos=total_egresos,
-        balance=total_ingresos - total_egresos
+        **datos
     )
 
 
+@cacheado('pagadas')
+def _pagadas_periodo(fecha_inicio, fecha_fin):
+    """Remesas pagadas en un rango y su total"""
+    fecha_inicio_dt = datetime.fromisoformat(fecha_inicio)
+    fecha_fin_dt = datetime.fromisoformat(fecha_fin) + timedelta(days=1)
+
+    pagadas_periodo = db.session.query(
+        RemesaHistorica.codigo,
+        RemesaHistorica.remitente_nombre,
+        RemesaHistorica.beneficiario_nombre,
+        RemesaHistorica.fecha_facturacion,
+        RemesaHistorica.monto_envio,
+        RemesaHistorica.total_cobrado
+    ).filter(
+        RemesaHistorica.facturada == True,
+        RemesaHistorica.fecha_facturacion >= fecha_inicio_dt,
+        RemesaHistorica.fecha_facturacion < fecha_fin_dt
+    ).order_by(RemesaHistorica.fecha_facturacion.desc()).all()
+    avanzar(1, 2)
+
+    total_pagado_periodo = db.session.query(func.sum(RemesaHistorica.total_cobrado)).filter(
+        RemesaHistorica.facturada == True,
+        RemesaHistorica.fecha_facturacion >= fecha_inicio_dt,
+        RemesaHistorica.fecha_facturacion < fecha_fin_dt
+    ).scalar() or 0
+
+    return {
+        'pagadas_periodo': [fila._asdict() for fila in pagadas_periodo],
+        'total_pagado_periodo': total_pagado_periodo
+    }
+
+
+@cacheado('pagado_historico')
+def _total_pagado_historico(desde, hasta):
+    """Total cobrado de todas las remesas pagadas (rango sin limites)"""
+    return db.session.query(func.sum(RemesaHistorica.total_cobrado)).filter(
+        RemesaHistorica.facturada == True
+    ).scalar() or 0
+
+
 @reportes_bp.route('/pagos')
 @login_required
 @admin_required
+@con_presupuesto('fecha_inicio', 'fecha_fin')
 def pagos():
     """Reporte de remesas pagadas vs pendientes de pago"""
     hoy = datetime.utcnow().date()
     fecha_inicio = request.args.get('fecha_inicio', (hoy - timedelta(days=30)).isoformat())
     fecha_fin = request.args.get('fecha_fin', hoy.isoformat())
 
-    fecha_inicio_dt = datetime.fromisoformat(fecha_inicio)
-    fecha_fin_dt = datetime.fromisoformat(fecha_fin) + timedelta(days=1)
+    pagadas, trabajo = resolver(_pagadas_periodo, fecha_inicio, fecha_fin, request.args.get('trabajo'))
+    if trabajo:
+        return _procesando(trabajo, 'Pagos')
 
-    # Remesas sin pagar (entregadas pero no facturadas)
+    # Remesas sin pagar (entregadas pero no facturadas; nunca se archivan): estado actual, sin cache
     sin_pagar = Remesa.query.filter(
         Remesa.facturada == False,
         Remesa.estado == 'entregada'
@@ -201,30 +306,48 @@ def pagos():
         Remesa.estado == 'entregada'
     ).scalar() or 0
 
-    # Remesas pagadas en el periodo
-    pagadas_periodo = Remesa.query.filter(
-        Remesa.facturada == True,
-        Remesa.fecha_facturacion >= fecha_inicio_dt,
-        Remesa.fecha_facturacion < fecha_fin_dt
-    ).order_by(Remesa.fecha_facturacion.desc()).all()
-
-    total_pagado_periodo = db.session.query(func.sum(Remesa.total_cobrado)).filter(
-        Remesa.facturada == True,
-        Remesa.fecha_facturacion >= fecha_inicio_dt,
-        Remesa.fecha_facturacion < fecha_fin_dt
-    ).scalar() or 0
-
     # Totales historicos
-    total_pagado_historico = db.session.query(func.sum(Remesa.total_cobrado)).filter(
-        Remesa.facturada == True
-    ).scalar() or 0
+    total_pagado_historico = _total_pagado_historico()
 
     return render_template('reportes/pagos.html',
         fecha_inicio=fecha_inicio,
         fecha_fin=fecha_fin,
         sin_pagar=sin_pagar,
         total_sin_pagar=total_sin_pagar,
-        pagadas_periodo=pagadas_periodo,
-        total_pagado_periodo=total_pagado_periodo,
+        pagadas_periodo=pagadas['pagadas_periodo'],
+        total_pagado_periodo=pagadas['total_pagado_periodo'],
         total_pagado_historico=total_pagado_historico
     )
+
+
+@reportes_bp.route('/exportar/<nombre>')
+@login_required
+@admin_required
+def exportar(nombre):
+    """
+    Descarga CSV de remesas, movimientos, efectivo o pagos_revendedor.
+    Sin fechas exporta todo el historial. Se envia por streaming y
+    comprimido con gzip si el cliente lo acepta.
+    """
+    if nombre not in EXPORTACIONES:
+        abort(404)
+
+    fecha_inicio = request.args.get('fecha_inicio', '')
+    fecha_fin = request.args.get('fecha_fin', '')
+    try:
+        desde = datetime.fromisoformat(fecha_inicio) if fecha_inicio else None
+        hasta = datetime.fromisoformat(fecha_fin) + timedelta(days=1) if fecha_fin else None
+    except ValueError:
+        abort(400)
+
+    bloques = generar_csv(nombre, desde, hasta)
+    headers = {
+        'Content-Disposition': f'attachment; filename={nombre}_{fecha_inicio or "inicio"}_{fecha_fin or "hoy"}.csv',
+        'Cache-Control': 'no-store',
+        'Vary': 'Accept-Encoding'
+    }
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        bloques = comprimir_gzip(bloques)
+        headers['Content-Encoding'] = 'gzip'
+
+    return Response(stream_with_context(bloques), mimetype='text/csv', headers=headers)
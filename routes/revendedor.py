@@ -1,13 +1,20 @@
 """
 Panel para revendedores
 """
-from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
+from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, abort
 from flask_login import login_required, current_user
 from models import db, Remesa, Usuario, TasaCambio, PagoRevendedor
 from datetime import datetime
 from functools import wraps
-from sqlalchemy import func
+from sqlalchemy import func, case
 from notificaciones import notificar_admin_nueva_remesa, generar_link_whatsapp
+from cuentas_revendedor import calcular_cargo, registrar_cargo, obtener_saldo
+from tarifas import montos_remesa_revendedor
+from archivo import obtener_remesa, RemesaHistorica
+import autocompletar
+import directorio
+from idempotencia import idempotente
+from importacion import importar_remesas, ErrorImportacion, COLUMNAS_OBLIGATORIAS
 
 revendedor_bp = Blueprint('revendedor', __name__, url_prefix='/revendedor')
 
@@ -27,24 +34,18 @@ def revendedor_required(f):
 @revendedor_required
 def panel():
     """Dashboard del revendedor"""
-    # Estadisticas
     mis_remesas = Remesa.query.filter_by(revendedor_id=current_user.id)
 
-    total_remesas = mis_remesas.count()
-    pendientes = mis_remesas.filter_by(estado='pendiente').count()
-    en_proceso = mis_remesas.filter_by(estado='en_proceso').count()
-    entregadas = mis_remesas.filter_by(estado='entregada').count()
-
-    # Montos
-    total_enviado = db.session.query(func.sum(Remesa.monto_envio)).filter(
-        Remesa.revendedor_id == current_user.id,
-        Remesa.estado != 'cancelada'
-    ).scalar() or 0
-
-    total_comision_plataforma = db.session.query(func.sum(Remesa.comision_plataforma)).filter(
-        Remesa.revendedor_id == current_user.id,
-        Remesa.estado != 'cancelada'
-    ).scalar() or 0
+    # Estadisticas y montos de siempre: incluyen las remesas archivadas
+    activa = RemesaHistorica.estado != 'cancelada'
+    total_remesas, pendientes, en_proceso, entregadas, total_enviado, total_comision_plataforma = db.session.query(
+        func.count(RemesaHistorica.id),
+        func.count(case((RemesaHistorica.estado == 'pendiente', 1))),
+        func.count(case((RemesaHistorica.estado == 'en_proceso', 1))),
+        func.count(case((RemesaHistorica.estado == 'entregada', 1))),
+        func.coalesce(func.sum(case((activa, RemesaHistorica.monto_envio))), 0),
+        func.coalesce(func.sum(case((activa, RemesaHistorica.comision_plataforma))), 0)
+    ).filter(RemesaHistorica.revendedor_id == current_user.id).one()
 
     # Ultimas remesas
     ultimas_remesas = mis_remesas.order_by(Remesa.fecha_creacion.desc()).limit(10).all()
@@ -56,7 +57,7 @@ def panel():
                          entregadas=entregadas,
                          total_enviado=total_enviado,
                          total_comision_plataforma=total_comision_plataforma,
-                         saldo_pendiente=current_user.saldo_pendiente,
+                         saldo_pendiente=obtener_saldo(current_user.id),
                          comision=current_user.comision_revendedor,
                          usa_logistica=current_user.usa_logistica,
                          ultimas_remesas=ultimas_remesas)
@@ -65,6 +66,7 @@ def panel():
 @revendedor_bp.route('/nueva', methods=['GET', 'POST'])
 @login_required
 @revendedor_required
+@idempotente
 def nueva_remesa():
     """Crear nueva remesa como revendedor"""
     tasa_usd = TasaCambio.query.filter_by(moneda_origen='USD', activa=True).first()
@@ -83,20 +85,8 @@ def nueva_remesa():
             flash('Complete todos los campos obligatorios', 'error')
             return render_template('revendedor/nueva.html', tasa_actual=tasa_actual)
 
-        # Calcular montos
-        if tipo_entrega == 'USD':
-            # Para USD, el beneficiario recibe lo mismo (sin conversion)
-            monto_entrega = monto_envio
-            moneda_entrega = 'USD'
-            tasa_aplicada = 1.0
-        else:
-            # Para MN, convertir a CUP
-            tasa_aplicada = tasa_actual
-            monto_entrega = monto_envio * tasa_aplicada
-            moneda_entrega = 'CUP'
-
-        # Comision de la plataforma (lo que cobra Happy Remesitas al revendedor)
-        comision_plataforma = monto_envio * (current_user.comision_revendedor / 100)
+        montos = montos_remesa_revendedor(current_user, monto_envio, tipo_entrega, tasa_actual)
+        comision_plataforma = montos['comision_plataforma']
 
         nueva = Remesa(
             remitente_nombre=remitente_nombre,
@@ -104,32 +94,28 @@ def nueva_remesa():
             beneficiario_nombre=beneficiario_nombre,
             beneficiario_telefono=beneficiario_telefono,
             beneficiario_direccion=beneficiario_direccion,
-            tipo_entrega=tipo_entrega,
-            monto_envio=monto_envio,
-            tasa_cambio=tasa_aplicada,
-            monto_entrega=monto_entrega,
-            moneda_entrega=moneda_entrega,
-            comision_plataforma=comision_plataforma,
-            total_cobrado=monto_envio,  # El revendedor cobra lo que quiera a su cliente
             estado='pendiente',
             creado_por=current_user.id,
-            revendedor_id=current_user.id
+            revendedor_id=current_user.id,
+            **montos
         )
 
         db.session.add(nueva)
 
         # Actualizar saldo pendiente del revendedor
+        total_a_pagar = calcular_cargo(current_user, monto_envio, comision_plataforma)
         if current_user.usa_logistica:
             # Usa logistica de Happy Remesitas: paga monto + comision
-            total_a_pagar = monto_envio + comision_plataforma
             mensaje = f'Remesa {nueva.codigo} creada. Debes pagar: ${total_a_pagar:.2f} (${monto_envio:.2f} + ${comision_plataforma:.2f} comision)'
         else:
             # Solo usa plataforma: paga solo comision
-            total_a_pagar = comision_plataforma
             mensaje = f'Remesa {nueva.codigo} creada. Comision plataforma: ${total_a_pagar:.2f}'
 
-        current_user.saldo_pendiente += total_a_pagar
+        # Cargo en el libro + incremento atomico en SQL (sin leer el saldo)
+        registrar_cargo(current_user.id, total_a_pagar, remesa=nueva)
+        directorio.registrar_remesa(nueva)
         db.session.commit()
+        autocompletar.registrar_remesa(nueva)
 
         flash(mensaje, 'success')
 
@@ -161,6 +147,36 @@ Pronto sera entregada."""
                          usa_logistica=current_user.usa_logistica)
 
 
+@revendedor_bp.route('/importar', methods=['GET', 'POST'])
+@login_required
+@revendedor_required
+def importar():
+    """Importar remesas desde un archivo CSV"""
+    resumen = None
+    if request.method == 'POST':
+        archivo = request.files.get('archivo')
+        if not archivo or not archivo.filename:
+            flash('Seleccione un archivo CSV', 'error')
+            return redirect(url_for('revendedor.importar'))
+
+        tasa_usd = TasaCambio.query.filter_by(moneda_origen='USD', activa=True).first()
+        try:
+            resumen = importar_remesas(archivo.stream, current_user, tasa_usd.tasa if tasa_usd else 435)
+        except ErrorImportacion as e:
+            flash(f'No se pudo leer el archivo: {e}', 'error')
+            return redirect(url_for('revendedor.importar'))
+
+        if resumen['importadas']:
+            flash(f'{resumen["importadas"]} remesas importadas', 'success')
+
+    return render_template('remesas/importar.html',
+                         resumen=resumen,
+                         obligatorias=COLUMNAS_OBLIGATORIAS,
+                         opcionales=('remitente_telefono', 'beneficiario_telefono',
+                                     'beneficiario_direccion', 'tipo_entrega', 'notas'),
+                         volver=url_for('revendedor.mis_remesas'))
+
+
 @revendedor_bp.route('/remesas')
 @login_required
 @revendedor_required
@@ -185,7 +201,9 @@ def mis_remesas():
 @revendedor_required
 def detalle_remesa(id):
     """Ver detalle de una remesa"""
-    remesa = Remesa.query.get_or_404(id)
+    remesa = obtener_remesa(id)
+    if not remesa:
+        abort(404)
 
     # Verificar que pertenece al revendedor
     if remesa.revendedor_id != current_user.id:
@@ -209,17 +227,17 @@ def balance():
         PagoRevendedor.revendedor_id == current_user.id
     ).scalar() or 0
 
-    # Comisiones generadas
-    total_comisiones = db.session.query(func.sum(Remesa.comision_plataforma)).filter(
-        Remesa.revendedor_id == current_user.id,
-        Remesa.estado != 'cancelada'
+    # Comisiones generadas (con las remesas archivadas)
+    total_comisiones = db.session.query(func.sum(RemesaHistorica.comision_plataforma)).filter(
+        RemesaHistorica.revendedor_id == current_user.id,
+        RemesaHistorica.estado != 'cancelada'
     ).scalar() or 0
 
     return render_template('revendedor/balance.html',
                          pagos=pagos,
                          total_pagado=total_pagado,
                          total_comisiones=total_comisiones,
-                         saldo_pendiente=current_user.saldo_pendiente)
+                         saldo_pendiente=obtener_saldo(current_user.id))
 
 
 @revendedor_bp.route('/api/calcular', methods=['POST'])
@@ -5,6 +5,7 @@ Actualiza la tasa de cambio automaticamente
 
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.triggers.cron import CronTrigger
 import logging
 
 logger = logging.getLogger(__name__)
@@ -66,6 +67,140 @@ def actualizar_tasa_automatica():
             logger.error(f"Error actualizando tasas: {e}")
 
 
+def conciliar_saldos():
+    """Concilia los saldos de repartidores y revendedores contra sus libros (solo reporta)"""
+    from app import crear_app
+    from conciliacion import conciliar
+
+    app = crear_app()
+    with app.app_context():
+        try:
+            # conciliar() completa antes los cargos historicos del libro
+            resultado = conciliar()
+            for d in resultado['descuadres']:
+                logger.warning(
+                    f"Saldo descuadrado {d['rol']} {d['nombre']} (id {d['usuario_id']}) {d['campo']}: "
+                    f"registrado {d['saldo_registrado']:.2f}, libro {d['saldo_libro']:.2f}"
+                )
+
+        except Exception as e:
+            logger.error(f"Error conciliando saldos: {e}")
+
+
+def cerrar_efectivo_diario():
+    """Crea los cierres de saldo de efectivo de los dias pendientes"""
+    from app import crear_app
+    from libro_efectivo import cerrar_pendientes
+
+    app = crear_app()
+    with app.app_context():
+        try:
+            cerrar_pendientes()
+        except Exception as e:
+            logger.error(f"Error cerrando efectivo del dia: {e}")
+
+
+def archivar_remesas_antiguas():
+    """Mueve al archivo las remesas cerradas con mas de N dias"""
+    from app import crear_app
+    from archivo import archivar_remesas
+
+    app = crear_app()
+    with app.app_context():
+        try:
+            archivar_remesas()
+        except Exception as e:
+            logger.error(f"Error archivando remesas: {e}")
+
+
+def limpiar_bajas_sincronizacion():
+    """Borra las bajas de remesas que ya ningun repartidor necesita sincronizar"""
+    from app import crear_app
+    from sincronizacion import limpiar_bajas
+
+    app = crear_app()
+    with app.app_context():
+        try:
+            limpiar_bajas()
+        except Exception as e:
+            logger.error(f"Error limpiando bajas de sincronizacion: {e}")
+
+
+def limpiar_claves_idempotencia():
+    """Borra las claves de idempotencia vencidas"""
+    from app import crear_app
+    from idempotencia import limpiar_claves
+
+    app = crear_app()
+    with app.app_context():
+        try:
+            limpiar_claves()
+        except Exception as e:
+            logger.error(f"Error limpiando claves de idempotencia: {e}")
+
+
+def procesar_fotos_pendientes():
+    """Procesa fotos de entrega que quedaron sin procesar por un reinicio"""
+    from fotos import procesar_pendientes
+
+    try:
+        procesar_pendientes()
+    except Exception as e:
+        logger.error(f"Error procesando fotos pendientes: {e}")
+
+
+def limpiar_subidas_fotos():
+    """Borra las subidas de fotos que nunca se terminaron"""
+    from app import crear_app
+    from subidas import limpiar_subidas
+
+    app = crear_app()
+    with app.app_context():
+        try:
+            limpiar_subidas()
+        except Exception as e:
+            logger.error(f"Error limpiando subidas de fotos: {e}")
+
+
+def limpiar_eventos_feed():
+    """Borra los eventos del feed en vivo de mas de un dia"""
+    from app import crear_app
+    from eventos import limpiar_eventos
+
+    app = crear_app()
+    with app.app_context():
+        try:
+            limpiar_eventos()
+        except Exception as e:
+            logger.error(f"Error limpiando eventos del feed: {e}")
+
+
+def limpiar_cache_reportes():
+    """Borra los reportes guardados de rangos que incluian el dia"""
+    from app import crear_app
+    from cache_reportes import limpiar_cache
+
+    app = crear_app()
+    with app.app_context():
+        try:
+            limpiar_cache()
+        except Exception as e:
+            logger.error(f"Error limpiando cache de reportes: {e}")
+
+
+def limpiar_trabajos_reporte():
+    """Borra los trabajos de reportes en segundo plano de mas de un dia"""
+    from app import crear_app
+    from trabajos_reporte import limpiar_trabajos
+
+    app = crear_app()
+    with app.app_context():
+        try:
+            limpiar_trabajos()
+        except Exception as e:
+            logger.error(f"Error limpiando trabajos de reportes: {e}")
+
+
 def iniciar_scheduler(app):
     """Inicia el scheduler con las tareas programadas"""
 
@@ -86,6 +221,96 @@ def iniciar_scheduler(app):
         name='Actualizar tasa inicial'
     )
 
+    # Conciliar saldos de repartidores y revendedores contra los libros
+    scheduler.add_job(
+        func=conciliar_saldos,
+        trigger=CronTrigger(hour=0, minute=30),
+        id='conciliar_saldos',
+        name='Conciliar saldos contra libros',
+        replace_existing=True
+    )
+
+    # Cerrar saldos de efectivo del dia anterior (UTC)
+    scheduler.add_job(
+        func=cerrar_efectivo_diario,
+        trigger=CronTrigger(hour=0, minute=10),
+        id='cerrar_efectivo_diario',
+        name='Cierre diario de efectivo',
+        replace_existing=True
+    )
+
+    # Archivar remesas cerradas antiguas, despues de cierres y conciliacion
+    scheduler.add_job(
+        func=archivar_remesas_antiguas,
+        trigger=CronTrigger(hour=1, minute=0),
+        id='archivar_remesas',
+        name='Archivar remesas antiguas',
+        replace_existing=True
+    )
+
+    # Bajas de la sincronizacion de repartidores, despues del archivo
+    scheduler.add_job(
+        func=limpiar_bajas_sincronizacion,
+        trigger=CronTrigger(hour=1, minute=30),
+        id='limpiar_bajas_sincronizacion',
+        name='Limpiar bajas de sincronizacion',
+        replace_existing=True
+    )
+
+    # Claves de idempotencia vencidas (cada hora: la tabla se mantiene chica)
+    scheduler.add_job(
+        func=limpiar_claves_idempotencia,
+        trigger=IntervalTrigger(hours=1),
+        id='limpiar_claves_idempotencia',
+        name='Limpiar claves de idempotencia',
+        replace_existing=True
+    )
+
+    # Fotos de entrega que el pool no llego a procesar
+    scheduler.add_job(
+        func=procesar_fotos_pendientes,
+        trigger=IntervalTrigger(minutes=10),
+        id='procesar_fotos_pendientes',
+        name='Procesar fotos pendientes',
+        replace_existing=True
+    )
+
+    # Subidas de fotos abandonadas
+    scheduler.add_job(
+        func=limpiar_subidas_fotos,
+        trigger=CronTrigger(hour=1, minute=45),
+        id='limpiar_subidas_fotos',
+        name='Limpiar subidas de fotos',
+        replace_existing=True
+    )
+
+    # Eventos del feed en vivo (cada hora: la tabla se mantiene chica)
+    scheduler.add_job(
+        func=limpiar_eventos_feed,
+        trigger=IntervalTrigger(hours=1),
+        id='limpiar_eventos_feed',
+        name='Limpiar eventos del feed',
+        replace_existing=True
+    )
+
+    # Reportes guardados de rangos abiertos (los cerrados se conservan)
+    scheduler.add_job(
+        func=limpiar_cache_reportes,
+        trigger=CronTrigger(hour=2, minute=0),
+        id='limpiar_cache_reportes',
+        name='Limpiar cache de reportes',
+        replace_existing=True
+    )
+
+    # Trabajos de reportes en segundo plano (el resultado queda en cache_reportes)
+    scheduler.add_job(
+        func=limpiar_trabajos_reporte,
+        trigger=CronTrigger(hour=2, minute=15),
+        id='limpiar_trabajos_reporte',
+        name='Limpiar trabajos de reportes',
+        replace_existing=True
+    )
+
     scheduler.start()
     logger.info("Scheduler iniciado - Tasa se actualizara cada 12 horas")
 
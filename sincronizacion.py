@@ -0,0 +1,149 @@
+"""
+Sincronizacion incremental de la PWA del repartidor
+/repartidor/api/sync?since=<cursor> devuelve solo las remesas del repartidor
+que cambiaron desde el cursor (una consulta por el indice
+repartidor_id + actualizado_en) y las que dejo de tener asignadas. La PWA
+guarda una copia local y pregunta con el ultimo cursor: si no cambio nada la
+respuesta es {"c": <cursor>}.
+
+Las remesas reasignadas a otro repartidor o borradas (incluido el archivo)
+ya no aparecen en sus consultas: dos triggers de SQLite las anotan en
+remesas_bajas, asi cualquier UPDATE/DELETE (ORM, bulk o SQL directo) queda
+registrado. Si la base no es SQLite cada sincronizacion es completa.
+"""
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete, text, or_, and_, func
+from sqlalchemy.exc import OperationalError
+from models import db, Remesa, BajaRemesa
+
+logger = logging.getLogger(__name__)
+
+# Orden de los campos de cada fila en la respuesta compacta
+CAMPOS = (
+    'id', 'codigo', 'estado', 'beneficiario_nombre', 'beneficiario_telefono',
+    'beneficiario_direccion', 'monto_entrega', 'moneda_entrega', 'fecha_entrega'
+)
+# Un cursor mas viejo que esto recibe la lista completa (las bajas se borran)
+RETENCION_BAJAS = timedelta(days=7)
+# El cursor no avanza hasta el ultimo instante: una escritura que calcula su
+# hora antes que otra pero hace commit despues no se pierde, a lo sumo se
+# reenvia una vez
+SOLAPE = timedelta(seconds=5)
+
+EPOCA = datetime(1970, 1, 1)
+
+_disponible = None
+
+
+def crear_registro_bajas():
+    """Crea los triggers que llenan remesas_bajas. Seguro de llamar en cada arranque."""
+    global _disponible
+    if db.engine.dialect.name != 'sqlite':
+        _disponible = False
+        return
+
+    ahora = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+    try:
+        with db.engine.begin() as conexion:
+            conexion.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS remesas_baja_reasignar AFTER UPDATE OF repartidor_id ON remesas
+                WHEN old.repartidor_id IS NOT NULL AND old.repartidor_id IS NOT new.repartidor_id BEGIN
+                    INSERT INTO remesas_bajas(remesa_id, repartidor_id, fecha) VALUES (old.id, old.repartidor_id, {ahora});
+                END"""))
+            conexion.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS remesas_baja_eliminar AFTER DELETE ON remesas
+                WHEN old.repartidor_id IS NOT NULL BEGIN
+                    INSERT INTO remesas_bajas(remesa_id, repartidor_id, fecha) VALUES (old.id, old.repartidor_id, {ahora});
+                END"""))
+        _disponible = True
+    except OperationalError as e:
+        logger.warning(f"Registro de bajas no disponible, la sincronizacion sera completa: {e}")
+        _disponible = False
+
+
+def limpiar_bajas():
+    """Borra las bajas mas viejas que RETENCION_BAJAS. Returns: cantidad borrada"""
+    resultado = db.session.execute(
+        delete(BajaRemesa).where(BajaRemesa.fecha < datetime.utcnow() - RETENCION_BAJAS)
+    )
+    db.session.commit()
+    return resultado.rowcount
+
+
+# === Cursor ===
+
+def _a_cursor(fecha):
+    return int((fecha - EPOCA).total_seconds() * 1000)
+
+
+def _de_cursor(valor):
+    """Fecha UTC del cursor, o None si falta o no es valido"""
+    try:
+        return EPOCA + timedelta(milliseconds=int(valor))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def _fila(remesa):
+    fila = [getattr(remesa, c) for c in CAMPOS]
+    if fila[-1]:
+        fila[-1] = _a_cursor(fila[-1])
+    return fila
+
+
+def _columnas():
+    return [getattr(Remesa, c) for c in CAMPOS]
+
+
+# === Consulta ===
+
+def cambios_repartidor(repartidor_id, cursor=None):
+    """
+    Cambios de las remesas de un repartidor desde el cursor.
+
+    Returns:
+        dict compacto: c (cursor nuevo), r (filas en el orden de CAMPOS),
+        b (ids que ya no le pertenecen) y t=1 si es la lista completa que
+        reemplaza la copia local. r y b se omiten si estan vacias.
+    """
+    ahora = datetime.utcnow()
+    limite = ahora - SOLAPE
+    desde = _de_cursor(cursor)
+
+    if not _disponible or desde is None or desde < ahora - RETENCION_BAJAS or desde > ahora:
+        hoy = datetime.now().date()
+        filas = db.session.execute(
+            select(*_columnas()).where(
+                Remesa.repartidor_id == repartidor_id,
+                or_(
+                    Remesa.estado.in_(['pendiente', 'en_proceso']),
+                    and_(Remesa.estado == 'entregada', func.date(Remesa.fecha_entrega) == hoy)
+                )
+            ).order_by(Remesa.id)
+        ).all()
+        respuesta = {'c': _a_cursor(limite), 't': 1}
+        if filas:
+            respuesta['r'] = [_fila(f) for f in filas]
+        return respuesta
+
+    filas = db.session.execute(
+        select(*_columnas(), Remesa.actualizado_en).where(
+            Remesa.repartidor_id == repartidor_id,
+            Remesa.actualizado_en > desde
+        ).order_by(Remesa.actualizado_en)
+    ).all()
+    bajas = db.session.execute(
+        select(BajaRemesa.remesa_id, BajaRemesa.fecha).where(
+            BajaRemesa.repartidor_id == repartidor_id,
+            BajaRemesa.fecha > desde
+        )
+    ).all()
+
+    maximo = max([desde] + [f.actualizado_en for f in filas] + [b.fecha for b in bajas])
+    respuesta = {'c': _a_cursor(max(desde, min(maximo, limite)))}
+    if filas:
+        respuesta['r'] = [_fila(f) for f in filas]
+    if bajas:
+        respuesta['b'] = sorted({b.remesa_id for b in bajas})
+    return respuesta
@@ -1,4 +1,6 @@
 // Service Worker para Happy Remesitas PWA
+// activos.py genera static/dist/sw.js reemplazando CACHE_NAME y urlsToCache
+// con los estaticos con hash; estos valores son los de desarrollo.
 const CACHE_NAME = 'happy-remesitas-v2';
 const urlsToCache = [
   '/static/css/style.css',
@@ -47,14 +49,208 @@ self.addEventListener('activate', event => {
   self.clients.claim();
 });
 
+// === Cola de acciones offline del repartidor ===
+// Las acciones (en camino / entregar) que no llegan al servidor se guardan en
+// IndexedDB y se reenvian con Background Sync, o al volver la conexion si el
+// navegador no lo soporta. Cada accion lleva Idempotency-Key y X-Fecha-Cliente
+// puestos por la pagina: el reenvio es seguro y conserva la hora real.
+// Las fotos de entrega van aparte (store 'fotos', las guarda la pagina) con
+// la subida reanudable de subidas.py: un corte de red retoma desde el
+// ultimo bloque recibido y la entrega no espera a la foto.
+const DB_COLA = 'remesitas-cola';
+const VERSION_COLA = 2;
+const STORE_ACCIONES = 'acciones';
+const STORE_FOTOS = 'fotos';
+const TAG_SYNC = 'acciones-repartidor';
+const URLS_ENCOLABLES = /\/repartidor\/(en-camino|entregar)\/\d+$/;
+const BLOQUE_FOTO = 128 * 1024;
+
+function abrirCola() {
+  return new Promise((resolve, reject) => {
+    const peticion = indexedDB.open(DB_COLA, VERSION_COLA);
+    peticion.onupgradeneeded = () => {
+      const db = peticion.result;
+      if (!db.objectStoreNames.contains(STORE_ACCIONES)) {
+        db.createObjectStore(STORE_ACCIONES, { keyPath: 'id', autoIncrement: true });
+      }
+      if (!db.objectStoreNames.contains(STORE_FOTOS)) {
+        db.createObjectStore(STORE_FOTOS, { keyPath: 'remesa_id' });
+      }
+    };
+    peticion.onsuccess = () => resolve(peticion.result);
+    peticion.onerror = () => reject(peticion.error);
+  });
+}
+
+function transaccion(modo, operacion, nombreStore = STORE_ACCIONES) {
+  return abrirCola().then(db => new Promise((resolve, reject) => {
+    const tx = db.transaction(nombreStore, modo);
+    const resultado = operacion(tx.objectStore(nombreStore));
+    tx.oncomplete = () => resolve(resultado && resultado.result);
+    tx.onerror = () => reject(tx.error);
+  }));
+}
+
+async function encolarAccion(request) {
+  const cabeceras = {};
+  for (const nombre of ['Content-Type', 'Idempotency-Key', 'X-Fecha-Cliente']) {
+    const valor = request.headers.get(nombre);
+    if (valor) cabeceras[nombre] = valor;
+  }
+  // El cuerpo (con la foto si la hay) se guarda tal cual; IndexedDB admite binarios
+  const cuerpo = await request.arrayBuffer();
+  await transaccion('readwrite', store => store.add({
+    url: request.url, cabeceras: cabeceras, cuerpo: cuerpo, encolada: Date.now()
+  }));
+  if (self.registration.sync) {
+    try { await self.registration.sync.register(TAG_SYNC); } catch (e) { /* sin permiso: se reintenta al volver la red */ }
+  }
+}
+
+let sincronizando = null;
+
+function sincronizarCola() {
+  // Una sola sincronizacion a la vez (sync y mensajes 'online' pueden coincidir)
+  if (!sincronizando) {
+    sincronizando = reenviarAcciones().then(subirFotos).then(avisarPaginas).finally(() => { sincronizando = null; });
+  }
+  return sincronizando;
+}
+
+async function reenviarAcciones() {
+  const acciones = await transaccion('readonly', store => store.getAll());
+  let enviadas = 0;
+  for (const accion of acciones) {
+    // Si falla la red se corta aqui y Background Sync reintenta mas tarde
+    const respuesta = await fetch(accion.url, {
+      method: 'POST', headers: accion.cabeceras, body: accion.cuerpo,
+      credentials: 'same-origin', redirect: 'manual'
+    });
+    // Redireccion = sesion vencida; 5xx = error temporal: la accion queda en cola
+    if (respuesta.type === 'opaqueredirect' || respuesta.status >= 500) continue;
+    // 2xx (incluidas las repetidas) o un rechazo definitivo (403/404/409): sale de la cola
+    await transaccion('readwrite', store => store.delete(accion.id));
+    enviadas++;
+  }
+  return enviadas;
+}
+
+async function avisarPaginas(enviadas) {
+  const pendientes = await transaccion('readonly', store => store.count());
+  const fotos = await transaccion('readonly', store => store.count(), STORE_FOTOS);
+  const clientes = await self.clients.matchAll({ type: 'window' });
+  clientes.forEach(cliente => cliente.postMessage({
+    tipo: 'cola-sincronizada', enviadas: enviadas, pendientes: pendientes, fotos: fotos
+  }));
+}
+
+// Sesion vencida (redireccion al login), error del servidor o sin red: se reintenta despues
+async function pedir(url, opciones) {
+  const respuesta = await fetch(url, Object.assign({ credentials: 'same-origin', redirect: 'manual' }, opciones));
+  if (respuesta.type === 'opaqueredirect' || respuesta.status >= 500) throw new Error('reintentar');
+  return respuesta;
+}
+
+async function subirFotos(enviadas) {
+  const fotos = await transaccion('readonly', store => store.getAll(), STORE_FOTOS);
+  for (const foto of fotos) {
+    try {
+      await subirFoto(foto);
+    } catch (e) {
+      break;  // Sin red: Background Sync o el proximo 'online' retoman desde el ultimo bloque
+    }
+  }
+  return enviadas;
+}
+
+async function subirFoto(foto, reintento) {
+  const descartar = () => transaccion('readwrite', store => store.delete(foto.remesa_id), STORE_FOTOS);
+
+  if (!foto.subida) {
+    const r = await pedir('/repartidor/subidas', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', 'Idempotency-Key': foto.clave + '-subida' },
+      body: JSON.stringify({ remesa_id: foto.remesa_id, tamano: foto.archivo.size })
+    });
+    // Remesa ajena o foto invalida: reintentar no lo arregla
+    if (!r.ok) return descartar();
+    foto.subida = (await r.json()).id;
+    await transaccion('readwrite', store => store.put(foto), STORE_FOTOS);
+  }
+
+  const url = '/repartidor/subidas/' + foto.subida;
+  const estado = await pedir(url);
+  if (estado.status === 404 && !reintento) {
+    // La subida vencio en el servidor: se empieza una nueva
+    foto.subida = null;
+    foto.clave = foto.clave + '-r';
+    return subirFoto(foto, true);
+  }
+  if (!estado.ok) return descartar();
+
+  let offset = (await estado.json()).offset;
+  while (offset < foto.archivo.size) {
+    const r = await pedir(url, {
+      method: 'PUT',
+      headers: { 'Upload-Offset': String(offset) },
+      body: foto.archivo.slice(offset, offset + BLOQUE_FOTO)
+    });
+    if (r.status !== 200 && r.status !== 409) return descartar();
+    const nuevo = (await r.json()).offset;
+    if (nuevo === offset) throw new Error('reintentar');  // El bloque no llego: mas tarde
+    offset = nuevo;
+  }
+
+  await pedir(url + '/finalizar', { method: 'POST', headers: { 'Idempotency-Key': foto.clave + '-finalizar' } });
+  return descartar();
+}
+
+self.addEventListener('sync', event => {
+  if (event.tag === TAG_SYNC) {
+    event.waitUntil(sincronizarCola());
+  }
+});
+
+self.addEventListener('message', event => {
+  if (event.data && event.data.tipo === 'sincronizar-cola') {
+    event.waitUntil(sincronizarCola().catch(() => {}));
+  }
+});
+
 // Interceptar peticiones
 self.addEventListener('fetch', event => {
+  // Acciones del repartidor: si no hay red se encolan y se responde que quedo pendiente
+  if (event.request.method === 'POST' && URLS_ENCOLABLES.test(new URL(event.request.url).pathname)) {
+    const copia = event.request.clone();
+    event.respondWith(
+      fetch(event.request).catch(() => encolarAccion(copia).then(() => new Response(
+        JSON.stringify({ success: true, encolada: true, mensaje: 'Sin conexion: se enviara al reconectar' }),
+        { headers: { 'Content-Type': 'application/json' } }
+      )))
+    );
+    return;
+  }
+
   // Solo cachear GET requests
   if (event.request.method !== 'GET') return;
 
   // No cachear APIs
   if (event.request.url.includes('/api/')) return;
 
+  // Estaticos con hash: el contenido de una URL nunca cambia, no hace falta revalidar
+  if (event.request.url.includes('/activos/')) {
+    event.respondWith(
+      caches.match(event.request).then(response => response || fetch(event.request).then(networkResponse => {
+        if (networkResponse && networkResponse.status === 200) {
+          const responseToCache = networkResponse.clone();
+          caches.open(CACHE_NAME).then(cache => cache.put(event.request, responseToCache));
+        }
+        return networkResponse;
+      }))
+    );
+    return;
+  }
+
   event.respondWith(
     caches.match(event.request)
       .then(response => {
@@ -0,0 +1,144 @@
+"""
+Subidas reanudables de fotos de entrega
+Con datos moviles una foto que se corta al 90% no vuelve a empezar de cero:
+
+    POST /repartidor/subidas              {"remesa_id": 5, "tamano": 183211}
+                                          -> {"id": "...", "offset": 0}
+    PUT  /repartidor/subidas/<id>         Upload-Offset: 0, cuerpo = bloque
+                                          -> {"offset": 131072}
+    GET  /repartidor/subidas/<id>         -> {"offset": 131072, "tamano": 183211}
+    POST /repartidor/subidas/<id>/finalizar
+
+Los bloques se agregan a static/fotos_entrega/pendientes/subida-<id>.part; el
+tamano del archivo es el offset, asi sobrevive a reinicios. Un PUT con otro
+offset (reintento de un bloque que si llego) recibe 409 con el offset real.
+Al finalizar la foto pasa a fotos.py y queda en la remesa: la entrega se
+confirma aparte y no espera a la foto.
+"""
+import os
+import uuid
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete
+from models import db, SubidaFoto
+import fotos
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAX_BLOQUE = 1024 * 1024
+BLOQUE_LECTURA = 64 * 1024
+# Subidas sin terminar se descartan despues de esto
+RETENCION = timedelta(days=2)
+
+
+class SubidaInvalida(ValueError):
+    """Tamano o bloque fuera de rango, o subida incompleta al finalizar"""
+
+
+class OffsetIncorrecto(Exception):
+    """El bloque no empieza donde termina lo recibido"""
+
+    def __init__(self, offset):
+        super().__init__(f'Offset esperado: {offset}')
+        self.offset = offset
+
+
+def _ruta(subida):
+    return os.path.join(fotos.PENDIENTES, f'subida-{subida.id}.part')
+
+
+def crear_subida(remesa, repartidor_id, tamano):
+    """Abre una subida para la foto de una remesa. Sin commit."""
+    if not 0 < tamano <= fotos.MAX_BYTES:
+        raise SubidaInvalida(f'La foto debe pesar entre 1 byte y {fotos.MAX_BYTES // (1024 * 1024)} MB')
+    subida = SubidaFoto(id=uuid.uuid4().hex, remesa_id=remesa.id, repartidor_id=repartidor_id, tamano=tamano)
+    db.session.add(subida)
+    os.makedirs(fotos.PENDIENTES, exist_ok=True)
+    open(_ruta(subida), 'wb').close()
+    return subida
+
+
+def offset(subida):
+    """Bytes recibidos hasta ahora"""
+    if subida.estado == 'completa':
+        return subida.tamano
+    try:
+        return os.path.getsize(_ruta(subida))
+    except OSError:
+        return 0
+
+
+def escribir_bloque(subida, inicio, stream, largo):
+    """
+    Agrega un bloque leido de stream en la posicion inicio.
+
+    Returns:
+        Offset nuevo
+
+    Raises:
+        OffsetIncorrecto: si inicio no es lo recibido hasta ahora
+        SubidaInvalida: si el bloque es muy grande o se pasa del tamano anunciado
+    """
+    if subida.estado == 'completa':
+        raise OffsetIncorrecto(subida.tamano)
+    if largo > MAX_BLOQUE:
+        raise SubidaInvalida(f'El bloque supera {MAX_BLOQUE} bytes')
+
+    with open(_ruta(subida), 'ab') as archivo:
+        # Dos reintentos del mismo bloque a la vez no deben escribirse dos veces
+        if fcntl:
+            fcntl.flock(archivo, fcntl.LOCK_EX)
+        actual = archivo.seek(0, os.SEEK_END)
+        if inicio != actual:
+            raise OffsetIncorrecto(actual)
+        if actual + largo > subida.tamano:
+            raise SubidaInvalida('El bloque se pasa del tamano de la foto')
+        # Si la conexion se corta a mitad del bloque lo recibido queda: se sigue desde ahi
+        restante = largo
+        while restante:
+            datos = stream.read(min(BLOQUE_LECTURA, restante))
+            if not datos:
+                break
+            archivo.write(datos)
+            restante -= len(datos)
+        archivo.flush()
+        return archivo.tell()
+
+
+def finalizar(subida, remesa):
+    """
+    Pasa la foto completa a fotos.py y la asigna a la remesa. Sin commit.
+    Repetir la llamada no hace nada.
+
+    Returns:
+        Nombre de la foto (Remesa.foto_entrega)
+    """
+    if subida.estado == 'completa':
+        return subida.foto
+    recibido = offset(subida)
+    if recibido != subida.tamano:
+        raise SubidaInvalida(f'Faltan {subida.tamano - recibido} bytes')
+
+    subida.foto = fotos.guardar_archivo(_ruta(subida))
+    subida.estado = 'completa'
+    remesa.foto_entrega = subida.foto
+    return subida.foto
+
+
+def limpiar_subidas():
+    """Borra las subidas (y sus bloques) con mas de RETENCION. Returns: cantidad"""
+    limite = datetime.utcnow() - RETENCION
+    viejas = db.session.execute(select(SubidaFoto).where(SubidaFoto.creada < limite)).scalars().all()
+    for subida in viejas:
+        if os.path.exists(_ruta(subida)):
+            os.remove(_ruta(subida))
+    db.session.execute(delete(SubidaFoto).where(SubidaFoto.creada < limite))
+    db.session.commit()
+    if viejas:
+        logger.info(f"Subidas de fotos vencidas borradas: {len(viejas)}")
+    return len(viejas)
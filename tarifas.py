@@ -0,0 +1,68 @@
+"""
+Reglas de precio de las remesas
+Calculan los montos de una remesa a partir del monto enviado y el tipo de
+entrega. Las usan la creacion individual y la importacion masiva, asi
+ambas cobran exactamente lo mismo.
+"""
+
+# Comision que cobra la casa en entregas USD creadas por el admin
+PORCENTAJE_COMISION_USD = 5.0
+
+
+def _entrega(monto_envio, tipo_entrega, tasa):
+    """Monto, moneda y tasa de la entrega: USD sin conversion, MN a la tasa dada"""
+    if tipo_entrega == 'USD':
+        return monto_envio, 'USD', 1.0
+    return monto_envio * tasa, 'CUP', tasa
+
+
+def montos_remesa(monto_envio, tipo_entrega, tasa_entrega=None):
+    """
+    Montos de una remesa creada por el admin.
+    USD cobra PORCENTAJE_COMISION_USD, MN no lleva comision.
+
+    Returns:
+        dict con los campos de precio de Remesa
+    """
+    if tipo_entrega == 'USD':
+        porcentaje = PORCENTAJE_COMISION_USD
+        total_comision = monto_envio * (porcentaje / 100)
+    else:
+        porcentaje = 0.0
+        total_comision = 0.0
+
+    monto_entrega, moneda_entrega, tasa_aplicada = _entrega(monto_envio, tipo_entrega, tasa_entrega)
+
+    return {
+        'tipo_entrega': tipo_entrega,
+        'monto_envio': monto_envio,
+        'tasa_cambio': tasa_aplicada,
+        'monto_entrega': monto_entrega,
+        'moneda_entrega': moneda_entrega,
+        'comision_porcentaje': porcentaje,
+        'comision_fija': 0.0,
+        'total_comision': total_comision,
+        'total_cobrado': monto_envio + total_comision
+    }
+
+
+def montos_remesa_revendedor(revendedor, monto_envio, tipo_entrega, tasa):
+    """
+    Montos de una remesa creada por un revendedor.
+    La plataforma cobra comision_revendedor % al revendedor; lo que este
+    cobre a su cliente no se registra (total_cobrado = monto_envio).
+
+    Returns:
+        dict con los campos de precio de Remesa
+    """
+    monto_entrega, moneda_entrega, tasa_aplicada = _entrega(monto_envio, tipo_entrega, tasa)
+
+    return {
+        'tipo_entrega': tipo_entrega,
+        'monto_envio': monto_envio,
+        'tasa_cambio': tasa_aplicada,
+        'monto_entrega': monto_entrega,
+        'moneda_entrega': moneda_entrega,
+        'comision_plataforma': monto_envio * (revendedor.comision_revendedor / 100),
+        'total_cobrado': monto_envio
+    }
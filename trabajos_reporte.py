@@ -0,0 +1,162 @@
+"""
+Reportes grandes en segundo plano
+Un balance de dos anos hace sus agregados sobre toda la historia: dentro de
+la solicitud puede pasar el timeout de PythonAnywhere y mientras tanto ocupa
+un worker que deberia atender a los repartidores.
+
+Si el rango pasa de UMBRAL_DIAS y el reporte no esta guardado en
+cache_reportes, resolver() no lo calcula: crea un trabajo (tabla
+trabajos_reporte) y lo pasa a un pool de un solo hilo, fuera de la
+solicitud. La pagina muestra el avance consultando
+/reportes/trabajos/<id> y al terminar vuelve a pedirse con ?trabajo=<id>:
+el resultado ya esta en cache_reportes y se muestra enseguida.
+
+Un trabajo por (reporte, rango, version): si varios admins piden lo mismo
+esperan al mismo trabajo. Los trabajos de un proceso que se reinicio quedan
+en curso; pasado MAX_DURACION se vuelven a lanzar.
+Sin cache de reportes (base que no es SQLite) se calcula como siempre.
+"""
+import contextvars
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, update, delete
+from sqlalchemy.exc import IntegrityError
+from models import db, TrabajoReporte
+import cache_reportes
+
+logger = logging.getLogger(__name__)
+
+# Rangos mas largos que esto se calculan en segundo plano
+UMBRAL_DIAS = 120
+# Un hilo: los reportes largos nunca compiten entre si por la base
+HILOS = 1
+# Un trabajo en curso mas viejo que esto murio con su proceso
+MAX_DURACION = timedelta(minutes=15)
+RETENCION = timedelta(days=1)
+
+_pool = None
+_pool_lock = threading.Lock()
+_trabajo_actual = contextvars.ContextVar('trabajo_reporte', default=None)
+
+
+def _encolar(app, id, funcion, desde, hasta):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=HILOS, thread_name_prefix='reportes')
+    _pool.submit(_ejecutar, app, id, funcion, desde, hasta)
+
+
+def _actualizar(id, **valores):
+    """Estado del trabajo en su propia transaccion, visible enseguida para quien consulta"""
+    with db.engine.begin() as conexion:
+        conexion.execute(update(TrabajoReporte).where(TrabajoReporte.id == id).values(**valores))
+
+
+def _ejecutar(app, id, funcion, desde, hasta):
+    with app.app_context():
+        marca = _trabajo_actual.set(id)
+        try:
+            _actualizar(id, estado='en_curso', progreso=0)
+            # La funcion cacheada guarda el resultado en cache_reportes
+            funcion(desde, hasta)
+            _actualizar(id, estado='completo', progreso=100, terminado=datetime.utcnow())
+        except Exception as e:
+            logger.exception(f"Error en el reporte {funcion.reporte} {desde}..{hasta}")
+            try:
+                _actualizar(id, estado='error', error=str(e)[:500], terminado=datetime.utcnow())
+            except Exception:
+                logger.exception(f"No se pudo marcar el trabajo {id} con error")
+        finally:
+            _trabajo_actual.reset(marca)
+
+
+def avanzar(hecho, total):
+    """Informa el avance de un reporte (pasos hechos de total). Fuera de un trabajo no hace nada."""
+    id = _trabajo_actual.get()
+    if id is None:
+        return
+    try:
+        _actualizar(id, progreso=min(99, int(100 * hecho / total)))
+    except Exception as e:
+        # El avance es informativo: nunca corta el reporte
+        logger.warning(f"No se pudo guardar el avance del trabajo {id}: {e}")
+
+
+def _largo(desde, hasta):
+    if not desde:
+        return True
+    fin = datetime.fromisoformat(hasta) if hasta else datetime.utcnow()
+    return (fin - datetime.fromisoformat(desde)).days > UMBRAL_DIAS
+
+
+def _lanzar(funcion, desde, hasta):
+    """Trabajo en curso o nuevo para el reporte y rango con la version actual de los datos"""
+    version = cache_reportes.version_rango(desde, hasta)
+    clave = (TrabajoReporte.reporte == funcion.reporte, TrabajoReporte.desde == desde,
+             TrabajoReporte.hasta == hasta, TrabajoReporte.version == version)
+    trabajo = db.session.execute(select(TrabajoReporte).where(*clave)).scalar_one_or_none()
+    if trabajo is None:
+        trabajo = TrabajoReporte(id=uuid.uuid4().hex, reporte=funcion.reporte, desde=desde,
+                                 hasta=hasta, version=version)
+        db.session.add(trabajo)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Otro proceso lo creo al mismo tiempo: se espera ese
+            db.session.rollback()
+            return db.session.execute(select(TrabajoReporte).where(*clave)).scalar_one()
+    elif trabajo.estado in ('pendiente', 'en_curso') and trabajo.creado > datetime.utcnow() - MAX_DURACION:
+        return trabajo
+    else:
+        # Fallo, quedo de un proceso que ya no existe o termino sin poder guardar
+        # el resultado: se vuelve a lanzar (si el resultado si esta, sale del cache)
+        trabajo.estado, trabajo.progreso, trabajo.error = 'pendiente', 0, None
+        trabajo.creado, trabajo.terminado = datetime.utcnow(), None
+        db.session.commit()
+
+    _encolar(current_app._get_current_object(), trabajo.id, funcion, desde, hasta)
+    return trabajo
+
+
+def resolver(funcion, desde, hasta, trabajo_id=None):
+    """
+    Datos de un reporte @cacheado, o el trabajo que los esta calculando.
+
+    Args:
+        funcion: funcion decorada con cache_reportes.cacheado
+        trabajo_id: trabajo ya terminado para este rango (?trabajo=): se
+                    muestra su resultado aunque los datos hayan cambiado despues
+
+    Returns:
+        (datos, None) o (None, TrabajoReporte)
+    """
+    if not cache_reportes.disponible() or not _largo(desde, hasta):
+        return funcion(desde, hasta), None
+
+    datos = funcion.guardado(desde, hasta)
+    if datos is not None:
+        return datos, None
+
+    if trabajo_id:
+        terminado = db.session.get(TrabajoReporte, trabajo_id)
+        if terminado and terminado.estado == 'completo' and \
+                (terminado.reporte, terminado.desde, terminado.hasta) == (funcion.reporte, desde, hasta):
+            datos = funcion.guardado(desde, hasta, vigente=False)
+            if datos is not None:
+                return datos, None
+
+    return None, _lanzar(funcion, desde, hasta)
+
+
+def limpiar_trabajos():
+    """Borra los trabajos con mas de RETENCION. Returns: cantidad borrada"""
+    resultado = db.session.execute(
+        delete(TrabajoReporte).where(TrabajoReporte.creado < datetime.utcnow() - RETENCION)
+    )
+    db.session.commit()
+    return resultado.rowcount
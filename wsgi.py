@@ -9,8 +9,20 @@ if project_home not in sys.path:
 
 # Configurar variable de entorno para produccion
 os.environ['FLASK_ENV'] = 'production'
+# Los workers de PythonAnywhere atienden una solicitud a la vez: un stream SSE
+# abierto dejaria al worker ocupado. El feed en vivo se consulta cada tanto
+os.environ.setdefault('EVENTOS_EN_VIVO', '0')
+
+# Generar los estaticos con hash antes de crear la app (lee su manifiesto)
+import activos
+activos.construir()
 
 # Importar la aplicacion
 from app import crear_app
 
 application = crear_app()
+
+# Construir el indice de autocompletar al arrancar y no en la primera busqueda
+import autocompletar
+with application.app_context():
+    autocompletar.construir()